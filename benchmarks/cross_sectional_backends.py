@@ -0,0 +1,52 @@
+"""
+Times the duckdb and numpy backends of factorize, rank and ntile on random panels of increasing size.
+The results are used to pick NUMPY_BACKEND_MAX_CELLS in toolbox/utils/utils.py
+
+python benchmarks/cross_sectional_backends.py
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from toolbox.utils.utils import factorize, rank, ntile
+
+# (dates, symbols, columns)
+SIZES = [(250, 100, 5), (250, 500, 20), (1000, 500, 20), (1000, 1000, 50)]
+
+
+def make_panel(dates: int, symbols: int, columns: int) -> pd.DataFrame:
+    index = pd.MultiIndex.from_product([pd.date_range('2000-01-01', periods=dates),
+                                        [f'S{i}' for i in range(symbols)]], names=['date', 'symbol'])
+    values = np.random.default_rng(0).normal(size=(len(index), columns))
+    return pd.DataFrame(values, index=index, columns=[f'f{i}' for i in range(columns)])
+
+
+def best_time(func, repeat: int = 2) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    rows = []
+    for dates, symbols, columns in SIZES:
+        df = make_panel(dates, symbols, columns)
+        for name, func in [('factorize', lambda b: factorize(df, ['date'], ['symbol'], backend=b)),
+                           ('rank', lambda b: rank(df, ['date'], ['symbol'], backend=b)),
+                           ('ntile', lambda b: ntile(df, 5, ['date'], ['symbol'], backend=b))]:
+            row = {'cells': df.size, 'rows': len(df), 'columns': columns, 'func': name}
+            for backend in ['duckdb', 'numpy']:
+                row[backend] = best_time(lambda: func(backend))
+            row['winner'] = 'numpy' if row['numpy'] < row['duckdb'] else 'duckdb'
+            rows.append(row)
+            print(row)
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,12 @@
 # constitutes
 from .constitutes.constitute_adjustment import ConstituteAdjustment
+from .constitutes.membership_store import MembershipStore
 
 # utils
 from .utils.format_data_alphalens import price_format_for_alphalens, factor_format_for_alphalens
 from .utils.ml_factor_calculation import calc_ml_factor
 from .utils.ml_factor_calculation import ModelWrapper
-from .utils.utils import factorize, rank, ntile
+from .utils.utils import factorize, rank, ntile, cross_sectional, cross_sectional_to_parquet
 
 # db functions
 from .db.read.query_constructor import QueryConstructor
@@ -20,6 +21,7 @@ from .db.read.universe import (ETFUniverse,
 
 __all__ = [
     'ConstituteAdjustment',
+    'MembershipStore',
     'price_format_for_alphalens',
     'factor_format_for_alphalens',
     'calc_ml_factor',
@@ -27,6 +29,8 @@ __all__ = [
     'factorize',
     'rank',
     'ntile',
+    'cross_sectional',
+    'cross_sectional_to_parquet',
     'QueryConstructor',
     'SQLConnection',
     'table_info',
@@ -0,0 +1,196 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class CompactMembership:
+    """
+    Integer coded membership of a universe.
+    Dates are ordinals into a shared calendar, assets are codes into a dictionary of asset ids and membership is held
+    as spells: asset code, first ordinal and one past the last ordinal. A spell of 10 years costs 12 bytes rather than
+    2500 (Timestamp, id) tuples
+    """
+
+    def __init__(self, calendar: pd.DatetimeIndex, assets: pd.Index, codes: np.ndarray, starts: np.ndarray,
+                 stops: np.ndarray, id_col: str):
+        """
+        :param calendar: sorted unique dates the spells are positions in
+        :param assets: unique asset ids the codes are positions in
+        :param codes: the asset code of each spell
+        :param starts: the ordinal of the first date of each spell
+        :param stops: one past the ordinal of the last date of each spell
+        :param id_col: the name of the asset identifier
+        """
+        self._calendar = calendar
+        self._assets = assets
+        self._codes = np.asarray(codes, dtype=np.int32)
+        self._starts = np.asarray(starts, dtype=np.int32)
+        self._stops = np.maximum(np.asarray(stops, dtype=np.int32), self._starts)
+        self._id_col = id_col
+
+    @classmethod
+    def from_spells(cls, calendar: pd.DatetimeIndex, ids: np.ndarray, starts: np.ndarray, stops: np.ndarray,
+                    id_col: str) -> 'CompactMembership':
+        """
+        makes the membership from spells of calendar positions, spell i covers calendar[starts[i]: stops[i]]
+        :param calendar: sorted unique dates
+        :param ids: the asset of each spell
+        :param starts: the position in the calendar of the first date of each spell
+        :param stops: one past the position in the calendar of the last date of each spell
+        :param id_col: the name of the asset identifier
+        """
+        codes, assets = pd.factorize(np.asarray(ids))
+        return cls(calendar, pd.Index(assets), codes, starts, stops, id_col)
+
+    @classmethod
+    def from_index(cls, index: pd.MultiIndex, id_col: str) -> 'CompactMembership':
+        """
+        makes the membership from a MultiIndex of (date, id), consecutive calendar dates of an asset become one spell
+        the calendar is every date in the index
+        :param index: MultiIndex with the levels date, id
+        :param id_col: the name of the asset identifier
+        """
+        dates = pd.DatetimeIndex(index.get_level_values(0))
+        calendar = dates.unique().dropna().sort_values()
+
+        ordinals = calendar.get_indexer(dates)
+        codes, assets = pd.factorize(index.get_level_values(1), sort=True)
+
+        keep = (ordinals >= 0) & (codes >= 0)
+        ordinals, codes = ordinals[keep], codes[keep]
+
+        order = np.lexsort((ordinals, codes))
+        ordinals, codes = ordinals[order], codes[order]
+
+        # dropping duplicate pairs
+        unique = np.ones(len(codes), dtype=bool)
+        unique[1:] = (codes[1:] != codes[:-1]) | (ordinals[1:] != ordinals[:-1])
+        ordinals, codes = ordinals[unique], codes[unique]
+
+        # a new spell starts when the asset changes or a date in the calendar is skipped
+        new_spell = np.ones(len(codes), dtype=bool)
+        new_spell[1:] = (codes[1:] != codes[:-1]) | (ordinals[1:] != ordinals[:-1] + 1)
+        spell_starts = np.flatnonzero(new_spell)
+        spell_ends = np.append(spell_starts[1:], len(codes)) - 1
+
+        return cls(calendar, pd.Index(assets), codes[spell_starts], ordinals[spell_starts],
+                   ordinals[spell_ends] + 1, id_col)
+
+    @property
+    def calendar(self) -> pd.DatetimeIndex:
+        return self._calendar
+
+    @property
+    def assets(self) -> pd.Index:
+        return self._assets
+
+    @property
+    def id_col(self) -> str:
+        return self._id_col
+
+    @property
+    def spells(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: the asset codes, first date ordinals and one past the last date ordinals of the spells
+        """
+        return self._codes, self._starts, self._stops
+
+    def with_assets(self, assets: pd.Index) -> 'CompactMembership':
+        """
+        recodes the spells into another dictionary of asset ids, lets many memberships share one dictionary
+        :param assets: unique asset ids, must contain every asset of this membership
+        :return: the same membership coded into assets
+        """
+        recode = assets.get_indexer(self._assets)
+        if (recode < 0).any():
+            raise ValueError('assets is missing assets of the membership')
+
+        return CompactMembership(self._calendar, assets, recode[self._codes], self._starts, self._stops,
+                                 self._id_col)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: the memory used by the spells and the calendar, not counting the asset ids
+        """
+        return self._codes.nbytes + self._starts.nbytes + self._stops.nbytes + self._calendar.nbytes
+
+    def __len__(self) -> int:
+        """
+        :return: the amount of (date, id) pairs in the membership
+        """
+        return int((self._stops - self._starts).sum())
+
+    def expand(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        expands the spells into every (date ordinal, asset code) pair, ordered by spell then date
+        :return: date ordinals, asset codes
+        """
+        lengths = self._stops - self._starts
+        offsets = np.cumsum(lengths) - lengths
+        ordinals = np.arange(lengths.sum()) - np.repeat(offsets - self._starts, lengths)
+
+        return ordinals, np.repeat(self._codes, lengths)
+
+    def to_index(self) -> pd.MultiIndex:
+        """
+        :return: MultiIndex of every (date, id) pair, ordered by spell then date
+        """
+        ordinals, codes = self.expand()
+        return pd.MultiIndex.from_arrays([self._calendar[ordinals], self._assets[codes]],
+                                         names=['date', self._id_col])
+
+    def reindex(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        left joins data onto the membership, every member (date, id) gets a row, NaN where data has no row
+        data is matched on the codes so the (Timestamp, id) tuples are never built
+        :param data: frame with the columns date, id_col, dates with a tz are matched in UTC
+        :return: frame with the columns date (no tz), id_col and the other columns of data,
+            integer and bool columns with missing rows become nullable the same as a left join in duckdb
+        """
+        calendar = _without_tz(self._calendar)
+
+        data_ordinals = calendar.get_indexer(_without_tz(pd.DatetimeIndex(data['date'])))
+        data_codes = self._assets.get_indexer(data[self._id_col])
+
+        n_assets = max(len(self._assets), 1)
+        in_membership = np.flatnonzero((data_ordinals >= 0) & (data_codes >= 0))
+        data_keys = data_ordinals[in_membership].astype(np.int64) * n_assets + data_codes[in_membership]
+        order = np.argsort(data_keys, kind='stable')
+        data_keys = data_keys[order]
+
+        ordinals, codes = self.expand()
+        member_keys = ordinals.astype(np.int64) * n_assets + codes
+
+        # the row of data for each member, -1 if data has no row for the member
+        rows = np.full(len(member_keys), -1)
+        if len(data_keys):
+            position = np.minimum(np.searchsorted(data_keys, member_keys), len(data_keys) - 1)
+            rows = np.where(data_keys[position] == member_keys, in_membership[order][position], -1)
+
+        missing = bool((rows < 0).any())
+        out = {'date': calendar[ordinals], self._id_col: self._assets[codes]}
+        for col in data.columns:
+            if col not in ['date', self._id_col]:
+                out[col] = _take(data[col], rows, missing)
+
+        return pd.DataFrame(out)
+
+
+def _take(values: pd.Series, rows: np.ndarray, missing: bool) -> pd.api.extensions.ExtensionArray:
+    """
+    takes rows of values, -1 is a missing value
+    numpy integer and bool columns are made nullable when there are missing values, like duckdb's fetchdf
+    """
+    if missing and isinstance(values.dtype, np.dtype) and values.dtype.kind in 'iub':
+        nullable = 'boolean' if values.dtype.kind == 'b' else values.dtype.name.replace('uint', 'UInt').replace('int', 'Int')
+        values = values.astype(nullable)
+    return values.array.take(rows, allow_fill=True)
+
+
+def _without_tz(dates: pd.DatetimeIndex) -> pd.DatetimeIndex:
+    """
+    converts tz aware dates to UTC and drops the tz
+    """
+    return dates.tz_convert(None) if dates.tz is not None else dates
@@ -1,8 +1,10 @@
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 import duckdb
+import numpy as np
 import pandas as pd
 
+from toolbox.constitutes.compact_membership import CompactMembership
 from toolbox.db.api.sql_connection import SQLConnection
 from toolbox.db.read.query_constructor import QueryConstructor
 from toolbox.utils.handle_data import handle_duplicates
@@ -21,11 +23,14 @@ class ConstituteAdjustment:
     """
 
     def __init__(self, id_col: str = 'symbol', date_type: str = 'timestamp', freq: str = 'D',
-                 bring_dates_to_end_of_period: bool = None):
+                 bring_dates_to_end_of_period: bool = None, compact: bool = False):
         """
         constructor for ConstituteAdjustment
         :param id_col: the asset identifier column for the data that will be passed
         :param date_type: should the date be outputted as a pd.Period or a pd.Timestamp?
+        :param compact: should the index constitutes be held as integer coded spells (CompactMembership) rather than
+            MultiIndexes? Uses a fraction of the memory, factor_components and pricing_components are built when
+            accessed
         self.__index_constitutes_factor: holds the index constitutes for the factor in a MultiIndex of date,
             self.__id_col
         self.__index_constitutes_pricing: holds the index constitutes for the pricing in a MultiIndex of date,
@@ -43,8 +48,13 @@ class ConstituteAdjustment:
         self.__freq = freq
         self.__normalize_dates = bring_dates_to_end_of_period
 
-        self.__index_constitutes_factor: Optional[pd.MultiIndex] = None
-        self.__index_constitutes_pricing: Optional[pd.MultiIndex] = None
+        self.__compact = compact
+        self.__index_constitutes_factor: Optional[Union[pd.MultiIndex, CompactMembership]] = None
+        self.__index_constitutes_pricing: Optional[Union[pd.MultiIndex, CompactMembership]] = None
+
+        # session the index constitutes are registered in once and joined against for every adjustment
+        self.__con: Optional[duckdb.DuckDBPyConnection] = None
+        self.__registered_tables = set()
 
     def add_index_info(self, index_constitutes: pd.DataFrame, start_date: Union[pd.Timestamp, str] = None,
                        end_date: Union[pd.Timestamp, str] = None, date_format: str = '') -> None:
@@ -94,29 +104,21 @@ class ConstituteAdjustment:
         else:
             relevant_cal = pd.date_range(start_date, end_date, freq=self.__freq, tz='UTC').to_series()
 
-        # making a list of series to eventually concat
-        indexes_factor: List[pd.Series] = []
-        indexes_pricing: List[pd.Series] = []
-
-        for row in index_constitutes.iterrows():
-            symbol = row[1][self.__id_col]
-
-            # getting the relevant dates for the factor
-            date_range_factors: pd.Series = relevant_cal.loc[row[1]['from']: row[1]['thru']]
-            # pricing data is only concerned with entrance bc of return calculation
-            date_range_prices: pd.Series = relevant_cal.loc[row[1]['from']:]
+        # the groups of a downsampled calendar with no market days are NaT
+        relevant_cal = pd.DatetimeIndex(relevant_cal.index).dropna()
 
-            # converting to frame and then stacking gives us a df with the index we are making, also speed improvement
-            indexes_factor.append(
-                date_range_factors.to_frame(symbol).stack()
-            )
-            indexes_pricing.append(
-                date_range_prices.to_frame(symbol).stack()
-            )
+        # the position of each spells "from" and "thru" in the calendar, same as relevant_cal.loc[from: thru]
+        starts = relevant_cal.searchsorted(index_constitutes['from'], side='left')
+        factor_stops = relevant_cal.searchsorted(index_constitutes['thru'], side='right')
+        # pricing data is only concerned with entrance bc of return calculation
+        pricing_stops = np.full(len(index_constitutes), len(relevant_cal))
 
-        # getting the index of the concatenated Series
-        self.__index_constitutes_factor = pd.concat(indexes_factor).index.set_names(['date', self.__id_col])
-        self.__index_constitutes_pricing = pd.concat(indexes_pricing).index.set_names(['date', self.__id_col])
+        ids = index_constitutes[self.__id_col].to_numpy()
+        self.__index_constitutes_factor = self._store(
+            CompactMembership.from_spells(relevant_cal, ids, starts, factor_stops, self.__id_col))
+        self.__index_constitutes_pricing = self._store(
+            CompactMembership.from_spells(relevant_cal, ids, starts, pricing_stops, self.__id_col))
+        self.__registered_tables.clear()
 
     def add_index_info_from_db(self, assets: str, start_date: str, end_date: str, sql_con=None) -> None:
         """
@@ -152,6 +154,10 @@ class ConstituteAdjustment:
         print(f"Universe missing \"{self.__id_col}\" for {round(missing_id_for * 100, 2)}% of data points")
 
         self.__index_constitutes_factor = raw_uni.index.dropna()
+        if self.__compact:
+            self.__index_constitutes_factor = CompactMembership.from_index(self.__index_constitutes_factor,
+                                                                           self.__id_col)
+        self.__registered_tables.clear()
 
     def add_index_info_long(self, index_constitutes: pd.DataFrame, start_date: Union[pd.Timestamp, str] = None,
                             end_date: Union[pd.Timestamp, str] = None):
@@ -167,6 +173,27 @@ class ConstituteAdjustment:
             (index_constitutes['date'] > start_date) & (index_constitutes['date'] < end_date)]
 
         self.__index_constitutes_factor = index_constitutes.set_index(['date', self.__id_col]).index
+        if self.__compact:
+            self.__index_constitutes_factor = CompactMembership.from_index(self.__index_constitutes_factor,
+                                                                           self.__id_col)
+        self.__registered_tables.clear()
+
+    def _components(self, contents: str) -> Optional[Union[pd.MultiIndex, CompactMembership]]:
+        """
+        :param contents: "pricing" or "factor"
+        :return: the stored index constitutes for contents
+        """
+        if contents == 'pricing':
+            return self.__index_constitutes_pricing
+        elif contents == 'factor':
+            return self.__index_constitutes_factor
+        raise ValueError(f'Representation {contents} is not recognised. Valid arguments are "pricing", "factor"')
+
+    def _store(self, membership: CompactMembership) -> Union[pd.MultiIndex, CompactMembership]:
+        """
+        :return: the membership in the representation set by compact in the constructor
+        """
+        return membership if self.__compact else membership.to_index()
 
     def adjust_data_for_membership(self, data: pd.DataFrame, contents: str = 'factor',
                                    date_format: str = '') -> pd.DataFrame:
@@ -211,13 +238,11 @@ class ConstituteAdjustment:
         if date_format != '':
             data['date'] = pd.to_datetime(data['date'], format=date_format)
 
-        if contents == 'pricing':
-            reindex_frame = self._fast_reindex(self.__index_constitutes_pricing, data)
-        elif contents == 'factor':
-            reindex_frame = self._fast_reindex(self.__index_constitutes_factor, data)
+        reindex_by = self._components(contents)
+        if isinstance(reindex_by, CompactMembership):
+            reindex_frame = self._set_tz(reindex_by.reindex(data)).set_index(['date', self.__id_col])
         else:
-            raise ValueError(
-                f'Representation {contents} is not recognised. Valid arguments are "pricing", "factor"')
+            reindex_frame = self._fast_reindex(self._membership_table(contents, reindex_by), data)
 
         # if we have dataframe with 1 column then return series
         if reindex_frame.shape[1] == 1:
@@ -225,26 +250,88 @@ class ConstituteAdjustment:
 
         return reindex_frame
 
-    def _fast_reindex(self, reindex_by: pd.MultiIndex, frame_to_reindex: pd.DataFrame):
+    def adjust_many(self, data: Dict[str, pd.DataFrame], contents: str = 'factor',
+                    date_format: str = '') -> Dict[str, Union[pd.DataFrame, pd.Series]]:
+        """
+        adjusts many data sets for membership, see adjust_data_for_membership
+        the index constitutes are registered once and shared by every adjustment
+        :param data: the data sets to adjust keyed by name
+        :param contents: Is the data set, "pricing" or "factor".
+        :param date_format: the format of the date column if the date column is a string.
+        :return: the adjusted data sets keyed by name
+        """
+        return {name: self.adjust_data_for_membership(frame, contents=contents, date_format=date_format)
+                for name, frame in data.items()}
+
+    def close(self) -> None:
+        """
+        closes the duckdb session holding the registered index constitutes, it is reopened when needed
+        """
+        if self.__con is not None:
+            self.__con.close()
+        self.__con = None
+        self.__registered_tables.clear()
+
+    def _get_con(self) -> duckdb.DuckDBPyConnection:
+        """
+        :return: the duckdb session of this object, opens it if needed
+        """
+        if self.__con is None:
+            self.__con = duckdb.connect(':memory:')
+            self.__registered_tables.clear()
+        return self.__con
+
+    def _membership_table(self, contents: str, reindex_by: pd.MultiIndex) -> str:
+        """
+        gets the table holding the index constitutes in the duckdb session, the table is only made once.
+        the table is sorted on (date, self.__id_col) and its dates are in UTC without a tz
+        :param contents: "pricing" or "factor"
+        :param reindex_by: the index constitutes for contents
+        :return: the name of the table
+        """
+        table = f'membership_{contents}'
+        if table in self.__registered_tables:
+            return table
+
+        membership = reindex_by.to_frame(index=False)
+        membership['date'] = _without_tz(membership['date'])
+
+        con = self._get_con()
+        con.register('new_membership', membership)
+        con.execute(f"""CREATE OR REPLACE TABLE {table} AS 
+                            SELECT * FROM new_membership ORDER BY date, {self.__id_col}""")
+        con.unregister('new_membership')
+
+        self.__registered_tables.add(table)
+        return table
+
+    def _fast_reindex(self, reindex_by: str, frame_to_reindex: pd.DataFrame):
         """
         Quickly reindex a pandas dataframe using a join in duckdb
         pandas reindex struggles with efficiently reindexing timestamps this is meant to be a work around to that issue
-        :param reindex_by: desired pandas multi index
+        :param reindex_by: the table in the duckdb session with the desired index
         :param frame_to_reindex: frame we are reindexing data from
         :return: reindexed dataframe
         """
-        reindex_by = reindex_by.to_frame()
+        frame_to_reindex = frame_to_reindex.copy(deep=False)
+        frame_to_reindex['date'] = _without_tz(frame_to_reindex['date'])
+
         id_cols = f'reindex_by.date, reindex_by.{self.__id_col}'
         factor_cols = ', '.join([col for col in frame_to_reindex.columns if col not in ['date', self.__id_col]])
 
-        query = duckdb.query(f"""
+        con = self._get_con()
+        con.register('frame_to_reindex', frame_to_reindex)
+        try:
+            reindexed = con.execute(f"""
                     SELECT {id_cols}, {factor_cols}
-                        FROM reindex_by 
+                        FROM {reindex_by} AS reindex_by
                             left join frame_to_reindex on (reindex_by.date = frame_to_reindex.date) 
                                                     and (reindex_by.{self.__id_col} = frame_to_reindex.{self.__id_col});
-                    """)
+                    """).df()
+        finally:
+            con.unregister('frame_to_reindex')
 
-        return self._set_tz(query.to_df()).set_index(['date', self.__id_col])
+        return self._set_tz(reindexed).set_index(['date', self.__id_col])
 
     def _set_tz(self, df: pd.DataFrame):
         """
@@ -266,14 +353,38 @@ class ConstituteAdjustment:
         """
         :return: Mutable list of tuples which represent the factor index constitutes
         """
-        return self.__index_constitutes_factor
+        return _as_index(self.__index_constitutes_factor)
 
     @property
     def pricing_components(self) -> Optional[pd.MultiIndex]:
         """
         :return: Mutable list of tuples which represent the pricing index constitutes
         """
-        return self.__index_constitutes_pricing
+        return _as_index(self.__index_constitutes_pricing)
+
+    def membership(self, contents: str = 'factor') -> Optional[CompactMembership]:
+        """
+        :param contents: "pricing" or "factor"
+        :return: the index constitutes as a CompactMembership, None if they are not set
+        """
+        components = self._components(contents)
+        if components is None or isinstance(components, CompactMembership):
+            return components
+        return CompactMembership.from_index(components, self.__id_col)
+
+
+def _as_index(components: Optional[Union[pd.MultiIndex, CompactMembership]]) -> Optional[pd.MultiIndex]:
+    """
+    expands CompactMembership into a MultiIndex, MultiIndexes and None are returned as is
+    """
+    return components.to_index() if isinstance(components, CompactMembership) else components
+
+
+def _without_tz(dates: pd.Series) -> pd.Series:
+    """
+    converts tz aware dates to UTC and drops the tz
+    """
+    return dates.dt.tz_convert(None) if isinstance(dates.dtype, pd.DatetimeTZDtype) else dates
 
 
 def _check_columns(needed: List[str], df: pd.DataFrame, index_columns: bool = True) -> pd.DataFrame:
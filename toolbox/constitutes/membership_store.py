@@ -0,0 +1,245 @@
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from toolbox.constitutes.compact_membership import CompactMembership
+from toolbox.constitutes.constitute_adjustment import ConstituteAdjustment, _check_columns
+from toolbox.utils.handle_data import handle_duplicates
+
+
+class _Universe:
+    """
+    the membership of one universe and the sorted spells used for point in time lookups
+    """
+
+    def __init__(self, factor: CompactMembership, pricing: Optional[CompactMembership]):
+        self.factor = factor
+        self.pricing = pricing
+
+        codes, starts, stops = factor.spells
+        days = _to_days(factor.calendar)
+        keep = stops > starts
+        codes, start_days, end_days = codes[keep], days[starts[keep]], days[stops[keep] - 1]
+
+        # spells sorted by asset then start, the key of a spell is its start day offset into the band of its asset
+        self.first_day = int(start_days.min()) if len(start_days) else 0
+        self.band = (int(end_days.max()) - self.first_day + 3) if len(end_days) else 1
+        keys = codes.astype(np.int64) * self.band + (start_days - self.first_day + 1)
+        order = np.argsort(keys, kind='stable')
+
+        self.keys = keys[order]
+        self.codes = codes[order]
+        self.start_days = start_days[order]
+        self.end_days = end_days[order]
+
+
+class MembershipStore:
+    """
+    Holds the membership of many universes with one shared dictionary of asset ids.
+    Each universe is stored as spells of (asset, start, end) so point in time lookups are a binary search per lookup.
+
+    Universes are loaded with add_index_info, add_index_info_long and add_index_info_from_db which take the same
+    arguments as ConstituteAdjustment plus the name of the universe, or from a loaded ConstituteAdjustment with
+    add_universe
+    """
+
+    def __init__(self, id_col: str = 'symbol', date_type: str = 'timestamp', freq: str = 'D',
+                 bring_dates_to_end_of_period: bool = None):
+        """
+        :param id_col: the asset identifier column for the data that will be passed
+        :param date_type: should the date be outputted as a pd.Period or a pd.Timestamp?
+        :param freq: the frequency universes loaded by the add_index_info methods are downsampled to
+        :param bring_dates_to_end_of_period: passed to ConstituteAdjustment by the add_index_info methods
+        """
+        if date_type not in ['period', 'timestamp']:
+            raise ValueError(f'{date_type} is not recognised')
+
+        self._id_col = id_col
+        self._date_type = date_type
+        self._freq = freq
+        self._normalize_dates = bring_dates_to_end_of_period
+
+        self._assets = pd.Index([])
+        self._universes: Dict[str, _Universe] = {}
+
+    @property
+    def universes(self) -> List[str]:
+        """
+        :return: the names of the loaded universes
+        """
+        return list(self._universes)
+
+    @property
+    def assets(self) -> pd.Index:
+        """
+        :return: the dictionary of asset ids shared by every universe
+        """
+        return self._assets
+
+    def add_index_info(self, universe: str, index_constitutes: pd.DataFrame,
+                       start_date: Union[pd.Timestamp, str] = None, end_date: Union[pd.Timestamp, str] = None,
+                       date_format: str = '') -> None:
+        """
+        loads a universe from spells, see ConstituteAdjustment.add_index_info
+        :param universe: the name of the universe, replaces the universe if it is loaded
+        """
+        ca = self._constitute_adjustment()
+        ca.add_index_info(index_constitutes, start_date=start_date, end_date=end_date, date_format=date_format)
+        self.add_universe(universe, ca)
+
+    def add_index_info_long(self, universe: str, index_constitutes: pd.DataFrame,
+                            start_date: Union[pd.Timestamp, str] = None,
+                            end_date: Union[pd.Timestamp, str] = None) -> None:
+        """
+        loads a universe from (date, id) pairs, see ConstituteAdjustment.add_index_info_long
+        :param universe: the name of the universe, replaces the universe if it is loaded
+        """
+        ca = self._constitute_adjustment()
+        ca.add_index_info_long(index_constitutes, start_date=start_date, end_date=end_date)
+        self.add_universe(universe, ca)
+
+    def add_index_info_from_db(self, universe: str, assets: str, start_date: str, end_date: str,
+                               sql_con=None) -> None:
+        """
+        loads a universe from the database, see ConstituteAdjustment.add_index_info_from_db
+        :param universe: the name of the universe, replaces the universe if it is loaded
+        """
+        ca = self._constitute_adjustment()
+        ca.add_index_info_from_db(assets, start_date=start_date, end_date=end_date, sql_con=sql_con)
+        self.add_universe(universe, ca)
+
+    def add_universe(self, universe: str, constitutes: ConstituteAdjustment) -> None:
+        """
+        loads a universe from a ConstituteAdjustment that has its index info added
+        :param universe: the name of the universe, replaces the universe if it is loaded
+        :param constitutes: the ConstituteAdjustment to take the factor and pricing constitutes from
+        """
+        factor = constitutes.membership('factor')
+        if factor is None:
+            raise ValueError('Index constitutes are not set')
+        if factor.id_col != self._id_col:
+            raise ValueError(f'The id_col of the constitutes "{factor.id_col}" does not match "{self._id_col}"')
+        pricing = constitutes.membership('pricing')
+
+        # new assets are appended so the codes of the loaded universes stay valid
+        new_assets = factor.assets.union(pricing.assets) if pricing is not None else factor.assets
+        new_assets = new_assets.difference(self._assets)
+        if len(new_assets):
+            self._assets = self._assets.append(new_assets) if len(self._assets) else new_assets
+            for name, loaded in self._universes.items():
+                self._universes[name] = _Universe(
+                    loaded.factor.with_assets(self._assets),
+                    loaded.pricing.with_assets(self._assets) if loaded.pricing is not None else None)
+
+        self._universes[universe] = _Universe(factor.with_assets(self._assets),
+                                              pricing.with_assets(self._assets) if pricing is not None else None)
+
+    def members(self, universe: str, date: Union[pd.Timestamp, str]) -> pd.Index:
+        """
+        gets the assets in a universe on a date
+        :param universe: the name of the universe
+        :param date: the date to get the members for
+        :return: the ids of the members
+        """
+        uni = self._get_universe(universe)
+        day = _to_days(pd.DatetimeIndex([date]))[0]
+
+        in_universe = (uni.start_days <= day) & (uni.end_days >= day)
+        return self._assets[np.unique(uni.codes[in_universe])]
+
+    def is_member(self, universe: str, assets: Iterable, dates: Iterable) -> np.ndarray:
+        """
+        checks if each asset is a member of a universe on the paired date
+        each lookup is a binary search over the spells of the universe
+        :param universe: the name of the universe
+        :param assets: the asset ids to check
+        :param dates: the date to check each asset on, must be the same length as assets
+        :return: boolean array, True where the asset is a member on the date
+        """
+        uni = self._get_universe(universe)
+
+        codes = self._assets.get_indexer(pd.Index(assets))
+        days = _to_days(pd.DatetimeIndex(dates))
+        if len(codes) != len(days):
+            raise ValueError('assets and dates must be the same length')
+
+        if not len(uni.keys):
+            return np.zeros(len(codes), dtype=bool)
+
+        # keeping the day inside the band of the asset so a search can't land in the spells of another asset
+        offset = np.clip(days - uni.first_day + 1, 0, uni.band - 1)
+        spell = np.searchsorted(uni.keys, codes.astype(np.int64) * uni.band + offset, side='right') - 1
+        found = np.maximum(spell, 0)
+
+        return ((spell >= 0) & (codes >= 0) & (uni.codes[found] == codes) & (uni.start_days[found] <= days) &
+                (uni.end_days[found] >= days))
+
+    def adjust_data_for_membership(self, data: pd.DataFrame, universe: str, contents: str = 'factor',
+                                   date_format: str = '') -> Union[pd.DataFrame, pd.Series]:
+        """
+        adjusts the data set for when assets are a member of a universe,
+        see ConstituteAdjustment.adjust_data_for_membership
+        :param data: a pandas dataframe to be filtered, must have columns named id_col, 'date'
+        :param universe: the name of the universe
+        :param contents: Is the data set, "pricing" or "factor".
+        :param date_format: the format of the date column if the date column is a string.
+        :return: a indexed data frame adjusted for the universe
+        """
+        uni = self._get_universe(universe)
+        if contents == 'factor':
+            membership = uni.factor
+        elif contents == 'pricing':
+            membership = uni.pricing
+            if membership is None:
+                raise ValueError(f'Universe {universe} does not have pricing constitutes')
+        else:
+            raise ValueError(f'Representation {contents} is not recognised. Valid arguments are "pricing", "factor"')
+
+        data = _check_columns(['date', self._id_col], data, False)
+
+        if isinstance(data['date'].dtype, pd.core.dtypes.dtypes.PeriodDtype):
+            data['date'] = data['date'].dt.to_timestamp()
+            date_format = ''
+
+        data = handle_duplicates(df=data, out_type='Warning', name='Data', drop=True, subset=['date', self._id_col])
+
+        if date_format != '':
+            data['date'] = pd.to_datetime(data['date'], format=date_format)
+
+        reindex_frame = membership.reindex(data)
+        if self._date_type == 'timestamp':
+            reindex_frame['date'] = reindex_frame['date'].dt.tz_localize('UTC')
+        else:
+            reindex_frame['date'] = reindex_frame['date'].dt.to_period('D')
+        reindex_frame = reindex_frame.set_index(['date', self._id_col])
+
+        # if we have dataframe with 1 column then return series
+        if reindex_frame.shape[1] == 1:
+            return reindex_frame.iloc[:, 0]
+
+        return reindex_frame
+
+    def _get_universe(self, universe: str) -> _Universe:
+        """
+        :return: the loaded universe, raises ValueError if it is not loaded
+        """
+        if universe not in self._universes:
+            raise ValueError(f'Universe {universe} is not loaded. Loaded universes are {self.universes}')
+        return self._universes[universe]
+
+    def _constitute_adjustment(self) -> ConstituteAdjustment:
+        """
+        :return: a compact ConstituteAdjustment with the settings of the store
+        """
+        return ConstituteAdjustment(id_col=self._id_col, date_type=self._date_type, freq=self._freq,
+                                    bring_dates_to_end_of_period=self._normalize_dates, compact=True)
+
+
+def _to_days(dates: pd.DatetimeIndex) -> np.ndarray:
+    """
+    converts dates to days since the epoch, dates with a tz are converted in UTC
+    """
+    if dates.tz is not None:
+        dates = dates.tz_convert(None)
+    return dates.to_numpy().astype('datetime64[D]').astype(np.int64)
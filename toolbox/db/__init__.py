@@ -1,19 +1,33 @@
 from .api.sql_connection import SQLConnection
+from .api.connection_pool import close_connection_pools
 from .read.query_constructor import QueryConstructor
+from .read.query_batch import QueryBatch, run_many
+from .read.query_profiler import enable_profiling, disable_profiling, LogSink, CSVSink, RingBufferSink
 from .write.create_tables import IngestDataBase
 from .write.make_universes import compustat_us_universe, crsp_us_universe
 from .read.db_functions import table_info
 from .read.universe import clear_built_universes, clear_etf_universes
-from .read.cached_query import clear_cache
+from .read.cached_query import clear_cache, evict_cache, invalidate_tables, invalidate_stale_cache
 
 __all__ = [
     'SQLConnection',
+    'close_connection_pools',
     'QueryConstructor',
+    'QueryBatch',
+    'run_many',
+    'enable_profiling',
+    'disable_profiling',
+    'LogSink',
+    'CSVSink',
+    'RingBufferSink',
     'IngestDataBase',
     'compustat_us_universe',
     'crsp_us_universe',
     'table_info',
     'clear_built_universes',
     'clear_etf_universes',
-    'clear_cache'
+    'clear_cache',
+    'evict_cache',
+    'invalidate_tables',
+    'invalidate_stale_cache'
 ]
@@ -0,0 +1,222 @@
+import threading
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+import duckdb
+
+from toolbox.db.settings import DB_POOL_SIZE, DB_POOL_TIMEOUT
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of duckdb cursors which all share one database handle.
+    Opening the database file is only done once, checking a connection out hands back a cursor of that handle.
+    """
+
+    def __init__(self, connection_string: str, read_only: bool = True, max_size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT) -> None:
+        """
+        :param connection_string: the path to the duck db database
+        :param read_only: should the database handle be opened as read only?
+        :param max_size: the max amount of connections that can be checked out at once
+        :param timeout: the default amount of seconds to wait for a free connection
+        :return: None
+        """
+        if max_size < 1:
+            raise ValueError('max_size must be greater than zero')
+
+        self._connection_string = connection_string
+        self._read_only = read_only
+        self._max_size = max_size
+        self._timeout = timeout
+
+        self._cond = threading.Condition()
+        self._database: Optional[duckdb.DuckDBPyConnection] = None
+        self._idle: List[duckdb.DuckDBPyConnection] = []
+        self._checked_out = 0
+        self._closed = False
+
+    @property
+    def checked_out(self) -> int:
+        """
+        :return: the amount of connections currently checked out of the pool
+        """
+        return self._checked_out
+
+    @property
+    def idle(self) -> int:
+        """
+        :return: the amount of healthy connections waiting in the pool
+        """
+        return len(self._idle)
+
+    def checkout(self, timeout: Optional[float] = None) -> duckdb.DuckDBPyConnection:
+        """
+        checks a connection out of the pool, if all connections are checked out then will wait for one to be returned
+        idle connections are health checked before they are handed out, unhealthy connections are replaced
+        :param timeout: seconds to wait for a connection, if None then will use the pools default timeout
+        :return: a duckdb connection, must be given back with self.checkin()
+        :raise TimeoutError: if no connection became free within the timeout
+        """
+        timeout = self._timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            while not self._closed and not self._idle and self._checked_out >= self._max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'Could not check out a connection to {self._connection_string} '
+                                       f'within {timeout} seconds, {self._checked_out} connections are checked out')
+                self._cond.wait(remaining)
+
+            if self._closed:
+                raise ValueError(f'Connection pool for {self._connection_string} is closed')
+
+            cursor = self._idle.pop() if self._idle else None
+            self._checked_out += 1
+
+        try:
+            if cursor is None or not self._is_healthy(cursor):
+                cursor = self._new_cursor()
+        except Exception as e:
+            self._release_slot()
+            raise e
+
+        return cursor
+
+    def checkin(self, cursor: duckdb.DuckDBPyConnection, discard: bool = False) -> None:
+        """
+        gives a connection back to the pool.
+        Any temp tables or registered views made on the connection are dropped so the next user gets a clean session
+        :param cursor: the connection to give back, must have come from self.checkout()
+        :param discard: should the connection be closed rather than reused?
+        :return: None
+        """
+        if not discard and not self._closed:
+            discard = not self._reset(cursor)
+
+        if discard or self._closed:
+            self._close_quietly(cursor)
+            self._release_slot()
+            return
+
+        with self._cond:
+            self._idle.append(cursor)
+            self._checked_out -= 1
+            self._cond.notify()
+
+    def close(self) -> None:
+        """
+        closes all idle connections and the shared database handle
+        connections that are still checked out will be closed when they are checked in
+        :return: None
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            database, self._database = self._database, None
+            self._cond.notify_all()
+
+        for cursor in idle:
+            self._close_quietly(cursor)
+        if database is not None:
+            self._close_quietly(database)
+
+    def _new_cursor(self) -> duckdb.DuckDBPyConnection:
+        """
+        makes a new cursor off of the shared database handle, (re)opening the handle if needed
+        """
+        with self._cond:
+            if self._database is not None:
+                try:
+                    return self._database.cursor()
+                except duckdb.Error:
+                    self._close_quietly(self._database)
+                    self._database = None
+
+            self._database = duckdb.connect(database=self._connection_string, read_only=self._read_only)
+            return self._database.cursor()
+
+    def _release_slot(self) -> None:
+        """
+        frees up a checked out slot without returning a connection to the idle list
+        """
+        with self._cond:
+            self._checked_out -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _is_healthy(cursor: duckdb.DuckDBPyConnection) -> bool:
+        """
+        checks the connection can still run a query
+        """
+        try:
+            return cursor.execute('SELECT 1').fetchone()[0] == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(cursor: duckdb.DuckDBPyConnection) -> bool:
+        """
+        drops the temp tables and views made on a connection
+        :return: was the connection reset successfully?
+        """
+        try:
+            temp_views = cursor.execute("""SELECT view_name FROM duckdb_views()
+                                            WHERE temporary AND NOT internal""").fetchall()
+            temp_tables = cursor.execute('SELECT table_name FROM duckdb_tables() WHERE temporary').fetchall()
+
+            for view in temp_views:
+                cursor.execute(f'DROP VIEW IF EXISTS temp."{view[0]}"')
+            for table in temp_tables:
+                cursor.execute(f'DROP TABLE IF EXISTS temp."{table[0]}"')
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(con: duckdb.DuckDBPyConnection) -> None:
+        """
+        closes a connection ignoring any errors
+        """
+        try:
+            con.close()
+        except Exception:
+            pass
+
+
+_POOLS: Dict[Tuple[str, bool], ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_connection_pool(connection_string: str, read_only: bool = True) -> ConnectionPool:
+    """
+    gets the process wide pool for a database, makes the pool if it does not exist
+    :param connection_string: the path to the duck db database
+    :param read_only: is the pool read only?
+    :return: the ConnectionPool keyed by (connection_string, read_only)
+    """
+    key = (connection_string, read_only)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = ConnectionPool(connection_string=connection_string, read_only=read_only)
+            _POOLS[key] = pool
+        return pool
+
+
+def close_connection_pools(connection_string: Optional[str] = None) -> None:
+    """
+    closes the process wide pools.
+    Must be done before opening a database with a different read_only configuration, duckdb does not allow the same
+    file to be opened as read only and writable in one process
+    :param connection_string: if passed then will only close the pools for this database
+    :return: None
+    """
+    with _POOLS_LOCK:
+        keys = [key for key in _POOLS if connection_string is None or key[0] == connection_string]
+        pools = [_POOLS.pop(key) for key in keys]
+
+    for pool in pools:
+        pool.close()
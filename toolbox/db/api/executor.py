@@ -0,0 +1,89 @@
+import asyncio
+import functools
+import threading
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from toolbox.db.api.sql_connection import SQLConnection
+from toolbox.db.settings import DB_ASYNC_MAX_CONCURRENCY
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+# one semaphore per event loop, asyncio primitives can't be shared across loops
+_SEMAPHORES: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]' = weakref.WeakKeyDictionary()
+# one lock per connection per event loop, a duckdb connection can't run queries from two threads at once
+_CONNECTION_LOCKS: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, weakref.WeakKeyDictionary]' = \
+    weakref.WeakKeyDictionary()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    gets the process wide executor the async api runs blocking database calls on,
+    only makes the executor once per process
+    """
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=DB_ASYNC_MAX_CONCURRENCY, thread_name_prefix='toolbox_db')
+        return _EXECUTOR
+
+
+def _get_semaphore(loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+    """
+    gets the semaphore bounding the amount of calls running at once on an event loop
+    """
+    semaphore = _SEMAPHORES.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(DB_ASYNC_MAX_CONCURRENCY)
+        _SEMAPHORES[loop] = semaphore
+    return semaphore
+
+
+def _get_connection_lock(loop: asyncio.AbstractEventLoop, sql_con: SQLConnection) -> asyncio.Lock:
+    """
+    gets the lock calls running on a connection hold, waiting on it can be cancelled without interrupting the
+    call that holds it
+    """
+    locks = _CONNECTION_LOCKS.setdefault(loop, weakref.WeakKeyDictionary())
+    lock = locks.get(sql_con)
+    if lock is None:
+        lock = asyncio.Lock()
+        locks[sql_con] = lock
+    return lock
+
+
+async def run_blocking(func: Callable[..., Any], *args, sql_con: Optional[SQLConnection] = None, **kwargs) -> Any:
+    """
+    runs a blocking function on the shared executor without blocking the event loop.
+    At most DB_ASYNC_MAX_CONCURRENCY calls run at once, the rest wait their turn. Calls on the same sql_con run one
+    after another since a duckdb connection can't run queries in parallel.
+    If the awaiting task is cancelled before the call starts then the call never runs, if the call is already running
+    then the query on sql_con is interrupted
+    :param func: the blocking function to run
+    :param args: positional arguments for func
+    :param sql_con: the connection func runs its queries on, interrupted when the task is cancelled
+    :param kwargs: keyword arguments for func
+    :return: the result of func
+    """
+    loop = asyncio.get_running_loop()
+    if sql_con is None:
+        return await _submit(loop, functools.partial(func, *args, **kwargs), sql_con)
+
+    async with _get_connection_lock(loop, sql_con):
+        return await _submit(loop, functools.partial(func, *args, **kwargs), sql_con)
+
+
+async def _submit(loop: asyncio.AbstractEventLoop, call: Callable[[], Any], sql_con: Optional[SQLConnection]) -> Any:
+    """
+    runs call on the shared executor once the semaphore of the loop lets it, see run_blocking
+    """
+    async with _get_semaphore(loop):
+        future = get_executor().submit(call)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if not future.cancel() and sql_con is not None:
+                sql_con.interrupt()
+            raise
@@ -1,8 +1,10 @@
 from typing import Optional
 
 import duckdb
+import pyarrow as pa
 
-from toolbox.db.settings import DB_CONNECTION_STRING
+from toolbox.db.api.connection_pool import ConnectionPool, close_connection_pools, get_connection_pool
+from toolbox.db.settings import DB_CONNECTION_STRING, DB_POOL_CONNECTIONS
 
 
 class SQLConnection:
@@ -10,12 +12,16 @@ class SQLConnection:
     Provides a lazy connection to a duckdb database
     """
 
-    def __init__(self, connection_string: Optional[str] = None, read_only: bool = True, close_key=None) -> None:
+    def __init__(self, connection_string: Optional[str] = None, read_only: bool = True, close_key=None,
+                 pooled: Optional[bool] = None) -> None:
         """
         if the connection is a memory connection then read_only will be False
         :param connection_string: the path to the duck db database
             If not passed then will look in settings.py for the string
         :param close_key: the key to be passed in order to close the connection in self.close_with_key()
+        :param pooled: should the connection be checked out of the process wide ConnectionPool?
+            If not passed then will use DB_POOL_CONNECTIONS in settings.py.
+            Only read only connections to a database file are pooled
         :return: None
         """
         self._read_only: bool = False if connection_string == ':memory:' else read_only
@@ -23,6 +29,8 @@ class SQLConnection:
 
         self._connection_string: str = self._get_connection_string(connection_string)
         self._db_connection: Optional[duckdb.DuckDBPyConnection] = None
+        self._pooled: bool = DB_POOL_CONNECTIONS if pooled is None else pooled
+        self._pool: Optional[ConnectionPool] = None
 
     @staticmethod
     def _get_connection_string(connection_string: Optional[str]) -> str:
@@ -45,10 +53,16 @@ class SQLConnection:
         sets connection to duckdb database, if connection is currently open then it will close connection
         :return: None
         """
-        if self._db_connection:
-            self._db_connection.close()
+        self.close()
 
-        self._db_connection = duckdb.connect(database=self._connection_string, read_only=self._read_only)
+        if self.pooled:
+            self._pool = get_connection_pool(self._connection_string, self._read_only)
+            self._db_connection = self._pool.checkout()
+        else:
+            if not self._read_only and self._connection_string != ':memory:':
+                # duckdb can't open the database as writable while a read only pool has it open
+                close_connection_pools(self._connection_string)
+            self._db_connection = duckdb.connect(database=self._connection_string, read_only=self._read_only)
 
     @property
     def con(self) -> duckdb.DuckDBPyConnection:
@@ -65,7 +79,14 @@ class SQLConnection:
         """
         :return: Is the connection read only?
         """
-        return self.read_only
+        return self._read_only
+
+    @property
+    def pooled(self) -> bool:
+        """
+        :return: Is the connection checked out of a ConnectionPool?
+        """
+        return self._pooled and self._read_only and self._connection_string != ':memory:'
 
     def connection_string(self) -> str:
         """
@@ -82,19 +103,21 @@ class SQLConnection:
         :return: None
         """
         if read_only != self.read_only:
+            self.close()
             self._read_only = read_only
 
-            if self._db_connection:
-                self._db_connection.close()
-                self._connection_string = None
-
     def close(self) -> None:
         """
         will close the sql connection regardless of self.close_key
+        pooled connections are checked back in to their pool rather than closed
         """
         if self._db_connection:
-            self._db_connection.close()
+            if self._pool is not None:
+                self._pool.checkin(self._db_connection)
+            else:
+                self._db_connection.close()
             self._db_connection = None
+            self._pool = None
 
     def close_with_key(self, close_key: str):
         """
@@ -103,6 +126,28 @@ class SQLConnection:
         if close_key == self._close_key and close_key is not None:
             self.close()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        # giving a pooled connection back if the user never closed it, otherwise the pool would run dry
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def interrupt(self) -> None:
+        """
+        interrupts the query running on the connection, can be called from another thread
+        does nothing if the connection is not open
+        """
+        db_connection = self._db_connection
+        if db_connection is not None:
+            db_connection.interrupt()
+
     def execute(self, sql: str, **kwargs) -> duckdb.DuckDBPyConnection:
         """
         wrapper for self.con.execute(sq;)
@@ -111,6 +156,28 @@ class SQLConnection:
         """
         return self.con.execute(sql, **kwargs)
 
+    def arrow(self, sql: str, **kwargs) -> pa.Table:
+        """
+        runs a query and returns the results as an Arrow table without going through pandas
+        :param sql: query to run
+        :return: Arrow table of the results
+        """
+        result = self.con.execute(sql, **kwargs)
+        # to_arrow_table replaced fetch_arrow_table in newer versions of duckdb
+        if hasattr(result, 'to_arrow_table'):
+            return result.to_arrow_table()
+        return result.fetch_arrow_table()
+
+    def arrow_reader(self, sql: str, rows: int = 1_000_000, **kwargs) -> pa.RecordBatchReader:
+        """
+        runs a query and streams the results as Arrow record batches, the full result is never held in memory
+        the connection must not run another query while the reader is being consumed
+        :param sql: query to run
+        :param rows: the amount of rows in each record batch
+        :return: reader of the results
+        """
+        return self.con.execute(sql, **kwargs).fetch_record_batch(rows)
+
     def set_threads(self, num_threads: int) -> None:
         """
         sets the amount of threads duck db should use
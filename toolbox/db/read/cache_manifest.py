@@ -0,0 +1,237 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from toolbox.db.settings import CACHE_DIRECTORY, MEMORY_CACHE_HIT_FLUSH
+
+EVICTION_POLICIES = {
+    'LRU': 'last_access ASC',
+    'LFU': 'hits ASC, last_access ASC',
+}
+
+
+class CacheManifest:
+    """
+    Book keeping for the query cache.
+    Records the size, creation time, last access time and hit count of every cached query in a sqlite file so lookups
+    and evictions never have to scan the cache directory.
+    Hits served from the in memory cache are kept in the process and written in batches so a memory hit does not
+    touch the sqlite file, they are written before anything reads the access times or hit counts
+    """
+
+    def __init__(self, directory: str = CACHE_DIRECTORY, hit_flush: int = MEMORY_CACHE_HIT_FLUSH):
+        """
+        :param directory: the directory the cached queries are in, the manifest is written in this directory
+        :param hit_flush: the amount of buffered hits that are written to the manifest at once
+        """
+        self._path = f'{directory}/query_cache_manifest.sqlite'
+        self._hit_flush = hit_flush
+        # query hash -> (buffered hits, last access time)
+        self._pending_hits: Dict[str, Tuple[int, float]] = {}
+        self._pending_count = 0
+        self._pending_lock = threading.Lock()
+        with self._connect() as con:
+            # write ahead logging lets a cache hit update its row without syncing the whole file
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute("""CREATE TABLE IF NOT EXISTS entries (
+                                query_hash TEXT PRIMARY KEY,
+                                path TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                created REAL NOT NULL,
+                                last_access REAL NOT NULL,
+                                hits INTEGER NOT NULL DEFAULT 0,
+                                fingerprint TEXT)""")
+            # manifests made before fingerprints were recorded
+            columns = [row[1] for row in con.execute('PRAGMA table_info(entries)').fetchall()]
+            if 'fingerprint' not in columns:
+                con.execute('ALTER TABLE entries ADD COLUMN fingerprint TEXT')
+
+        atexit.register(self._flush_at_exit)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        opens a short lived connection to the manifest, commits on exit
+        """
+        con = sqlite3.connect(self._path, timeout=30)
+        con.execute('PRAGMA synchronous=NORMAL')
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def record_store(self, query_hash: str, path: str, size: Optional[int] = None,
+                     fingerprint: Optional[str] = None) -> None:
+        """
+        records a newly cached query, will overwrite the old record if the query was cached before
+        :param query_hash: the hash of the cached query
+        :param path: the path to the cached file
+        :param size: the size of the file in bytes, if None then will stat the file
+        :param fingerprint: the versions of the tables and files the query depends on
+        :return: None
+        """
+        size = os.path.getsize(path) if size is None else size
+        now = time.time()
+        with self._connect() as con:
+            con.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, 0, ?)',
+                        (query_hash, path, size, now, now, fingerprint))
+
+    def record_hit(self, query_hash: str) -> Optional[float]:
+        """
+        updates the last access time and hit count of a cached query
+        :param query_hash: the hash of the cached query
+        :return: the time the query was cached, None if the query is not in the manifest
+        """
+        with self._connect() as con:
+            con.execute('UPDATE entries SET last_access = ?, hits = hits + 1 WHERE query_hash = ?',
+                        (time.time(), query_hash))
+            row = con.execute('SELECT created FROM entries WHERE query_hash = ?', (query_hash,)).fetchone()
+        return row[0] if row else None
+
+    def buffer_hit(self, query_hash: str) -> None:
+        """
+        records a hit of a cached query in the process, the hits are written once hit_flush of them are buffered
+        :param query_hash: the hash of the cached query
+        :return: None
+        """
+        with self._pending_lock:
+            hits, _ = self._pending_hits.get(query_hash, (0, 0.0))
+            self._pending_hits[query_hash] = (hits + 1, time.time())
+            self._pending_count += 1
+            full = self._pending_count >= self._hit_flush
+
+        if full:
+            self.flush_hits()
+
+    def flush_hits(self) -> None:
+        """
+        writes the buffered hits to the manifest in one transaction
+        :return: None
+        """
+        with self._pending_lock:
+            pending, self._pending_hits, self._pending_count = self._pending_hits, {}, 0
+        if not pending:
+            return
+
+        with self._connect() as con:
+            con.executemany('UPDATE entries SET last_access = max(last_access, ?), hits = hits + ? '
+                            'WHERE query_hash = ?',
+                            [(last_access, hits, query_hash) for query_hash, (hits, last_access) in pending.items()])
+
+    def _flush_at_exit(self) -> None:
+        """
+        writes the buffered hits when the process exits, the hits are dropped if the manifest is gone
+        """
+        try:
+            self.flush_hits()
+        except sqlite3.Error:
+            pass
+
+    def get(self, query_hash: str) -> Optional[dict]:
+        """
+        :param query_hash: the hash of the cached query
+        :return: the record of the cached query, None if the query is not in the manifest
+        """
+        with self._connect() as con:
+            con.row_factory = sqlite3.Row
+            row = con.execute('SELECT * FROM entries WHERE query_hash = ?', (query_hash,)).fetchone()
+        return dict(row) if row else None
+
+    def remove(self, query_hash: str) -> None:
+        """
+        removes a cached query from the manifest and deletes the cached file
+        :param query_hash: the hash of the cached query
+        :return: None
+        """
+        record = self.get(query_hash)
+        if record is None:
+            return
+
+        with self._connect() as con:
+            con.execute('DELETE FROM entries WHERE query_hash = ?', (query_hash,))
+        _remove_file(record['path'])
+
+    def entries(self) -> pd.DataFrame:
+        """
+        :return: DataFrame of every record in the manifest
+        """
+        self.flush_hits()
+        with self._connect() as con:
+            return pd.read_sql_query('SELECT * FROM entries ORDER BY last_access DESC', con)
+
+    def evict(self, max_bytes: Optional[int] = None, max_entries: Optional[int] = None, ttl: Optional[float] = None,
+              policy: str = 'LRU', protect: Optional[str] = None) -> List[str]:
+        """
+        evicts cached queries until the cache is within the given limits
+        entries older than the ttl are always evicted, then entries are evicted in the order defined by the policy
+        :param max_bytes: max total size of the cache in bytes, None for no limit
+        :param max_entries: max amount of cached queries, None for no limit
+        :param ttl: max age of a cached query in seconds, None for no limit
+        :param policy: the order to evict entries in 'LRU' (least recently used) or 'LFU' (least frequently used)
+        :param protect: a query hash that should not be evicted, normally the query that was just cached
+        :return: the hashes of the evicted queries
+        """
+        if policy.upper() not in EVICTION_POLICIES:
+            raise ValueError(f'Eviction policy {policy} is not recognised. '
+                             f'Valid policies are {list(EVICTION_POLICIES.keys())}')
+
+        # the policies order by the access times and hit counts
+        self.flush_hits()
+        with self._connect() as con:
+            rows = con.execute(f'SELECT query_hash, path, size, created FROM entries '
+                               f'ORDER BY {EVICTION_POLICIES[policy.upper()]}').fetchall()
+
+            total_bytes = sum(row[2] for row in rows)
+            total_entries = len(rows)
+            expired_before = time.time() - ttl if ttl is not None else None
+
+            evicted = []
+            for query_hash, path, size, created in rows:
+                if query_hash == protect:
+                    continue
+
+                expired = expired_before is not None and created < expired_before
+                over_bytes = max_bytes is not None and total_bytes > max_bytes
+                over_entries = max_entries is not None and total_entries > max_entries
+
+                if not (expired or over_bytes or over_entries):
+                    continue
+
+                evicted.append((query_hash, path))
+                total_bytes -= size
+                total_entries -= 1
+
+            con.executemany('DELETE FROM entries WHERE query_hash = ?', [(e[0],) for e in evicted])
+
+        for _, path in evicted:
+            _remove_file(path)
+
+        return [e[0] for e in evicted]
+
+    def clear(self) -> None:
+        """
+        removes every record from the manifest, does not delete the cached files
+        :return: None
+        """
+        with self._pending_lock:
+            self._pending_hits, self._pending_count = {}, 0
+        with self._connect() as con:
+            con.execute('DELETE FROM entries')
+
+
+def _remove_file(path: str) -> None:
+    """
+    deletes a file if it exists
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
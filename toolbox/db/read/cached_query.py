@@ -1,13 +1,34 @@
 import glob
 import hashlib
+import json
 import os
+import time
 
-import pandas as pd
+from typing import List, Optional
 
-from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from toolbox.db.settings import CACHE_DIRECTORY
+from toolbox.db.settings import (CACHE_DIRECTORY, CACHE_MAX_BYTES, CACHE_MAX_ENTRIES, CACHE_TTL,
+                                 CACHE_EVICTION_POLICY)
+from toolbox.db.api.executor import run_blocking
 from toolbox.db.api.sql_connection import SQLConnection
+from toolbox.db.read.cache_manifest import CacheManifest
+from toolbox.db.read.fingerprint import changed_dependencies, fingerprint, query_dependencies
+from toolbox.db.read.memory_cache import get_memory_cache
+
+_MANIFEST = None
+
+
+def get_cache_manifest() -> CacheManifest:
+    """
+    gets the CacheManifest for CACHE_DIRECTORY, only makes the manifest once per process
+    """
+    global _MANIFEST
+    if _MANIFEST is None:
+        _MANIFEST = CacheManifest(CACHE_DIRECTORY)
+    return _MANIFEST
 
 
 class CachedQuery:
@@ -15,33 +36,94 @@ class CachedQuery:
     Functionality to cache results of a QueryConstructor
     """
 
-    def __init__(self, query: str):
+    def __init__(self, query: str, sql_con: SQLConnection = None, dependencies: Optional[List[str]] = None):
         """
         :param query: the query we are looking at
+        :param sql_con: connection to the database the query runs on, used to fingerprint the tables the query reads
+            if not passed then will use the default database
+        :param dependencies: the tables and files to fingerprint the query by, if None then will parse the query
         """
         self._query = query
+        self._sql_con = sql_con
+        self._dependencies = dependencies
         self._query_hash = hashlib.sha224(query.encode()).hexdigest()
         # what the path should be to the cache file
         self._path = f'{CACHE_DIRECTORY}/{self._query_hash.upper()}.parquet'
+        self._fingerprint: Optional[str] = None
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        the current versions of the tables and files the query reads from
+        """
+        if self._fingerprint is None:
+            dependencies = self._dependencies
+            if dependencies is None:
+                dependencies = query_dependencies(self._query, self._sql_con)
+            self._fingerprint = fingerprint(dependencies, self._sql_con)
+        return self._fingerprint
 
     def is_query_cached(self) -> bool:
         """
-        checks to see if the query is cached
+        checks to see if the query is cached in memory or on disk
+        if the tables or files the query reads from changed since it was cached then the cache is invalidated.
+        Tables in memory are checked against the fingerprint they were cached with so a memory hit does not read the
+        manifest or parse the query
+        """
+        memory_cache = get_memory_cache()
+        memory_fingerprint = memory_cache.fingerprint(self._query_hash)
+        if memory_fingerprint is not None:
+            current = fingerprint(list(json.loads(memory_fingerprint)), self._sql_con)
+            if current == memory_fingerprint:
+                self._fingerprint = current
+                return True
+        memory_cache.remove(self._query_hash)
+
+        if not os.path.isfile(self._path):
+            return False
+
+        record = get_cache_manifest().get(self._query_hash)
+        if record and record['fingerprint'] and record['fingerprint'] != self.fingerprint:
+            changed = changed_dependencies(record['fingerprint'], self.fingerprint)
+            print(f'Invalidated Cache, {", ".join(changed)} changed')
+            self.invalidate()
+            return False
+
+        return True
+
+    def invalidate(self) -> None:
+        """
+        removes the query from the memory and disk caches
         """
-        return os.path.isfile(self._path)
+        get_memory_cache().remove(self._query_hash)
+        get_cache_manifest().remove(self._query_hash)
+        if os.path.isfile(self._path):
+            os.remove(self._path)
 
     def cache_query(self, results: pd.DataFrame):
         """
         caches the given results
         If index is not range index then will write index as a column not an index
+        After caching the eviction policies in settings.py are applied to the cache
         """
         if not isinstance(results.index, pd.RangeIndex):
             results = results.reset_index()
 
-        # if any columns are a period type change them to timestamp
-        con = SQLConnection(':memory:')
-        con.execute(f"COPY results TO '{self._path}' (FORMAT 'parquet')")
-        con.close()
+        self.cache_arrow(pa.Table.from_pandas(results, preserve_index=False))
+
+    def cache_arrow(self, table: pa.Table):
+        """
+        caches the given Arrow table, written to parquet and kept in the in memory cache without going through pandas
+        After caching the eviction policies in settings.py are applied to the cache
+        """
+        pq.write_table(table, self._path)
+        get_memory_cache().put(self._query_hash, table, self.fingerprint)
+
+        manifest = get_cache_manifest()
+        manifest.record_store(self._query_hash, self._path, fingerprint=self.fingerprint)
+        evicted = manifest.evict(max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL,
+                                 policy=CACHE_EVICTION_POLICY, protect=self._query_hash)
+        _remove_from_memory(evicted)
         print(f'Cached Query')
 
     def get_cached_query_path(self) -> str:
@@ -52,26 +134,150 @@ class CachedQuery:
             return self._path
         raise ValueError('Query is not cached!')
 
-    def get_cached_query_df(self) -> pd.DataFrame:
+    def get_cached_query_arrow(self) -> pa.Table:
+        """
+        gets the Arrow table of the cached query will rase ValueError if the query is not cached
+        Reads from the in memory cache when possible, otherwise reads the parquet file and keeps it in memory
+        """
+        table = get_memory_cache().get(self._query_hash)
+        if table is not None:
+            get_cache_manifest().buffer_hit(self._query_hash)
+            print('Using In Memory Cache')
+            return table
+
+        table = pq.read_table(self.get_cached_query_path())
+        get_memory_cache().put(self._query_hash, table, self.fingerprint)
+
+        created = self._record_hit()
+        file_age = int((time.time() - created) // 86_400)
+
+        print(f'Using {file_age} Day Old Cache')
+        return table
+
+    def get_cached_query_df(self, zero_copy: bool = False) -> pd.DataFrame:
         """
         gets the DataFrame contents of the cached query will rase ValueError if the query is not cached
         The index will be a default range index
+        :param zero_copy: should the columns share memory with the cached Arrow table where possible?
+            The returned frame will then be read only
+        """
+        return arrow_to_df(self.get_cached_query_arrow(), copy=not zero_copy)
+
+    async def aget_cached_query_arrow(self) -> pa.Table:
+        """
+        async version of get_cached_query_arrow, tables in the in memory cache are returned without leaving the loop
+        """
+        table = get_memory_cache().get(self._query_hash)
+        if table is not None:
+            get_cache_manifest().buffer_hit(self._query_hash)
+            print('Using In Memory Cache')
+            return table
+        return await run_blocking(self.get_cached_query_arrow)
+
+    async def aget_cached_query_df(self, zero_copy: bool = False) -> pd.DataFrame:
+        """
+        async version of get_cached_query_df
+        """
+        return await run_blocking(self.get_cached_query_df, zero_copy=zero_copy)
+
+    def _record_hit(self) -> float:
         """
-        path = f"'{self.get_cached_query_path()}'"
+        updates the manifest for a cache hit, cached files made before the manifest existed are added to it
+        :return: the time the query was cached
+        """
+        manifest = get_cache_manifest()
+        created = manifest.record_hit(self._query_hash)
+        if created is None:
+            manifest.record_store(self._query_hash, self._path)
+            created = os.path.getmtime(self._path)
 
-        con = SQLConnection(':memory:')
-        cached_results = con.execute(f"SELECT * FROM {path}").df()
-        con.close()
+        return created
 
-        file_creation = datetime.fromtimestamp(os.stat(self._path).st_birthtime)
-        file_age = (datetime.now() - file_creation).days
 
-        print(f'Using {file_age} Day Old Cache')
-        return cached_results
+def evict_cache() -> None:
+    """
+    applies the eviction policies in settings.py to the query cache
+    """
+    evicted = get_cache_manifest().evict(max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL,
+                                         policy=CACHE_EVICTION_POLICY)
+    _remove_from_memory(evicted)
+    print(f'Evicted {len(evicted)} Cached Queries')
+
+
+def _remove_from_memory(query_hashes: List[str]) -> None:
+    """
+    removes queries evicted from disk from the in memory cache so they can't be served without a manifest record
+    """
+    memory_cache = get_memory_cache()
+    for query_hash in query_hashes:
+        memory_cache.remove(query_hash)
+
+
+def arrow_to_df(table: pa.Table, copy: bool = True) -> pd.DataFrame:
+    """
+    converts an Arrow table to a DataFrame with the same types duckdb's fetchdf would give
+    decimals are turned into floats and dates into datetime64
+    :param table: the table to convert
+    :param copy: should the frame be consolidated into new memory?
+        If False then columns share memory with the table where possible and the frame is read only
+    """
+    for i, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+
+    return table.to_pandas(split_blocks=not copy, date_as_object=False)
+
+
+def invalidate_tables(tables: List[str]) -> None:
+    """
+    invalidates every cached query that reads from one of the given tables
+    :param tables: tables prefixed by their schema ex: ['cstat.funda', 'cstat.sd']
+    """
+    wanted = {f'table:{table.lower()}' for table in tables}
+    # tables evicted from disk by another process can still be in memory
+    for query_hash, memory_fingerprint in get_memory_cache().fingerprints().items():
+        if memory_fingerprint and wanted & set(json.loads(memory_fingerprint)):
+            get_memory_cache().remove(query_hash)
+
+    entries = get_cache_manifest().entries()
+
+    invalidated = 0
+    for query_hash, entry_fingerprint in zip(entries['query_hash'], entries['fingerprint']):
+        if entry_fingerprint and wanted & set(json.loads(entry_fingerprint)):
+            get_memory_cache().remove(query_hash)
+            get_cache_manifest().remove(query_hash)
+            invalidated += 1
+
+    print(f'Invalidated {invalidated} Cached Queries')
+
+
+def invalidate_stale_cache(sql_con: SQLConnection = None) -> None:
+    """
+    invalidates every cached query whose tables or files have changed since it was cached
+    :param sql_con: connection to the database the queries run on, if not passed then will use the default database
+    """
+    for query_hash, memory_fingerprint in get_memory_cache().fingerprints().items():
+        if memory_fingerprint and fingerprint(list(json.loads(memory_fingerprint)), sql_con) != memory_fingerprint:
+            get_memory_cache().remove(query_hash)
+
+    entries = get_cache_manifest().entries()
+
+    invalidated = 0
+    for query_hash, entry_fingerprint in zip(entries['query_hash'], entries['fingerprint']):
+        if not entry_fingerprint:
+            continue
+        if fingerprint(list(json.loads(entry_fingerprint)), sql_con) != entry_fingerprint:
+            get_memory_cache().remove(query_hash)
+            get_cache_manifest().remove(query_hash)
+            invalidated += 1
+
+    print(f'Invalidated {invalidated} Cached Queries')
 
 
 def clear_cache():
     files = glob.glob(f'{CACHE_DIRECTORY}/*.parquet')
     for f in files:
         os.remove(f)
+    get_cache_manifest().clear()
+    get_memory_cache().clear()
     print('Cleared Cache')
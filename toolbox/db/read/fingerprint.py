@@ -0,0 +1,162 @@
+import json
+import os
+import re
+import threading
+
+from typing import Dict, List, Optional, Set, Tuple
+
+from toolbox.db.api.sql_connection import SQLConnection
+
+TABLE_VERSIONS = 'meta.table_versions'
+
+_QUALIFIED_NAME = re.compile(r'\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b')
+_UNQUALIFIED_NAME = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)\b(?!\.)', re.IGNORECASE)
+_PARQUET_PATH = re.compile(r"'([^']+\.parquet)'")
+
+
+class _CatalogSnapshot:
+    """
+    the tables, table versions and estimated table row counts of a database at a database file modification time
+    """
+
+    def __init__(self, mtime: float, tables: Set[Tuple[str, str]], versions: Dict[str, str], rows: Dict[str, int]):
+        self.mtime = mtime
+        self.tables = tables
+        self.versions = versions
+        self.rows = rows
+
+    def version(self, table: str) -> str:
+        """
+        :param table: table prefixed by its schema, lowercase
+        :return: the version of the table
+        """
+        if table in self.versions:
+            return self.versions[table]
+        if table in self.rows:
+            return table_version(self.rows[table])
+        return 'missing'
+
+
+_SNAPSHOTS: Dict[str, _CatalogSnapshot] = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+
+
+def query_dependencies(sql: str, sql_con: Optional[SQLConnection] = None) -> List[str]:
+    """
+    finds the database tables and parquet files a query reads from
+    table names are only kept if they exist in the database so table aliases like data.date are ignored
+    :param sql: the query to find the dependencies for
+    :param sql_con: connection to the database the query runs on, if None then will use the default database
+    :return: sorted list of dependencies in the form 'table:schema.name' or 'file:/path/to/file.parquet'
+    """
+    dependencies = {f'file:{path}' for path in _PARQUET_PATH.findall(sql)}
+
+    snapshot = _get_snapshot(sql_con)
+    if snapshot is not None:
+        for schema, table in _QUALIFIED_NAME.findall(sql):
+            if (schema.lower(), table.lower()) in snapshot.tables:
+                dependencies.add(f'table:{schema.lower()}.{table.lower()}')
+
+        for table in _UNQUALIFIED_NAME.findall(sql):
+            if ('main', table.lower()) in snapshot.tables:
+                dependencies.add(f'table:main.{table.lower()}')
+
+    return sorted(dependencies)
+
+
+def fingerprint(dependencies: List[str], sql_con: Optional[SQLConnection] = None) -> str:
+    """
+    makes a fingerprint of the current state of the given dependencies.
+    tables are fingerprinted by the row count and update time kept in meta.table_versions by IngestDataBase,
+    tables that are not versioned fall back to duckdb's estimated row count, the same version IngestDataBase backfills
+    them with. files are fingerprinted by their modification time
+    :param dependencies: the dependencies from query_dependencies
+    :param sql_con: connection to the database the query runs on, if None then will use the default database
+    :return: json string mapping each dependency to its version
+    """
+    snapshot = _get_snapshot(sql_con) if any(dep.startswith('table:') for dep in dependencies) else None
+
+    versions = {}
+    for dep in dependencies:
+        kind, name = dep.split(':', 1)
+        if kind == 'file':
+            versions[dep] = str(os.path.getmtime(name)) if os.path.isfile(name) else 'missing'
+        elif snapshot is None:
+            versions[dep] = 'missing'
+        else:
+            versions[dep] = snapshot.version(name)
+
+    return json.dumps(versions, sort_keys=True)
+
+
+def table_version(row_count: int, updated=None) -> str:
+    """
+    formats the version of a table
+    :param row_count: the amount of rows in the table
+    :param updated: when the table was last loaded, None for tables that were backfilled rather than loaded
+    """
+    if updated is None:
+        return f'rows={row_count}'
+    return f'rows={row_count};updated={updated}'
+
+
+def current_table_version(table: str, sql_con: Optional[SQLConnection] = None) -> Tuple[str, Optional[int]]:
+    """
+    gets the version of a table without scanning it
+    :param table: table prefixed by its schema ex: 'crsp.sd'
+    :param sql_con: connection to the database the table is in, if None then will use the default database
+    :return: the version of the table and duckdb's estimated row count, ('missing', None) if the table is not found
+    """
+    snapshot = _get_snapshot(sql_con)
+    if snapshot is None:
+        return 'missing', None
+    return snapshot.version(table.lower()), snapshot.rows.get(table.lower())
+
+
+def changed_dependencies(old_fingerprint: str, new_fingerprint: str) -> List[str]:
+    """
+    :return: the dependencies whose version is different between two fingerprints
+    """
+    old, new = json.loads(old_fingerprint), json.loads(new_fingerprint)
+    return sorted(dep for dep in set(old) | set(new) if old.get(dep) != new.get(dep))
+
+
+def _get_snapshot(sql_con: Optional[SQLConnection]) -> Optional[_CatalogSnapshot]:
+    """
+    gets the tables and versions of a database.
+    the snapshot is only re-read when the database file has been modified so repeated lookups only cost a stat
+    :return: None if the connection is not to a database file
+    """
+    try:
+        con = sql_con if sql_con else SQLConnection(close_key='fingerprint')
+    except ValueError:
+        return None
+
+    path = con.connection_string()
+    if path == ':memory:' or not os.path.isfile(path):
+        return None
+
+    # duckdb may only write to the .wal file until it checkpoints
+    wal_path = f'{path}.wal'
+    mtime = max(os.path.getmtime(path), os.path.getmtime(wal_path) if os.path.isfile(wal_path) else 0)
+    with _SNAPSHOTS_LOCK:
+        snapshot = _SNAPSHOTS.get(path)
+    if snapshot is not None and snapshot.mtime == mtime:
+        return snapshot
+
+    catalog = con.execute('SELECT schema_name, table_name, estimated_size FROM duckdb_tables() '
+                          'WHERE NOT temporary').fetchall()
+    tables = {(row[0].lower(), row[1].lower()) for row in catalog}
+    rows = {f'{row[0].lower()}.{row[1].lower()}': row[2] for row in catalog}
+
+    versions = {}
+    if tuple(TABLE_VERSIONS.split('.')) in tables:
+        versions = {row[0]: table_version(row[1], row[2]) for row in con.execute(
+            f'SELECT table_name, row_count, updated FROM {TABLE_VERSIONS}').fetchall()}
+
+    con.close_with_key('fingerprint')
+
+    snapshot = _CatalogSnapshot(mtime=mtime, tables=tables, versions=versions, rows=rows)
+    with _SNAPSHOTS_LOCK:
+        _SNAPSHOTS[path] = snapshot
+    return snapshot
@@ -0,0 +1,124 @@
+import threading
+
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import pyarrow as pa
+
+from toolbox.db.settings import MEMORY_CACHE_MAX_BYTES
+
+
+class MemoryCache:
+    """
+    Bounded in process cache of Arrow tables keyed by query hash.
+    Sits in front of the parquet files of CachedQuery, least recently used tables are evicted once the cache is over
+    its size limit. Each table keeps the fingerprint it was cached with so a hit can be checked without the manifest
+    """
+
+    def __init__(self, max_bytes: int = MEMORY_CACHE_MAX_BYTES):
+        """
+        :param max_bytes: the max total size of the cached tables, 0 disables the cache
+        """
+        self._max_bytes = max_bytes
+        self._tables: 'OrderedDict[str, pa.Table]' = OrderedDict()
+        self._fingerprints: Dict[str, Optional[str]] = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: the total size of the cached tables in bytes
+        """
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    def __contains__(self, query_hash: str) -> bool:
+        return query_hash in self._tables
+
+    def get(self, query_hash: str) -> Optional[pa.Table]:
+        """
+        :param query_hash: the hash of the query
+        :return: the cached table, None if the query is not in the cache
+        """
+        with self._lock:
+            table = self._tables.get(query_hash)
+            if table is not None:
+                self._tables.move_to_end(query_hash)
+            return table
+
+    def fingerprint(self, query_hash: str) -> Optional[str]:
+        """
+        :param query_hash: the hash of the query
+        :return: the fingerprint the table was cached with, None if the query is not in the cache or has no fingerprint
+        """
+        with self._lock:
+            return self._fingerprints.get(query_hash)
+
+    def fingerprints(self) -> Dict[str, Optional[str]]:
+        """
+        :return: the fingerprint of every cached table keyed by query hash
+        """
+        with self._lock:
+            return dict(self._fingerprints)
+
+    def put(self, query_hash: str, table: pa.Table, fingerprint: Optional[str] = None) -> None:
+        """
+        adds a table to the cache then evicts the least recently used tables until the cache is under max_bytes
+        tables larger than max_bytes are not cached, the old table of the query is still removed so it is not served
+        :param query_hash: the hash of the query
+        :param table: the results of the query
+        :param fingerprint: the versions of the tables and files the query read from when it was cached
+        :return: None
+        """
+        with self._lock:
+            self._pop(query_hash)
+            if table.nbytes > self._max_bytes:
+                return
+
+            self._tables[query_hash] = table
+            self._fingerprints[query_hash] = fingerprint
+            self._nbytes += table.nbytes
+
+            while self._nbytes > self._max_bytes:
+                self._pop(next(iter(self._tables)))
+
+    def remove(self, query_hash: str) -> None:
+        """
+        removes a table from the cache if it is cached
+        :param query_hash: the hash of the query
+        :return: None
+        """
+        with self._lock:
+            self._pop(query_hash)
+
+    def clear(self) -> None:
+        """
+        removes every table from the cache
+        :return: None
+        """
+        with self._lock:
+            self._tables.clear()
+            self._fingerprints.clear()
+            self._nbytes = 0
+
+    def _pop(self, query_hash: str) -> None:
+        """
+        removes a table, must hold self._lock
+        """
+        table = self._tables.pop(query_hash, None)
+        self._fingerprints.pop(query_hash, None)
+        if table is not None:
+            self._nbytes -= table.nbytes
+
+
+_MEMORY_CACHE = MemoryCache()
+
+
+def get_memory_cache() -> MemoryCache:
+    """
+    :return: the process wide MemoryCache
+    """
+    return _MEMORY_CACHE
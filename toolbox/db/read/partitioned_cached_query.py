@@ -0,0 +1,195 @@
+import json
+
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from toolbox.db.api.sql_connection import SQLConnection
+from toolbox.db.read.cached_query import CachedQuery
+from toolbox.db.read.fingerprint import current_table_version, query_dependencies
+
+# placeholder for the date filter in a partitioned query template
+DATE_FILTER = '--partition_date_filter--'
+# key in the Arrow schema metadata holding the date range a cached segment covers
+_SEGMENT_KEY = b'toolbox_segment'
+
+
+class PartitionedCachedQuery:
+    """
+    Caches a timeseries query in date partitioned segments, one cached segment per period (ex: one per year).
+    Queries that only differ in their date range share segments, only the dates missing from the cache are queried.
+
+    A segment records the date range it covers, the version of the source table in meta.table_versions and the amount
+    of rows the source table had in that range. Reloading the source table gives it a new version so every segment is
+    re-queried, invalidate_tables also invalidates the segments of a table.
+    If rows are added to the source table without a new version then the rows in each segment's range are counted and
+    only the segments whose count changed are re-queried, so appending new dates only re-queries the latest segment.
+    The rows are only counted when duckdb's estimated row count of the table changed since the segment was cached
+    """
+
+    def __init__(self, template: str, table: str, start_date: str, end_date: str, freq: str = 'Y',
+                 sql_con: SQLConnection = None, register: Optional[Callable[[], None]] = None):
+        """
+        :param template: the query with its date filter replaced by DATE_FILTER
+        :param table: the timeseries table the query reads from, must be prefixed by the schema
+        :param start_date: the first date to get data on, anything pd.Timestamp can parse ex: '2020-01-31', '2020'
+        :param end_date: the last date to get data on, anything pd.Timestamp can parse
+        :param freq: the size of each cached segment, any pandas period frequency ex: 'Y', 'Q', 'M'
+        :param sql_con: the connection to run the query on
+        :param register: called once before the first query is sent to the database,
+            used to register the tables the template needs
+        """
+        self._template = template
+        self._table = table
+        self._start = pd.Timestamp(start_date).normalize()
+        self._end = pd.Timestamp(end_date).normalize()
+        self._freq = freq
+        self._sql_con = sql_con
+        self._register = register
+        self._registered = False
+        # the daily row counts of the partitioned table over the dates in _count_range, counted on demand
+        self._source_rows: Optional[pd.Series] = None
+        self._count_range: Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]] = (None, None)
+
+        # the partitioned table is always a dependency so a new version or invalidate_tables reaches the segments
+        self._dependencies = sorted(set(query_dependencies(template.replace(DATE_FILTER, 'TRUE'), sql_con)) |
+                                    {f'table:{table.lower()}'})
+
+    def get_arrow(self) -> pa.Table:
+        """
+        gets the results of the query, stitched together from the cached segments and the dates missing from the cache
+        dates after today are never cached
+        :return: Arrow table of the results, an empty table with the columns of the query if there are no dates
+        """
+        today = pd.Timestamp.today().normalize()
+        start = self._start
+        end = min(self._end, today)
+
+        pieces: List[pa.Table] = []
+        if start <= end:
+            periods = pd.period_range(start, end, freq=self._freq)
+            self._source_rows = None
+            self._count_range = (periods[0].start_time.normalize(), end)
+            version, table_rows = current_table_version(self._table, self._sql_con)
+
+            for period in periods:
+                need_start = max(period.start_time.normalize(), start)
+                need_end = min(period.end_time.normalize(), end)
+                segment = self._get_segment(period, need_end, version, table_rows)
+                pieces.append(_filter_dates(segment, need_start, need_end))
+
+        after_today = max(start, today + pd.Timedelta(days=1))
+        if after_today <= self._end:
+            pieces.append(self._fetch(after_today, self._end))
+
+        if not pieces:
+            # the start date is after the end date
+            return self._run('FALSE')
+        return _concat(pieces)
+
+    def _get_segment(self, period: pd.Period, need_end: pd.Timestamp, version: str,
+                     table_rows: Optional[int]) -> pa.Table:
+        """
+        gets the segment for a period, covering the start of the period through need_end
+        queries the database for the whole segment if it is not cached or is stale,
+        only queries the missing dates if the cached segment ends before need_end
+        :param version: the current version of the partitioned table
+        :param table_rows: duckdb's estimated row count of the partitioned table
+        """
+        period_start = period.start_time.normalize()
+        cq = CachedQuery(f'{self._template}\n-- partition {self._freq} {period}', sql_con=self._sql_con,
+                         dependencies=self._dependencies)
+
+        cached = cq.get_cached_query_arrow() if cq.is_query_cached() else None
+        segment = json.loads(cached.schema.metadata[_SEGMENT_KEY]) \
+            if cached is not None and cached.schema.metadata and _SEGMENT_KEY in cached.schema.metadata else None
+
+        if segment is not None:
+            covered_end = pd.Timestamp(segment['end'])
+            if segment.get('version') != version:
+                segment = None
+            elif segment.get('table_rows') != table_rows and \
+                    segment['source_rows'] != _count_rows(self._daily_source_rows(), period_start, covered_end):
+                segment = None
+
+        if segment is None:
+            table = self._fetch(period_start, need_end)
+        elif covered_end < need_end:
+            missing = self._fetch(covered_end + pd.Timedelta(days=1), need_end)
+            table = _concat([cached.replace_schema_metadata(None), missing])
+        elif segment.get('table_rows') != table_rows:
+            # rows were added outside of the segment, recording the new row count so they are not counted again
+            table = cached.replace_schema_metadata(None)
+        else:
+            return cached.replace_schema_metadata(None)
+
+        segment = {'start': str(period_start.date()), 'end': str(need_end.date()), 'version': version,
+                   'table_rows': table_rows,
+                   'source_rows': _count_rows(self._daily_source_rows(), period_start, need_end)}
+        cq.cache_arrow(table.replace_schema_metadata({_SEGMENT_KEY: json.dumps(segment).encode()}))
+
+        return table
+
+    def _fetch(self, start: pd.Timestamp, end: pd.Timestamp) -> pa.Table:
+        """
+        queries the database for the dates in [start, end]
+        """
+        return self._run(f"""data.date >= '{start:%Y-%m-%d}' AND
+                            data.date < '{end + pd.Timedelta(days=1):%Y-%m-%d}'""")
+
+    def _run(self, date_filter: str) -> pa.Table:
+        """
+        runs the template with the given date filter
+        """
+        if not self._registered and self._register:
+            self._register()
+        self._registered = True
+
+        return self._sql_con.arrow(self._template.replace(DATE_FILTER, date_filter))
+
+    def _daily_source_rows(self) -> pd.Series:
+        """
+        counts the rows per day of the partitioned table over the dates of the query,
+        only counted once per get_arrow and only when a segment has to be checked or cached
+        """
+        if self._source_rows is not None:
+            return self._source_rows
+
+        start, end = self._count_range
+        counts = self._sql_con.execute(f"""SELECT CAST(date AS DATE) AS day, count(*) AS num_rows
+                                            FROM {self._table}
+                                            WHERE date >= '{start:%Y-%m-%d}' AND
+                                                date < '{end + pd.Timedelta(days=1):%Y-%m-%d}'
+                                            GROUP BY 1""").fetchdf()
+        self._source_rows = pd.Series(counts['num_rows'].to_numpy(),
+                                      index=pd.DatetimeIndex(counts['day'])).sort_index()
+        return self._source_rows
+
+
+def _count_rows(source_rows: pd.Series, start: pd.Timestamp, end: pd.Timestamp) -> int:
+    """
+    the amount of source rows in [start, end]
+    """
+    return int(source_rows.loc[start:end].sum())
+
+
+def _filter_dates(table: pa.Table, start: pd.Timestamp, end: pd.Timestamp) -> pa.Table:
+    """
+    keeps the rows of a table with a date in [start, end]
+    """
+    dates = pd.DatetimeIndex(table.column('date').to_numpy())
+    keep = (dates >= start) & (dates < end + pd.Timedelta(days=1))
+    if keep.all():
+        return table
+    return table.filter(pa.array(np.asarray(keep)))
+
+
+def _concat(tables: List[pa.Table]) -> pa.Table:
+    """
+    concatenates tables, casting them to the schema of the first table.
+    a parquet round trip can change some Arrow types (ex: string views) so cached and fresh tables can differ
+    """
+    schema = tables[0].schema
+    return pa.concat_tables([table if table.schema.equals(schema) else table.cast(schema) for table in tables])
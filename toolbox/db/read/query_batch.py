@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+
+from toolbox.db.read.cached_query import arrow_to_df
+from toolbox.db.read.query_constructor import QueryConstructor
+from toolbox.db.settings import DB_POOL_SIZE
+
+
+class QueryBatch:
+    """
+    Runs many QueryConstructors at once.
+    Queries with the same sql are only run once, the cache is checked for every query before anything is run and the
+    queries that are not cached are run concurrently, each on its own pooled connection.
+    Queries that share a SQLConnection are run one after another since a duckdb connection can't run queries in
+    parallel
+    """
+
+    def __init__(self, queries: Iterable[QueryConstructor] = (), max_workers: int = DB_POOL_SIZE):
+        """
+        :param queries: the queries to run
+        :param max_workers: the max amount of queries to run at once,
+            running more queries than DB_POOL_SIZE at once will wait on the connection pool
+        """
+        if max_workers < 1:
+            raise ValueError('max_workers must be greater than zero')
+
+        self._queries: List[QueryConstructor] = list(queries)
+        self._max_workers = max_workers
+
+    def add(self, query: QueryConstructor):
+        """
+        adds a query to the batch
+        :return: self
+        """
+        self._queries.append(query)
+        return self
+
+    def __len__(self) -> int:
+        return len(self._queries)
+
+    def arrow(self) -> List[pa.Table]:
+        """
+        runs the queries and returns the Arrow results in the order the queries were added
+        the freq and index options are not applied, the date column is a timestamp
+        """
+        # the index of the first query with the same sql on the same database and the same cache option,
+        # it is the one that gets run
+        first_seen: Dict[Tuple[str, str, bool], int] = {}
+        runs_as = []
+        for i, qc in enumerate(self._queries):
+            runs_as.append(first_seen.setdefault((qc._con.connection_string(), qc.raw_sql, qc._cache), i))
+
+        unique = sorted(set(runs_as))
+        results: Dict[int, pa.Table] = {}
+
+        for i in unique:
+            cached = self._queries[i]._cached_arrow()
+            if cached is not None:
+                results[i] = cached
+
+        # queries sharing a connection have to run on the same worker one after another
+        by_connection: Dict[int, List[int]] = {}
+        for i in unique:
+            if i not in results:
+                by_connection.setdefault(id(self._queries[i]._con), []).append(i)
+
+        if by_connection:
+            print(f'Running {sum(len(group) for group in by_connection.values())} Queries, '
+                  f'{len(results)} Found in Cache')
+            with ThreadPoolExecutor(max_workers=min(self._max_workers, len(by_connection))) as executor:
+                futures = [executor.submit(self._run_group, group) for group in by_connection.values()]
+                for future in futures:
+                    results.update(future.result())
+
+        for qc in self._queries:
+            qc._con.close_with_key(QueryConstructor.__name__)
+
+        return [results[i] for i in runs_as]
+
+    def df(self, copy: bool = True) -> List[pd.DataFrame]:
+        """
+        runs the queries and returns the DataFrames in the order the queries were added
+        each query applies its own freq and index options
+        :param copy: should the returned frames own their memory?
+            If False then the columns are zero copy views of the Arrow results and the frames are read only
+        """
+        return [qc._make_df_changes(arrow_to_df(table, copy=copy)) for qc, table in zip(self._queries, self.arrow())]
+
+    def _run_group(self, group: List[int]) -> Dict[int, pa.Table]:
+        """
+        runs queries that share a connection one after another
+        """
+        return {i: self._queries[i]._execute_arrow() for i in group}
+
+
+def run_many(queries: Iterable[QueryConstructor], max_workers: int = DB_POOL_SIZE,
+             as_arrow: bool = False) -> List[Union[pd.DataFrame, pa.Table]]:
+    """
+    runs many QueryConstructors at once, see QueryBatch
+    :param queries: the queries to run
+    :param max_workers: the max amount of queries to run at once
+    :param as_arrow: should the results be Arrow tables instead of DataFrames?
+    :return: the results in the order of queries
+    """
+    batch = QueryBatch(queries, max_workers=max_workers)
+    return batch.arrow() if as_arrow else batch.df()
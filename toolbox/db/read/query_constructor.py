@@ -1,13 +1,18 @@
-from typing import Iterable, List, Optional, Tuple, Union, Dict
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union, Dict
 
 import re
 import hashlib
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 
+from toolbox.db.api.executor import run_blocking
 from toolbox.db.api.sql_connection import SQLConnection
-from toolbox.db.read.cached_query import CachedQuery
+from toolbox.db.read.cached_query import CachedQuery, arrow_to_df
+from toolbox.db.read.partitioned_cached_query import DATE_FILTER, PartitionedCachedQuery
+from toolbox.db.read.query_profiler import QueryProfile, record_profile, start_profile, timed
 from toolbox.db.read.universe import dispatch_universe_path
-from toolbox.db.settings import DB_ADJUSTOR_FIELDS
+from toolbox.db.settings import DB_ADJUSTOR_FIELDS, CACHE_PARTITION_FREQ
 
 # try to import sqlparse, but not required
 try:
@@ -15,6 +20,12 @@ try:
 except ImportError as e:
     pass
 
+# try to import polars, but not required
+try:
+    import polars as pl
+except ImportError as e:
+    pass
+
 # this allows compatibility with python 3.6
 try:
     import pandas_market_calendars as mcal
@@ -30,15 +41,22 @@ class QueryConstructor:
         possibly cache the data in a feather file
     """
 
-    def __init__(self, sql_con: SQLConnection = None, cache: bool = True, freq: Optional[str] = 'D'):
+    def __init__(self, sql_con: SQLConnection = None, cache: bool = True, freq: Optional[str] = 'D',
+                 partition_freq: Optional[str] = CACHE_PARTITION_FREQ):
         """
         :param sql_con: the connection to the database, if non is passed then will use default SQLConnection
         :param cache: should we check the cache and see if this query has been executed before?
             and should we cache this query?
         :param freq: frequency for the period, if None then return a Timestamp
+        :param partition_freq: the size of the date partitions timeseries queries are cached in ex: 'Y', 'Q', 'M'
+            queries that only differ in their dates then share the cached partitions. If None then will cache the
+            whole query
         """
         self._con: SQLConnection = sql_con if sql_con else SQLConnection(close_key=self.__class__.__name__)
         self._cache = cache
+        self._partition_freq = partition_freq
+        # the state of the query when query_timeseries_table was called, None if the query can't be partitioned
+        self._partition_source = None
 
         self._query_string = {'select': '', 'from': '', 'where': '', 'group_by': '', 'window': '', 'order_by': ''}
         self._df_options = {'freq': freq, 'index': []}
@@ -88,24 +106,249 @@ class QueryConstructor:
         """
         executes the sql query that the user has created
         """
-        raw_sql = self.raw_sql
+        return self.to_df()
 
-        # getting the cached file
-        cq = CachedQuery(raw_sql) if self._cache else None
-        if self._cache and cq.is_query_cached():
-            raw_df = cq.get_cached_query_df()
-        else:
-            self._register_universe()
-            raw_df = self._con.execute(raw_sql).fetchdf()
+    def to_df(self, copy: bool = True) -> pd.DataFrame:
+        """
+        executes the sql query that the user has created
+        :param copy: should the returned frame own its memory?
+            If False then the columns are zero copy views of the Arrow results and the frame is read only
+        """
+        profile = start_profile(self.raw_sql)
+        raw_table = self._run_arrow(profile)
+
+        with timed(profile, 'convert_seconds'):
+            df = self._make_df_changes(arrow_to_df(raw_table, copy=copy))
 
-        # caching the query
-        if self._cache and not cq.is_query_cached():
-            cq.cache_query(raw_df)
+        record_profile(profile)
+        return df
+
+    async def adf(self, copy: bool = True) -> pd.DataFrame:
+        """
+        async version of self.to_df(), the query runs on the shared executor so the event loop is not blocked
+        cancelling the awaiting task interrupts the query
+        :param copy: should the returned frame own its memory?
+            If False then the columns are zero copy views of the Arrow results and the frame is read only
+        """
+        return await run_blocking(self.to_df, copy=copy, sql_con=self._con)
+
+    async def aarrow(self) -> pa.Table:
+        """
+        async version of self.arrow, the query runs on the shared executor so the event loop is not blocked
+        cancelling the awaiting task interrupts the query
+        """
+        return await run_blocking(lambda: self.arrow, sql_con=self._con)
+
+    @property
+    def arrow(self) -> pa.Table:
+        """
+        executes the sql query that the user has created and returns the Arrow results
+        the freq and index options are not applied, the date column is a timestamp
+        """
+        profile = start_profile(self.raw_sql)
+        raw_table = self._run_arrow(profile)
+        record_profile(profile)
+        return raw_table
+
+    def explain(self, analyze: bool = False) -> str:
+        """
+        gets duckdb's physical plan for the query
+        :param analyze: should the query be run so the plan has the time spent and rows made by each operator?
+        :return: the plan as text
+        """
+        self._register_universe()
+        plan = self._con.execute(f"EXPLAIN {'ANALYZE ' if analyze else ''}{self.raw_sql}").fetchall()
+        self._con.close_with_key(self.__class__.__name__)
+
+        return '\n'.join(row[1] for row in plan)
+
+    def _run_arrow(self, profile: Optional[QueryProfile] = None) -> pa.Table:
+        """
+        gets the Arrow results from the cache or the database then closes the connection if the user did not pass it
+        :param profile: records the time spent in each step and the size of the results, None to not profile
+        """
+        raw_table = self._cached_arrow(profile)
+        if raw_table is None:
+            raw_table = self._execute_arrow(profile)
+        elif profile is not None:
+            profile.cache = 'hit'
+
+        if profile is not None:
+            profile.rows = raw_table.num_rows
+            profile.bytes = raw_table.nbytes
 
         # if the user did not pass the connection then close it
         self._con.close_with_key(self.__class__.__name__)
 
-        return self._make_df_changes(raw_df)
+        return raw_table
+
+    def _cached_arrow(self, profile: Optional[QueryProfile] = None) -> Optional[pa.Table]:
+        """
+        looks for the whole query in the cache without running it,
+        queries cached in date partitions are only cached in their segments so are never found here
+        :param profile: records the time spent looking in the cache, None to not profile
+        :return: the cached Arrow results, None if the query is not cached
+        """
+        if not self._cache or self._can_partition():
+            return None
+
+        with timed(profile, 'cache_seconds'):
+            cq = CachedQuery(self.raw_sql, sql_con=self._con)
+            return cq.get_cached_query_arrow() if cq.is_query_cached() else None
+
+    def _execute_arrow(self, profile: Optional[QueryProfile] = None) -> pa.Table:
+        """
+        runs the query on the database and caches the results if self._cache
+        :param profile: records the time spent registering the universe, running and caching the query,
+            None to not profile
+        """
+        def register():
+            with timed(profile, 'register_seconds'):
+                self._register_universe()
+
+        raw_sql = self.raw_sql
+        partitioned = self._partitioned_cached_query(register=register) if self._cache else None
+        if partitioned is not None:
+            if profile is not None:
+                profile.cache = 'partitioned'
+            with timed(profile, 'execute_seconds'):
+                raw_table = partitioned.get_arrow()
+            if profile is not None:
+                # registering happens while the partitions are being fetched
+                profile.execute_seconds -= profile.register_seconds
+        else:
+            register()
+            with timed(profile, 'execute_seconds'):
+                raw_table = self._con.arrow(raw_sql)
+
+        if self._cache and partitioned is None:
+            with timed(profile, 'cache_seconds'):
+                CachedQuery(raw_sql, sql_con=self._con).cache_arrow(raw_table)
+
+        return raw_table
+
+    def _can_partition(self) -> bool:
+        """
+        checks if the query can be cached in date partitions.
+        Only timeseries queries on a list of assets that have not been changed since query_timeseries_table, other than
+        extra where conditions, can be partitioned. Universes are filtered by the query dates and windows, joins and
+        resampling can look across the partition boundaries
+        """
+        source = self._partition_source
+        if not self._partition_freq or source is None:
+            return False
+
+        query_string = source['query_string']
+        if any(self._query_string[part] != query_string[part] for part in query_string if part != 'where') or \
+                not self._query_string['where'].startswith(query_string['where']):
+            return False
+
+        return self.raw_sql.count(source['date_filter']) == 1
+
+    def _partitioned_cached_query(self, register: Optional[Callable[[], None]] = None) \
+            -> Optional[PartitionedCachedQuery]:
+        """
+        makes a PartitionedCachedQuery for the query if it can be cached in date partitions, see _can_partition
+        :param register: registers the universe before the first partition is fetched,
+            if None then will use self._register_universe
+        :return: None if the query can't be partitioned
+        """
+        if not self._can_partition():
+            return None
+
+        source = self._partition_source
+        raw_sql = self.raw_sql
+        return PartitionedCachedQuery(raw_sql.replace(source['date_filter'], DATE_FILTER), table=source['table'],
+                                      start_date=source['start_date'], end_date=source['end_date'],
+                                      freq=self._partition_freq, sql_con=self._con,
+                                      register=register if register else self._register_universe)
+
+    def iter_batches(self, rows: int = 1_000_000, as_arrow: bool = False) -> Iterator[Union[pd.DataFrame,
+                                                                                               pa.RecordBatch]]:
+        """
+        executes the sql query that the user has created and streams the results in chunks of rows
+        the query is not cached, the connection is closed once the generator is exhausted
+        :param rows: the max amount of rows in each chunk
+        :param as_arrow: should the chunks be Arrow record batches instead of DataFrames?
+            The freq and index options are only applied to DataFrames
+        :return: generator of chunks
+        """
+        for batch in self._iter_raw_batches(self.raw_sql, rows):
+            yield batch if as_arrow else self._finish_chunk(pa.Table.from_batches([batch]), as_arrow)
+
+    def iter_dates(self, freq: str = 'Y', rows: int = 1_000_000,
+                   as_arrow: bool = False) -> Iterator[Union[pd.DataFrame, pa.Table]]:
+        """
+        executes the sql query that the user has created and streams the results one date period at a time
+        the results are sorted by date in duckdb, which spills to disk if needed, and cut at each period boundary
+        so only one period is held in memory. The query is not cached
+        :param freq: the size of each period, any pandas period frequency ex: 'Y', 'Q', 'M'
+        :param rows: the amount of rows to fetch from duckdb at a time
+        :param as_arrow: should the chunks be Arrow tables instead of DataFrames?
+            The freq and index options are only applied to DataFrames
+        :return: generator of chunks, one per period that has data
+        """
+        sql = f"""SELECT * FROM ({self.raw_sql}) AS chunked ORDER BY date"""
+
+        pending: List[pa.Table] = []
+        pending_key = None
+
+        for batch in self._iter_raw_batches(sql, rows):
+            if 'date' not in batch.schema.names:
+                raise ValueError('iter_dates needs the query to have a date column')
+
+            table = pa.Table.from_batches([batch])
+            keys = pd.DatetimeIndex(table.column('date').to_numpy()).to_period(freq).asi8
+            bounds = [0] + (np.flatnonzero(np.diff(keys)) + 1).tolist() + [len(keys)]
+
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if start == end:
+                    continue
+                if pending and keys[start] != pending_key:
+                    yield self._finish_chunk(pa.concat_tables(pending), as_arrow)
+                    pending = []
+                pending.append(table.slice(start, end - start))
+                pending_key = keys[start]
+
+        if pending:
+            yield self._finish_chunk(pa.concat_tables(pending), as_arrow)
+
+    def _iter_raw_batches(self, sql: str, rows: int) -> Iterator[pa.RecordBatch]:
+        """
+        streams the record batches of a query, closes the connection once the stream is exhausted
+        """
+        self._register_universe()
+
+        try:
+            yield from self._con.arrow_reader(sql, rows=rows)
+        finally:
+            self._con.close_with_key(self.__class__.__name__)
+
+    def _finish_chunk(self, table: pa.Table, as_arrow: bool) -> Union[pd.DataFrame, pa.Table]:
+        """
+        applies the freq and index options to a streamed chunk
+        """
+        return table if as_arrow else self._make_df_changes(arrow_to_df(table))
+
+    @property
+    def numpy(self) -> Dict[str, np.ndarray]:
+        """
+        executes the sql query that the user has created and returns a dict of column name to numpy array
+        the freq and index options are not applied
+        """
+        raw_table = self.arrow
+        return {name: raw_table.column(name).to_numpy() for name in raw_table.column_names}
+
+    @property
+    def polars(self):
+        """
+        executes the sql query that the user has created and returns a polars DataFrame built from the Arrow results
+        polars must be installed, the freq and index options are not applied
+        :raise ImportError: if polars is not installed
+        """
+        if 'pl' not in globals():
+            raise ImportError('polars is required for QueryConstructor.polars, install it with "pip install polars"')
+        return pl.from_arrow(self.arrow)
 
     @property
     def asset_tables(self) -> Dict[str, Union[str, pd.DataFrame]]:
@@ -176,6 +419,11 @@ class QueryConstructor:
         self._query_metadata['asset_id'] = search_by
         self._query_metadata['fields'] = fields + ['date']
 
+        # universes are filtered by the query dates so only a list of assets can be cached in date partitions
+        self._partition_source = None if isinstance(assets, str) else {
+            'table': table, 'start_date': start_date, 'end_date': end_date,
+            'date_filter': self._query_string['where'], 'query_string': dict(self._query_string)}
+
         return self
 
     def query_static_table(self, table: str, fields: List[str], assets: Union[Iterable[any], str],
@@ -0,0 +1,181 @@
+import csv
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import pandas as pd
+
+PROFILE_FIELDS = ['started', 'sql_hash', 'cache', 'cache_seconds', 'register_seconds', 'execute_seconds',
+                  'convert_seconds', 'rows', 'bytes']
+
+
+class QueryProfile:
+    """
+    The timings of one QueryConstructor call.
+    cache is 'hit' if the results came from the cache, 'miss' if the query ran on the database and 'partitioned' if the
+    query was stitched together from date partitioned cache segments
+    """
+
+    def __init__(self, sql: str):
+        """
+        :param sql: the sql of the query being profiled
+        """
+        self.started = time.time()
+        self.sql_hash = hashlib.sha224(sql.encode()).hexdigest().upper()
+        self.cache = 'miss'
+        self.cache_seconds = 0.0
+        self.register_seconds = 0.0
+        self.execute_seconds = 0.0
+        self.convert_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def to_dict(self) -> dict:
+        """
+        :return: the profile as a dict with the keys in PROFILE_FIELDS
+        """
+        return {field: getattr(self, field) for field in PROFILE_FIELDS}
+
+
+class ProfileSink(ABC):
+    """
+    Somewhere to send QueryProfiles, subclasses must implement record
+    """
+
+    @abstractmethod
+    def record(self, profile: QueryProfile) -> None:
+        """
+        sends a profile to the sink, called once for every profiled QueryConstructor call
+        :param profile: the timings of the call
+        :return: None
+        """
+        pass
+
+
+class LogSink(ProfileSink):
+    """
+    Logs every profile at the info level
+    """
+
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        """
+        :param logger: the logger to write to, if None then will use the 'toolbox.db.profiler' logger
+        """
+        self._logger = logger if logger else logging.getLogger('toolbox.db.profiler')
+
+    def record(self, profile: QueryProfile) -> None:
+        self._logger.info(f'Query {profile.sql_hash[:12]} cache={profile.cache} '
+                          f'lookup={profile.cache_seconds:.3f}s register={profile.register_seconds:.3f}s '
+                          f'execute={profile.execute_seconds:.3f}s convert={profile.convert_seconds:.3f}s '
+                          f'rows={profile.rows} bytes={profile.bytes}')
+
+
+class CSVSink(ProfileSink):
+    """
+    Appends every profile to a csv file, the header is written when the file is made
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: the path to the csv file
+        """
+        self._path = path
+        self._lock = threading.Lock()
+
+    def record(self, profile: QueryProfile) -> None:
+        with self._lock:
+            write_header = not os.path.isfile(self._path)
+            with open(self._path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=PROFILE_FIELDS)
+                if write_header:
+                    writer.writeheader()
+                writer.writerow(profile.to_dict())
+
+
+class RingBufferSink(ProfileSink):
+    """
+    Keeps the most recent profiles in memory
+    """
+
+    def __init__(self, max_records: int = 10_000):
+        """
+        :param max_records: the amount of profiles to keep, older profiles are dropped
+        """
+        self._records = deque(maxlen=max_records)
+
+    def record(self, profile: QueryProfile) -> None:
+        self._records.append(profile)
+
+    @property
+    def records(self) -> List[QueryProfile]:
+        """
+        :return: the kept profiles oldest first
+        """
+        return list(self._records)
+
+    def df(self) -> pd.DataFrame:
+        """
+        :return: DataFrame of the kept profiles, columns are PROFILE_FIELDS
+        """
+        return pd.DataFrame([profile.to_dict() for profile in self.records], columns=PROFILE_FIELDS)
+
+    def clear(self) -> None:
+        self._records.clear()
+
+
+_SINKS: List[ProfileSink] = []
+
+
+def enable_profiling(*sinks: ProfileSink) -> None:
+    """
+    starts profiling QueryConstructor calls, every profile is sent to each of the sinks
+    :param sinks: where to send the profiles, if none are passed then will log the profiles
+    """
+    _SINKS.extend(sinks if sinks else [LogSink()])
+
+
+def disable_profiling() -> None:
+    """
+    stops profiling and removes all sinks
+    """
+    _SINKS.clear()
+
+
+def start_profile(sql: str) -> Optional[QueryProfile]:
+    """
+    :return: a new profile for the query, None if profiling is off
+    """
+    return QueryProfile(sql) if _SINKS else None
+
+
+def record_profile(profile: Optional[QueryProfile]) -> None:
+    """
+    sends a finished profile to the sinks, does nothing if profile is None
+    """
+    if profile is None:
+        return
+    for sink in list(_SINKS):
+        sink.record(profile)
+
+
+@contextmanager
+def timed(profile: Optional[QueryProfile], attribute: str) -> Iterator[None]:
+    """
+    adds the time spent in the block to an attribute of the profile, does nothing if profile is None
+    """
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(profile, attribute, getattr(profile, attribute) + time.perf_counter() - start)
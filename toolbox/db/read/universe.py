@@ -6,6 +6,7 @@ import pandas as pd
 from typing import Union
 
 from toolbox.db.settings import ADD_ALL_LINKS_TO_PERMNO, ETF_UNI_DIRECTORY, BUILT_UNI_DIRECTORY
+from toolbox.db.api.executor import run_blocking
 from toolbox.db.api.sql_connection import SQLConnection
 
 # this allows compatibility with python 3.6
@@ -81,6 +82,15 @@ class ETFUniverse:
 
         return etf_uni[(etf_uni['date'] > start_date) & (etf_uni['date'] < end_date)]
 
+    async def aget_universe_df(self, ticker: str = None, crsp_portno: int = None, start_date: str = '2000',
+                               end_date: str = '2023') -> pd.DataFrame:
+        """
+        async version of get_universe_df, runs on the shared executor so the event loop is not blocked
+        cancelling the awaiting task interrupts the holdings query
+        """
+        return await run_blocking(self.get_universe_df, ticker=ticker, crsp_portno=crsp_portno, start_date=start_date,
+                                  end_date=end_date, sql_con=self._con)
+
     def get_universe_path(self, ticker: str = None, crsp_portno: int = None):
         """
         gets the SQL code to read cached universe constitutes for an etf
@@ -4,9 +4,21 @@ Define Global Settings
 
 DB_CONNECTION_STRING = '/Users/alex/Desktop/DB/wrds.duckdb'  # the directory to the sql database
 CACHE_DIRECTORY = '/tmp'  # the directory to cache files, QueryConstructor gets cached here
+CACHE_MAX_BYTES = 5 * 1024 ** 3  # max total size of the query cache, None for no limit
+CACHE_MAX_ENTRIES = None  # max amount of cached queries, None for no limit
+CACHE_TTL = None  # max age of a cached query in seconds, None for no limit
+CACHE_EVICTION_POLICY = 'LRU'  # order to evict cached queries in when over a limit, 'LRU' or 'LFU'
+CACHE_PARTITION_FREQ = 'Y'  # size of the date partitions timeseries queries are cached in, None to cache whole queries
+MEMORY_CACHE_MAX_BYTES = 2 * 1024 ** 3  # max size of the in process cache in front of the query cache, 0 disables it
+MEMORY_CACHE_HIT_FLUSH = 100  # in memory cache hits kept in the process before they are written to the manifest
 ETF_UNI_DIRECTORY = '/tmp'  # '/Users/alex/Desktop/DB/universes/etf'  # the directory to save ETF Universes
 BUILT_UNI_DIRECTORY = '/Users/alex/Desktop/DB/universes/built'  # directory to save custom-built universes
 
+DB_POOL_CONNECTIONS = True  # should read only SQLConnections check connections out of a process wide pool
+DB_POOL_SIZE = 8  # the max amount of connections that can be checked out of a pool at once
+DB_POOL_TIMEOUT = 30  # seconds to wait for a pooled connection before raising a TimeoutError
+DB_ASYNC_MAX_CONCURRENCY = 8  # the max amount of blocking database calls the async api runs at once
+
 DB_ADJUSTOR_FIELDS = {
     'cstat.sd': [
         {
@@ -2,6 +2,8 @@ import logging
 from typing import Dict, List
 
 from toolbox.db.api.sql_connection import SQLConnection
+from toolbox.db.read.cached_query import invalidate_tables
+from toolbox.db.read.fingerprint import TABLE_VERSIONS
 
 logging.basicConfig(format='%(message)s ::: %(asctime)s', datefmt='%I:%M:%S %p', level=logging.INFO)
 
@@ -48,11 +50,14 @@ class IngestDataBase:
                 self._alter_types(tbl_to_create)  # changing types of data
                 self._to_lowercase(tbl_to_create)  # making all column names lowercase
                 self._create_index(tbl_to_create)  # making indexes
+                self._record_version(tbl_to_create)  # letting the query cache know the table changed
 
         except Exception as e:
             self._sql_api.close()
             raise e
 
+        invalidate_tables([self._get_table_name(tbl_to_create) for tbl_to_create in to_insert])
+
         if close:
             self._sql_api.close()
             logging.info('Closed SQL Connection')
@@ -195,6 +200,34 @@ class IngestDataBase:
 
         logging.info('\tSuccessfully made all columns lowercase')
 
+    def _record_version(self, tbl_to_create) -> None:
+        """
+        records the row count and update time of a table in meta.table_versions
+        cached queries are only invalidated when a table they read from has a new version.
+        When meta.table_versions is made every existing table is backfilled with the version the query cache already
+        gave it, so loading one table does not invalidate the queries on the others
+        :param tbl_to_create: dict defining the table we want to create
+        :return: None
+        """
+        tbl_name = self._get_table_name(tbl_to_create)
+        schema, table = TABLE_VERSIONS.split('.')
+        exists = self._sql_api.execute(f"""SELECT count(*) FROM duckdb_tables()
+                                        WHERE schema_name = '{schema}' AND table_name = '{table}'""").fetchone()[0]
+
+        if not exists:
+            self._sql_api.execute(f'CREATE SCHEMA IF NOT EXISTS {schema};')
+            self._sql_api.execute(f"""CREATE TABLE {TABLE_VERSIONS}
+                                    (table_name VARCHAR PRIMARY KEY, row_count BIGINT, updated TIMESTAMP);""")
+            self._sql_api.execute(f"""INSERT INTO {TABLE_VERSIONS}
+                                    SELECT lower(schema_name || '.' || table_name), estimated_size, NULL
+                                    FROM duckdb_tables() WHERE NOT temporary AND schema_name != '{schema}';""")
+            logging.info(f'\tBackfilled {TABLE_VERSIONS}')
+
+        self._sql_api.execute(f"""INSERT OR REPLACE INTO {TABLE_VERSIONS}
+                                SELECT '{tbl_name.lower()}', count(*), now()::TIMESTAMP FROM {tbl_name};""")
+
+        logging.info(f'\tRecorded version of {tbl_name}')
+
     @staticmethod
     def _get_table_name(tbl_to_create) -> str:
         """
@@ -1,2 +1,9 @@
 import constitute_adjustment_test
 import ml_factor_calculation_test
+import membership_store_test
+import utils_test
+import connection_pool_test
+import cache_manifest_test
+import cached_query_test
+import fingerprint_test
+import query_constructor_test
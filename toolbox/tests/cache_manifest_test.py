@@ -0,0 +1,138 @@
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from toolbox.db.read.cache_manifest import CacheManifest
+
+
+class CacheManifestTest(unittest.TestCase):
+
+    def examples(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+        # every call to time.time() is one second after the last so access order is never a tie
+        clock = mock.patch('toolbox.db.read.cache_manifest.time')
+        clock.start().time.side_effect = itertools.count(1_000)
+        self.addCleanup(clock.stop)
+
+        self.manifest = CacheManifest(self.directory)
+        self.paths = {}
+        for query_hash in ['A', 'B', 'C']:
+            self.paths[query_hash] = os.path.join(self.directory, f'{query_hash}.parquet')
+            with open(self.paths[query_hash], 'wb') as f:
+                f.write(b'0' * 100)
+            self.manifest.record_store(query_hash, self.paths[query_hash], fingerprint='{}')
+
+    def cached(self):
+        return sorted(self.manifest.entries()['query_hash'])
+
+    #
+    #  ************************************  record  ************************************
+    #
+
+    def test_record(self):
+        """
+        ensuring stores and hits are recorded
+        """
+        self.examples()
+
+        self.assertEqual(1_000, self.manifest.record_hit('A'))
+        self.manifest.record_hit('A')
+        self.assertIsNone(self.manifest.record_hit('D'))
+
+        record = self.manifest.get('A')
+        self.assertEqual(2, record['hits'])
+        self.assertEqual(100, record['size'])
+        self.assertEqual('{}', record['fingerprint'])
+        self.assertIsNone(self.manifest.get('D'))
+
+    def test_remove(self):
+        """
+        ensuring removing a query deletes the record and the file
+        """
+        self.examples()
+
+        self.manifest.remove('B')
+        self.assertEqual(['A', 'C'], self.cached())
+        self.assertFalse(os.path.isfile(self.paths['B']))
+
+        self.manifest.clear()
+        self.assertEqual([], self.cached())
+        self.assertTrue(os.path.isfile(self.paths['A']))
+
+    def test_buffer_hit(self):
+        """
+        ensuring buffered hits are only written once hit_flush of them are buffered or the manifest is read
+        """
+        self.examples()
+        manifest = CacheManifest(self.directory, hit_flush=3)
+
+        with mock.patch.object(CacheManifest, '_connect', wraps=manifest._connect) as connect:
+            manifest.buffer_hit('A')
+            manifest.buffer_hit('A')
+            connect.assert_not_called()
+            manifest.buffer_hit('B')
+            self.assertEqual(1, connect.call_count)
+
+        self.assertEqual((2, 1), (manifest.get('A')['hits'], manifest.get('B')['hits']))
+
+        manifest.buffer_hit('C')
+        entries = manifest.entries().set_index('query_hash')
+        self.assertEqual([2, 1, 1], list(entries.loc[['A', 'B', 'C'], 'hits']))
+        self.assertEqual('C', entries.index[0])
+
+    #
+    #  ************************************  evict  ************************************
+    #
+
+    def test_evict_lru(self):
+        """
+        ensuring the least recently used queries are evicted first
+        """
+        self.examples()
+        self.manifest.record_hit('A')
+
+        self.assertEqual(['B'], self.manifest.evict(max_entries=2))
+        self.assertEqual(['C'], self.manifest.evict(max_bytes=100))
+        self.assertEqual(['A'], self.cached())
+        self.assertFalse(os.path.isfile(self.paths['B']))
+        self.assertFalse(os.path.isfile(self.paths['C']))
+
+    def test_evict_lfu(self):
+        """
+        ensuring the least frequently used queries are evicted first, ties are broken by the last access
+        """
+        self.examples()
+        for query_hash in ['A', 'A', 'C', 'B', 'B']:
+            self.manifest.record_hit(query_hash)
+
+        self.assertEqual(['C'], self.manifest.evict(max_entries=2, policy='LFU'))
+        self.assertEqual(['A'], self.manifest.evict(max_entries=1, policy='lfu'))
+
+        # buffered hits are written before evicting
+        self.manifest.buffer_hit('A')
+        self.manifest.buffer_hit('A')
+        self.assertEqual(['B'], self.manifest.evict(max_entries=0, policy='LFU', protect='A'))
+
+    def test_evict_ttl_and_protect(self):
+        """
+        ensuring expired queries are evicted even when under the size limits and protected queries are never evicted
+        """
+        self.examples()
+
+        # the clock is at 1_003, A and B were made more than 1.5 seconds ago
+        self.assertEqual(['A'], self.manifest.evict(ttl=1.5, protect='B'))
+        self.assertEqual(['B', 'C'], self.cached())
+        self.assertEqual(['C'], self.manifest.evict(max_entries=0, protect='B'))
+
+        with self.assertRaises(ValueError) as em:
+            self.manifest.evict(policy='FIFO')
+        self.assertTrue(str(em.exception).startswith('Eviction policy FIFO is not recognised'))
+
+
+if __name__ == '__main__':
+    unittest.main()
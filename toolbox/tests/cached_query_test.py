@@ -0,0 +1,173 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import duckdb
+import pyarrow as pa
+
+from toolbox.db.api.connection_pool import close_connection_pools
+from toolbox.db.api.sql_connection import SQLConnection
+from toolbox.db.read.cache_manifest import CacheManifest
+from toolbox.db.read.cached_query import (CachedQuery, evict_cache, get_cache_manifest, invalidate_stale_cache,
+                                          invalidate_tables)
+from toolbox.db.read.memory_cache import MemoryCache, get_memory_cache
+
+
+class CachedQueryTest(unittest.TestCase):
+
+    def examples(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.addCleanup(close_connection_pools)
+        self.addCleanup(get_memory_cache().clear)
+
+        for name, value in [('CACHE_DIRECTORY', directory), ('_MANIFEST', None)]:
+            patcher = mock.patch(f'toolbox.db.read.cached_query.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.db_path = os.path.join(directory, 'test.duckdb')
+        con = duckdb.connect(self.db_path)
+        con.execute('CREATE TABLE foo AS SELECT range AS x FROM range(10)')
+        con.close()
+
+        self.sql_con = SQLConnection(self.db_path, pooled=False)
+        self.addCleanup(self.sql_con.close)
+        self.sql = 'SELECT sum(x) AS total FROM main.foo'
+
+    def run_query(self) -> int:
+        """
+        runs self.sql through the cache the same way QueryConstructor does
+        """
+        cq = CachedQuery(self.sql, sql_con=self.sql_con)
+        if cq.is_query_cached():
+            return cq.get_cached_query_arrow().column('total')[0].as_py()
+
+        table = self.sql_con.arrow(self.sql)
+        cq.cache_arrow(table)
+        return table.column('total')[0].as_py()
+
+    def update_foo(self):
+        """
+        doubles the values in foo, the row count stays the same
+        """
+        self.sql_con.close()
+        with SQLConnection(self.db_path, read_only=False) as writer:
+            writer.execute('UPDATE foo SET x = x * 2')
+
+    #
+    #  ************************************  MemoryCache  ************************************
+    #
+
+    def test_memory_cache(self):
+        """
+        ensuring the least recently used tables are evicted once over max_bytes
+        """
+        table = pa.table({'x': list(range(100))})
+        cache = MemoryCache(max_bytes=int(table.nbytes * 2.5))
+
+        cache.put('A', table)
+        cache.put('B', table)
+        self.assertIs(table, cache.get('A'))
+        cache.put('C', table)
+
+        self.assertEqual(2, len(cache))
+        self.assertNotIn('B', cache)
+        self.assertEqual(table.nbytes * 2, cache.nbytes)
+
+        cache.put('D', pa.table({'x': list(range(1_000))}))
+        self.assertNotIn('D', cache)
+
+        # a new table too large to cache replaces the old table of the query
+        cache.put('C', pa.table({'x': list(range(1_000))}))
+        self.assertNotIn('C', cache)
+        self.assertEqual(table.nbytes, cache.nbytes)
+
+        cache.remove('A')
+        self.assertIsNone(cache.get('A'))
+        cache.clear()
+        self.assertEqual(0, cache.nbytes)
+
+    def test_memory_tier(self):
+        """
+        ensuring a cached query is served from memory without touching the manifest and the memory hits are recorded
+        in the manifest when it is read
+        """
+        self.examples()
+
+        self.assertEqual(45, self.run_query())
+        self.assertIn(CachedQuery(self.sql)._query_hash, get_memory_cache())
+
+        with mock.patch('toolbox.db.read.cached_query.pq.read_table') as read_table, \
+                mock.patch.object(CacheManifest, '_connect') as connect:
+            self.assertEqual(45, self.run_query())
+            self.assertEqual(45, self.run_query())
+        read_table.assert_not_called()
+        # the manifest is not read or written until the buffered hits are needed
+        connect.assert_not_called()
+        self.assertEqual(2, get_cache_manifest().entries()['hits'][0])
+
+    def test_memory_tier_stale(self):
+        """
+        ensuring a table in memory is not served once a table the query reads from has a new version
+        """
+        self.examples()
+
+        self.assertEqual(45, self.run_query())
+        self.sql_con.close()
+        with SQLConnection(self.db_path, read_only=False) as writer:
+            writer.execute('INSERT INTO foo VALUES (10)')
+
+        self.assertEqual(55, self.run_query())
+
+    #
+    #  ************************************  eviction  ************************************
+    #
+
+    def test_evicted_not_in_memory(self):
+        """
+        ensuring a query evicted from disk is not served from memory after its table changes
+        """
+        self.examples()
+
+        self.assertEqual(45, self.run_query())
+        get_cache_manifest().evict(max_entries=0)
+        self.update_foo()
+        invalidate_tables(['main.foo'])
+        invalidate_stale_cache(self.sql_con)
+
+        self.assertEqual(90, self.run_query())
+
+    def test_evict_cache_clears_memory(self):
+        """
+        ensuring evict_cache removes the queries it evicts from memory
+        """
+        self.examples()
+
+        self.assertEqual(45, self.run_query())
+        with mock.patch('toolbox.db.read.cached_query.CACHE_MAX_ENTRIES', 0):
+            evict_cache()
+
+        self.assertEqual(0, len(get_memory_cache()))
+        self.assertFalse(CachedQuery(self.sql, sql_con=self.sql_con).is_query_cached())
+
+    def test_cache_arrow_evicts_memory(self):
+        """
+        ensuring caching a query removes the queries it evicts from memory
+        """
+        self.examples()
+
+        with mock.patch('toolbox.db.read.cached_query.CACHE_MAX_ENTRIES', 1):
+            self.run_query()
+            first = CachedQuery(self.sql)._query_hash
+            self.sql = 'SELECT max(x) AS total FROM main.foo'
+            self.run_query()
+
+        self.assertNotIn(first, get_memory_cache())
+        self.assertEqual(1, len(get_memory_cache()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import duckdb
+
+from toolbox.db.api.connection_pool import ConnectionPool, close_connection_pools, get_connection_pool
+from toolbox.db.api.sql_connection import SQLConnection
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def examples(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.addCleanup(close_connection_pools)
+
+        self.db_path = os.path.join(directory, 'test.duckdb')
+        con = duckdb.connect(self.db_path)
+        con.execute('CREATE TABLE foo AS SELECT range AS x FROM range(10)')
+        con.close()
+
+        self.pool = ConnectionPool(self.db_path, max_size=2, timeout=.05)
+        self.addCleanup(self.pool.close)
+
+    #
+    #  ************************************  checkout  ************************************
+    #
+
+    def test_checkout_checkin(self):
+        """
+        ensuring connections are reused and counted
+        """
+        self.examples()
+
+        cursor = self.pool.checkout()
+        self.assertEqual(45, cursor.execute('SELECT sum(x) FROM foo').fetchone()[0])
+        self.assertEqual(1, self.pool.checked_out)
+
+        self.pool.checkin(cursor)
+        self.assertEqual(0, self.pool.checked_out)
+        self.assertEqual(1, self.pool.idle)
+        self.assertIs(cursor, self.pool.checkout())
+
+    def test_checkout_timeout(self):
+        """
+        ensuring a checkout waits then raises once every connection is checked out
+        """
+        self.examples()
+
+        cursors = [self.pool.checkout(), self.pool.checkout()]
+        with self.assertRaises(TimeoutError):
+            self.pool.checkout()
+
+        self.pool.checkin(cursors[0])
+        self.assertIs(cursors[0], self.pool.checkout(timeout=0))
+
+    def test_checkin_drops_temp_tables(self):
+        """
+        ensuring the temp tables and views made on a connection are gone when it is checked out again
+        """
+        self.examples()
+
+        cursor = self.pool.checkout()
+        cursor.execute('CREATE TEMP TABLE bar AS SELECT 1 AS y')
+        cursor.execute('CREATE TEMP VIEW baz AS SELECT 2 AS z')
+        self.pool.checkin(cursor)
+
+        cursor = self.pool.checkout()
+        self.assertEqual(0, cursor.execute('SELECT count(*) FROM duckdb_tables() WHERE temporary').fetchone()[0])
+        self.assertEqual(0, cursor.execute("""SELECT count(*) FROM duckdb_views()
+                                                WHERE temporary AND NOT internal""").fetchone()[0])
+
+    def test_close(self):
+        """
+        ensuring a closed pool can't be checked out of and connections checked in after closing are closed
+        """
+        self.examples()
+
+        cursor = self.pool.checkout()
+        self.pool.close()
+
+        with self.assertRaises(ValueError) as em:
+            self.pool.checkout()
+        self.assertEqual(f'Connection pool for {self.db_path} is closed', str(em.exception))
+
+        self.pool.checkin(cursor)
+        self.assertEqual(0, self.pool.checked_out)
+        self.assertEqual(0, self.pool.idle)
+        with self.assertRaises(duckdb.Error):
+            cursor.execute('SELECT 1')
+
+    def test_max_size(self):
+        """
+        ensuring a pool must be able to hand out a connection
+        """
+        with self.assertRaises(ValueError) as em:
+            ConnectionPool(':memory:', max_size=0)
+        self.assertEqual('max_size must be greater than zero', str(em.exception))
+
+    #
+    #  ************************************  SQLConnection  ************************************
+    #
+
+    def test_sql_connection_pooled(self):
+        """
+        ensuring read only SQLConnections share one pool and give their connection back on close
+        """
+        self.examples()
+
+        pool = get_connection_pool(self.db_path)
+        with SQLConnection(self.db_path, pooled=True) as con:
+            self.assertTrue(con.pooled)
+            self.assertEqual(10, con.execute('SELECT count(*) FROM foo').fetchone()[0])
+            self.assertEqual(1, pool.checked_out)
+
+        self.assertEqual(0, pool.checked_out)
+        self.assertIs(pool, get_connection_pool(self.db_path))
+
+    def test_writable_sql_connection_closes_pools(self):
+        """
+        ensuring a writable SQLConnection closes the read only pools of its database so duckdb can open it
+        """
+        self.examples()
+
+        reader = SQLConnection(self.db_path, pooled=True)
+        reader.execute('SELECT 1')
+        pool = get_connection_pool(self.db_path)
+        reader.close()
+
+        with SQLConnection(self.db_path, read_only=False) as writer:
+            self.assertFalse(writer.pooled)
+            writer.execute('INSERT INTO foo VALUES (10)')
+
+        with self.assertRaises(ValueError):
+            pool.checkout()
+        self.assertIsNot(pool, get_connection_pool(self.db_path))
+
+        with SQLConnection(self.db_path, pooled=True) as reader:
+            self.assertEqual(11, reader.execute('SELECT count(*) FROM foo').fetchone()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,7 @@
 import unittest
+from unittest import mock
+
+import duckdb
 
 from pandas import (
     Timestamp,
@@ -7,6 +10,8 @@ from pandas import (
     MultiIndex
 )
 
+from pandas.testing import assert_series_equal
+
 from toolbox.constitutes.constitute_adjustment import ConstituteAdjustment
 
 
@@ -98,6 +103,20 @@ class ConstituteAdjustmentTest(unittest.TestCase):
                                                   (Timestamp('2010-01-12', tz='UTC'), 'LARY')]
         self.assertTrue(MultiIndex.from_tuples(pricing_components).equals(self.ca.pricing_components))
 
+    def test_compact_add_index_info(self):
+        """
+        ensuring the compact membership expands to the same index constitutes
+        """
+        self.examples()
+
+        compact_ca = ConstituteAdjustment(compact=True)
+        compact_ca.add_index_info(start_date=Timestamp(year=2010, month=1, day=4, tz='UTC'),
+                                  end_date=Timestamp(year=2010, month=1, day=12, tz='UTC'),
+                                  index_constitutes=self.foo_constitutes, date_format='%Y%m%d')
+
+        self.assertTrue(self.ca.factor_components.equals(compact_ca.factor_components))
+        self.assertTrue(self.ca.pricing_components.equals(compact_ca.pricing_components))
+
     def test_throw_column_error(self):
         """
         ensuring a error will be thrown when the correct columns are not supplied
@@ -152,6 +171,65 @@ class ConstituteAdjustmentTest(unittest.TestCase):
 
         self.assertTrue(self.adjusted_pricing.sort_index().equals(filtered.sort_index()))
 
+    def test_compact_adjust_data_for_membership(self):
+        """
+        ensuring the compact membership adjusts data the same as the duckdb join, including the dtypes
+        """
+        self.examples()
+
+        compact_ca = ConstituteAdjustment(compact=True)
+        compact_ca.add_index_info(start_date=Timestamp(year=2010, month=1, day=4, tz='UTC'),
+                                  end_date=Timestamp(year=2010, month=1, day=12, tz='UTC'),
+                                  index_constitutes=self.foo_constitutes, date_format='%Y%m%d')
+
+        for contents, expected in [('factor', self.adjusted_foo), ('pricing', self.adjusted_pricing)]:
+            filtered = self.ca.adjust_data_for_membership(data=self.foo_data, date_format='%Y-%m-%d',
+                                                          contents=contents).sort_index()
+            compact = compact_ca.adjust_data_for_membership(data=self.foo_data, date_format='%Y-%m-%d',
+                                                            contents=contents).sort_index()
+
+            assert_series_equal(filtered, compact)
+            self.assertEqual('Int64', str(compact.dtype))
+            assert_series_equal(expected['factor'].sort_index().astype('Int64'), compact, check_index_type=False)
+
+    def test_adjust_many(self):
+        """
+        ensuring adjust_many matches adjusting one at a time and the membership table is only registered once,
+        then rebuilt when the index constitutes change
+        """
+        self.examples()
+        data = {'foo': self.foo_data, 'bar': self.foo_data.assign(factor=self.foo_data['factor'] * 2)}
+
+        with mock.patch.object(MultiIndex, 'to_frame', autospec=True, side_effect=MultiIndex.to_frame) as to_frame:
+            adjusted = self.ca.adjust_many(data, date_format='%Y-%m-%d')
+            self.assertEqual(['foo', 'bar'], list(adjusted))
+            assert_series_equal(adjusted['foo'] * 2, adjusted['bar'])
+            assert_series_equal(self.ca.adjust_data_for_membership(self.foo_data, date_format='%Y-%m-%d'),
+                                adjusted['foo'])
+            self.assertEqual(1, to_frame.call_count)
+
+            self.ca.add_index_info(start_date=Timestamp(year=2010, month=1, day=4, tz='UTC'),
+                                   end_date=Timestamp(year=2010, month=1, day=12, tz='UTC'),
+                                   index_constitutes=self.foo_constitutes.iloc[[0]], date_format='%Y%m%d')
+            adjusted = self.ca.adjust_many(data, date_format='%Y-%m-%d')
+            self.assertEqual(2, to_frame.call_count)
+            self.assertEqual(['BOB'], list(adjusted['foo'].index.get_level_values('symbol').unique()))
+
+    def test_close(self):
+        """
+        ensuring close closes the duckdb session and the next adjustment opens a new one
+        """
+        self.examples()
+
+        expected = self.ca.adjust_data_for_membership(self.foo_data, date_format='%Y-%m-%d')
+        con = self.ca._get_con()
+        self.ca.close()
+
+        with self.assertRaises(duckdb.ConnectionException):
+            con.execute('SELECT 1')
+        assert_series_equal(expected, self.ca.adjust_data_for_membership(self.foo_data, date_format='%Y-%m-%d'))
+        self.ca.close()
+
     def test_throw_error_adjust_data_for_membership(self):
         """
         ensuring adjust_data_for_membership throws error when not given symbols or date
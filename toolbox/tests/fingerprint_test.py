@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import duckdb
+
+from toolbox.db.api.connection_pool import close_connection_pools
+from toolbox.db.api.sql_connection import SQLConnection
+from toolbox.db.read.cached_query import CachedQuery
+from toolbox.db.read.fingerprint import changed_dependencies, fingerprint, query_dependencies
+from toolbox.db.read.memory_cache import get_memory_cache
+from toolbox.db.write.create_tables import IngestDataBase
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def examples(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.addCleanup(close_connection_pools)
+        self.addCleanup(get_memory_cache().clear)
+
+        for name, value in [('CACHE_DIRECTORY', self.directory), ('_MANIFEST', None)]:
+            patcher = mock.patch(f'toolbox.db.read.cached_query.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # a database made before tables were versioned
+        self.db_path = os.path.join(self.directory, 'test.duckdb')
+        con = duckdb.connect(self.db_path)
+        for schema in ['crsp', 'cstat']:
+            con.execute(f'CREATE SCHEMA {schema}')
+            con.execute(f'CREATE TABLE {schema}.sd AS SELECT range AS x FROM range(10)')
+        con.close()
+
+        self.csv_path = os.path.join(self.directory, 'sd.csv')
+        with open(self.csv_path, 'w') as f:
+            f.write('x\n' + '\n'.join(str(i) for i in range(12)))
+
+        self.sql_con = SQLConnection(self.db_path, pooled=False)
+        self.addCleanup(self.sql_con.close)
+
+    def write(self, sql: str):
+        """
+        runs sql on a writable connection
+        """
+        self.sql_con.close()
+        with SQLConnection(self.db_path, read_only=False) as writer:
+            writer.execute(sql)
+
+    def ingest(self, schema: str):
+        """
+        reloads schema.sd from self.csv_path
+        """
+        self.sql_con.close()
+        IngestDataBase(self.db_path).ingest([{'schema': schema, 'table': 'sd', 'file_path': self.csv_path}],
+                                            overwrite=True)
+
+    #
+    #  ************************************  dependencies  ************************************
+    #
+
+    def test_query_dependencies(self):
+        """
+        ensuring tables and parquet files are found and aliases that look like tables are not
+        """
+        self.examples()
+
+        sql = """SELECT data.x FROM crsp.sd AS data JOIN cstat.sd ON data.x = cstat.sd.x
+                    JOIN '/tmp/foo.parquet' AS foo ON foo.x = data.x"""
+        self.assertEqual(['file:/tmp/foo.parquet', 'table:crsp.sd', 'table:cstat.sd'],
+                         query_dependencies(sql, self.sql_con))
+
+    def test_changed_dependencies(self):
+        """
+        ensuring only the changed versions are found
+        """
+        old = json.dumps({'table:crsp.sd': 'rows=1', 'table:cstat.sd': 'rows=1'})
+        new = json.dumps({'table:crsp.sd': 'rows=1', 'table:cstat.sd': 'rows=2', 'file:/a.parquet': '1'})
+        self.assertEqual(['file:/a.parquet', 'table:cstat.sd'], changed_dependencies(old, new))
+
+    #
+    #  ************************************  fingerprint  ************************************
+    #
+
+    def test_unversioned_fingerprint(self):
+        """
+        ensuring a table with no version is fingerprinted by its rows, not by the modification time of the database
+        """
+        self.examples()
+
+        before = fingerprint(['table:crsp.sd', 'table:main.missing'], self.sql_con)
+        self.assertEqual({'table:crsp.sd': 'rows=10', 'table:main.missing': 'missing'}, json.loads(before))
+
+        self.write('CREATE TABLE main.other AS SELECT 1 AS y')
+        self.assertEqual(before, fingerprint(['table:crsp.sd', 'table:main.missing'], self.sql_con))
+
+        self.write('INSERT INTO crsp.sd VALUES (10)')
+        self.assertEqual({'table:crsp.sd': 'rows=11', 'table:main.missing': 'missing'},
+                         json.loads(fingerprint(['table:crsp.sd', 'table:main.missing'], self.sql_con)))
+
+    def test_first_ingest_keeps_other_caches(self):
+        """
+        ensuring the first load into a database made before tables were versioned only invalidates the loaded table
+        """
+        self.examples()
+
+        queries = {schema: CachedQuery(f'SELECT sum(x) AS total FROM {schema}.sd', sql_con=self.sql_con)
+                   for schema in ['crsp', 'cstat']}
+        for schema, cq in queries.items():
+            cq.cache_arrow(self.sql_con.arrow(f'SELECT sum(x) AS total FROM {schema}.sd'))
+
+        self.ingest('cstat')
+
+        self.assertTrue(CachedQuery(queries['crsp']._query, sql_con=self.sql_con).is_query_cached())
+        self.assertFalse(CachedQuery(queries['cstat']._query, sql_con=self.sql_con).is_query_cached())
+
+        versions = dict(self.sql_con.execute('SELECT table_name, row_count FROM meta.table_versions').fetchall())
+        self.assertEqual({'crsp.sd': 10, 'cstat.sd': 12}, versions)
+
+    def test_ingest_changes_version(self):
+        """
+        ensuring every load gives the table a new version even when its row count stays the same
+        """
+        self.examples()
+
+        self.ingest('cstat')
+        first = fingerprint(['table:cstat.sd'], self.sql_con)
+        self.ingest('cstat')
+        second = fingerprint(['table:cstat.sd'], self.sql_con)
+
+        self.assertNotEqual(first, second)
+        self.assertTrue(json.loads(second)['table:cstat.sd'].startswith('rows=12;updated='))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+
+import numpy as np
+from pandas import (
+    Timestamp,
+    DataFrame
+)
+
+from toolbox.constitutes.membership_store import MembershipStore
+
+
+class MembershipStoreTest(unittest.TestCase):
+
+    def examples(self):
+        self.big_constitutes = DataFrame(data=[
+            # symbol    entered     exited
+            ['BOB', '20090101', '20120101'],  # whole thing
+            ['LARY', '20100105', '20100107'],  # added and then exited
+            ['JEFF', '20110302', '20200302']],  # added too late
+            columns=['symbol', 'from', 'thru']
+        )
+        self.small_constitutes = DataFrame(data=[
+            ['LARY', '20100106', '20100111'],
+            ['CARL', '20100104', '20100105']],
+            columns=['symbol', 'from', 'thru']
+        )
+
+        self.store = MembershipStore()
+        for name, constitutes in [('big', self.big_constitutes), ('small', self.small_constitutes)]:
+            self.store.add_index_info(name, start_date=Timestamp(year=2010, month=1, day=4, tz='UTC'),
+                                      end_date=Timestamp(year=2010, month=1, day=12, tz='UTC'),
+                                      index_constitutes=constitutes, date_format='%Y%m%d')
+
+    #
+    #  ************************************  members  ************************************
+    #
+
+    def test_members(self):
+        """
+        ensuring members gives the assets in a universe on a date
+        """
+        self.examples()
+
+        self.assertEqual(['BOB', 'LARY'], sorted(self.store.members('big', '2010-01-06')))
+        self.assertEqual(['BOB'], sorted(self.store.members('big', '2010-01-08')))
+        self.assertEqual(['CARL'], sorted(self.store.members('small', '2010-01-04')))
+        self.assertEqual([], sorted(self.store.members('small', '2010-01-12')))
+
+    def test_shared_assets(self):
+        """
+        ensuring universes share one dictionary of assets, JEFF has no dates in range but is still an asset
+        """
+        self.examples()
+
+        self.assertEqual(['BOB', 'CARL', 'JEFF', 'LARY'], sorted(self.store.assets))
+        self.assertEqual(['big', 'small'], self.store.universes)
+
+    #
+    #  ************************************  is_member  ************************************
+    #
+
+    def test_is_member(self):
+        """
+        ensuring is_member checks each asset on its paired date, unknown assets and dates out of range are not members
+        """
+        self.examples()
+
+        assets = ['BOB', 'LARY', 'LARY', 'LARY', 'CARL', 'FOO', 'BOB']
+        dates = ['2010-01-04', '2010-01-04', '2010-01-05', '2010-01-08', '2010-01-05', '2010-01-05', '2011-01-05']
+
+        self.assertEqual([True, False, True, False, False, False, False],
+                         list(self.store.is_member('big', assets, dates)))
+        self.assertEqual([False, False, False, True, True, False, False],
+                         list(self.store.is_member('small', assets, dates)))
+
+    def test_not_loaded_universe(self):
+        """
+        ensuring a ValueError is raised for a universe that is not loaded
+        """
+        self.examples()
+
+        with self.assertRaises(ValueError) as em:
+            self.store.members('foo', '2010-01-04')
+        self.assertEqual("Universe foo is not loaded. Loaded universes are ['big', 'small']", str(em.exception))
+
+    #
+    #  ************************************  adjust_data_for_membership  ************************************
+    #
+
+    def test_adjust_data_for_membership(self):
+        """
+        ensuring adjust_data_for_membership only keeps the members of the given universe
+        """
+        self.examples()
+
+        data = DataFrame(data=[['LARY', '2010-01-05', 21],
+                               ['LARY', '2010-01-06', 22],
+                               ['LARY', '2010-01-11', 25],
+                               ['CARL', '2010-01-05', 1]],
+                         columns=['symbol', 'date', 'factor'])
+
+        filtered = self.store.adjust_data_for_membership(data, universe='small', date_format='%Y-%m-%d')
+
+        expected_index = [(Timestamp('2010-01-04', tz='UTC'), 'CARL'),
+                          (Timestamp('2010-01-05', tz='UTC'), 'CARL'),
+                          (Timestamp('2010-01-06', tz='UTC'), 'LARY'),
+                          (Timestamp('2010-01-07', tz='UTC'), 'LARY'),
+                          (Timestamp('2010-01-08', tz='UTC'), 'LARY'),
+                          (Timestamp('2010-01-11', tz='UTC'), 'LARY')]
+        self.assertEqual(expected_index, list(filtered.sort_index().index))
+        np.testing.assert_array_equal([np.nan, 1, 22, np.nan, np.nan, 25], filtered.sort_index().to_numpy())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,77 @@
+import os
+import tempfile
 import unittest
 from abc import ABC
 
 import numpy as np
 import pandas as pd
 
-from toolbox.utils.ml_factor_calculation import ModelWrapper, calc_ml_factor, generate_indexes
-from toolbox.utils.ml_factor_calculation import SliceHolder
+from toolbox.utils.ml_factor_calculation import ModelWrapper, calc_ml_factor, generate_indexes, fold_plan
+from toolbox.utils.ml_factor_calculation import SliceHolder, _sorted
+
+
+class MeanModel(ModelWrapper):
+    """
+    predicts the mean of the target plus the sum of the features, defined at the module level so it can be pickled
+    """
+
+    class _Fitted:
+        def __init__(self, mean: float):
+            self.mean = mean
+
+        def predict(self, features: pd.DataFrame) -> np.ndarray:
+            return self.mean + features.to_numpy().sum(axis=1)
+
+    def fit_model(self, tf: pd.DataFrame, tt: pd.Series):
+        return MeanModel._Fitted(tt.mean())
+
+
+class RunningMeanModel(MeanModel):
+    """
+    MeanModel that keeps a running sum of the target rather than refitting, counts the calls to each fit method
+    """
+    supports_partial_fit = True
+    fits = 0
+    partial_fits = 0
+
+    def fit_model(self, tf: pd.DataFrame, tt: pd.Series):
+        RunningMeanModel.fits += 1
+        return super().fit_model(tf, tt)
+
+    def partial_fit_model(self, new_features: pd.DataFrame, new_target: pd.Series, state):
+        RunningMeanModel.partial_fits += 1
+        total, count = (state.total, state.count) if state is not None else (0.0, 0)
+        fitted = MeanModel._Fitted((total + new_target.sum()) / (count + len(new_target)))
+        fitted.total, fitted.count = total + new_target.sum(), count + len(new_target)
+        return fitted
+
+
+class CountingModel(MeanModel):
+    """
+    MeanModel that counts the calls to fit_model
+    """
+    fits = 0
+
+    def fit_model(self, tf: pd.DataFrame, tt: pd.Series):
+        CountingModel.fits += 1
+        return super().fit_model(tf, tt)
+
+
+class Float32Model(MeanModel):
+    """
+    MeanModel that wants float32 features, its transform_data upcasts them to float64
+    """
+    feature_dtype = 'float32'
+
+    def fit_model(self, tf: pd.DataFrame, tt: pd.Series):
+        if not (tf.dtypes == np.float32).all():
+            raise ValueError('features are not float32')
+        return super().fit_model(tf, tt)
+
+    @staticmethod
+    def transform_data(train_features, train_target, predict):
+        # upcasting, should be cast back to float32
+        return train_features.astype('float64'), predict.astype('float64')
 
 
 class MyTestCase(unittest.TestCase):
@@ -85,6 +151,11 @@ class MyTestCase(unittest.TestCase):
         self.fooFeatures = pd.DataFrame(index=self.date_index)
         self.fooFeatures.loc[:] = 0
 
+        rng = np.random.default_rng(0)
+        self.rand_features = pd.DataFrame(rng.normal(size=(len(self.date_index), 2)), index=self.date_index,
+                                          columns=['a', 'b'])
+        self.rand_target = pd.Series(rng.normal(size=len(self.date_index)), index=self.date_index)
+
     #
     #  ************************************  generate_indexes  ************************************
     #
@@ -123,6 +194,57 @@ class MyTestCase(unittest.TestCase):
 
         self.assertEqual(str(self.expected_index_r7_8_30), str(returnedIndexesR7_8_30))
 
+    def test_positional_generateIndexes(self):
+        """
+        testing generate indexes returns the row offsets of the date slices when positional is True
+        """
+        self.examples()
+
+        for kwargs in [dict(eval_days=10, refit_every=5, expanding=30), dict(eval_days=7, refit_every=8, rolling=30)]:
+            dates = self.date_index.get_level_values(0)
+            date_slices = list(generate_indexes(data_index=self.date_index, **kwargs))
+            positional_slices = list(generate_indexes(data_index=self.date_index, positional=True, **kwargs))
+
+            self.assertEqual(len(date_slices), len(positional_slices))
+            for date_pair, positional_pair in zip(date_slices, positional_slices):
+                for date_slice, positional_slice in zip(date_pair, positional_pair):
+                    self.assertEqual(dates.searchsorted(date_slice.start, 'left'), positional_slice.start)
+                    self.assertEqual(dates.searchsorted(date_slice.end, 'right'), positional_slice.end)
+
+        # 3 symbols a day, first expanding fold trains on the first 30 days and predicts days 40 to 44
+        first_train, first_predict = next(generate_indexes(data_index=self.date_index, eval_days=10, refit_every=5,
+                                                           expanding=30, positional=True))
+        self.assertEqual('0, 90', str(first_train))
+        self.assertEqual('120, 135', str(first_predict))
+
+    def test_fold_plan(self):
+        """
+        testing the fold plan has the same folds as generate_indexes and purge and embargo move the windows
+        """
+        self.examples()
+
+        plan = fold_plan(data_index=self.date_index, eval_days=7, refit_every=8, rolling=30)
+        positional = list(generate_indexes(data_index=self.date_index, eval_days=7, refit_every=8, rolling=30,
+                                           positional=True))
+        self.assertEqual(str(self.expected_index_r7_8_30),
+                         str([(SliceHolder(f.train_start.to_datetime64(), f.train_end.to_datetime64()),
+                               SliceHolder(f.predict_start.to_datetime64(), f.predict_end.to_datetime64()))
+                              for f in plan.itertuples()]))
+        self.assertEqual(str(positional),
+                         str([(SliceHolder(f.train_start_row, f.train_stop_row),
+                               SliceHolder(f.predict_start_row, f.predict_stop_row)) for f in plan.itertuples()]))
+
+        # purge shortens the training windows, embargo moves the predicting windows later
+        gapped = fold_plan(data_index=self.date_index, eval_days=7, refit_every=8, rolling=30, purge=2, embargo=3)
+        self.assertTrue((gapped.train_start == plan.train_start).all())
+        self.assertTrue((gapped.train_end == plan.train_end - pd.Timedelta(days=2)).all())
+        self.assertTrue((gapped.predict_start == plan.predict_start + pd.Timedelta(days=3)).all())
+        self.assertEqual(plan.predict_end.iloc[-1], gapped.predict_end.iloc[-1])
+
+        with self.assertRaises(ValueError) as em:
+            fold_plan(data_index=self.date_index, eval_days=7, refit_every=8, rolling=30, purge=30)
+        self.assertEqual('purge must be less than the amount of training days', str(em.exception))
+
     #
     #  ************************************  calcMlFactor  ************************************
     #
@@ -212,6 +334,172 @@ class MyTestCase(unittest.TestCase):
                            refit_every=1)
         self.assertEqual('There are nan or inf values in the target', str(em.exception))
 
+    def test_n_jobs_calc_ml_factor(self):
+        """
+        testing the folds fit in processes give the same predictions as the folds fit in order
+        """
+        self.examples()
+        features, target = self.rand_features, self.rand_target
+
+        expected = calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                                  rolling=30)
+        parallel = calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                                  rolling=30, n_jobs=2)
+        pd.testing.assert_series_equal(expected, parallel)
+
+        with self.assertRaises(ValueError) as em:
+            calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                           rolling=30, n_jobs=0)
+        self.assertEqual('n_jobs must be greater than zero or -1', str(em.exception))
+
+    def test_checkpoint_calc_ml_factor(self):
+        """
+        testing a rerun with a checkpoint only fits the folds that were not saved
+        """
+        self.examples()
+        features, target = self.rand_features, self.rand_target
+
+        CountingModel.fits = 0
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            expected = calc_ml_factor(model=CountingModel(), features=features, target=target, eval_days=7,
+                                      refit_every=8, rolling=30, checkpoint_dir=checkpoint_dir, model_id='mean')
+            self.assertEqual(3, CountingModel.fits)
+
+            # losing the last fold
+            run_dir = os.path.join(checkpoint_dir, os.listdir(checkpoint_dir)[0])
+            os.remove(os.path.join(run_dir, 'fold_000002.parquet'))
+
+            resumed = calc_ml_factor(model=CountingModel(), features=features, target=target, eval_days=7,
+                                     refit_every=8, rolling=30, checkpoint_dir=checkpoint_dir, model_id='mean')
+            self.assertEqual(4, CountingModel.fits)
+            pd.testing.assert_series_equal(expected, resumed)
+
+            # different parameters do not use the checkpoint
+            calc_ml_factor(model=CountingModel(), features=features, target=target, eval_days=7, refit_every=8,
+                           expanding=30, checkpoint_dir=checkpoint_dir, model_id='mean')
+            self.assertEqual(7, CountingModel.fits)
+
+            # a float32 run does not load the float64 predictions
+            float32 = calc_ml_factor(model=CountingModel(), features=features, target=target, eval_days=7,
+                                     refit_every=8, rolling=30, checkpoint_dir=checkpoint_dir, model_id='mean',
+                                     dtype='float32')
+            self.assertEqual(10, CountingModel.fits)
+            pd.testing.assert_series_equal(expected, float32, check_dtype=False, rtol=1e-5)
+
+            with self.assertRaises(ValueError) as em:
+                calc_ml_factor(model=CountingModel(), features=features, target=target, eval_days=7, refit_every=8,
+                               rolling=30, checkpoint_dir=checkpoint_dir)
+            self.assertEqual('model_id must be passed with checkpoint_dir', str(em.exception))
+
+    def test_partial_fit_calc_ml_factor(self):
+        """
+        testing an expanding window updates a model with partial_fit_model and a rolling window refits it
+        """
+        self.examples()
+        features, target = self.rand_features, self.rand_target
+
+        expected = calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                                  expanding=30)
+        RunningMeanModel.fits, RunningMeanModel.partial_fits = 0, 0
+        incremental = calc_ml_factor(model=RunningMeanModel(), features=features, target=target, eval_days=7,
+                                     refit_every=8, expanding=30)
+        pd.testing.assert_series_equal(expected, incremental)
+        self.assertEqual((0, 3), (RunningMeanModel.fits, RunningMeanModel.partial_fits))
+
+        calc_ml_factor(model=RunningMeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                       rolling=30)
+        self.assertEqual((3, 3), (RunningMeanModel.fits, RunningMeanModel.partial_fits))
+
+        # partial_fit_model is only used when the model supports it
+        no_partial_fit = RunningMeanModel()
+        no_partial_fit.supports_partial_fit = False
+        calc_ml_factor(model=no_partial_fit, features=features, target=target, eval_days=7, refit_every=8,
+                       expanding=30)
+        self.assertEqual((6, 3), (RunningMeanModel.fits, RunningMeanModel.partial_fits))
+        self.assertFalse(MeanModel().supports_partial_fit)
+
+    def test_validate_calc_ml_factor(self):
+        """
+        testing the validate and copy options, sorted and unsorted data give the same predictions
+        """
+        self.examples()
+        features, target = self.rand_features, self.rand_target
+
+        expected = calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                                  rolling=30)
+        for validate in ['full', 'sample', 'none']:
+            no_copy = calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7,
+                                     refit_every=8, rolling=30, validate=validate, copy=False)
+            pd.testing.assert_series_equal(expected, no_copy)
+
+        shuffled = np.random.default_rng(1).permutation(len(features))
+        unsorted = calc_ml_factor(model=MeanModel(), features=features.iloc[shuffled], target=target.iloc[shuffled],
+                                  eval_days=7, refit_every=8, rolling=30, copy=False)
+        pd.testing.assert_series_equal(expected, unsorted)
+
+        # validate none skips the nan check
+        target.iat[1] = np.nan
+        calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8, rolling=30,
+                       validate='none')
+        with self.assertRaises(ValueError) as em:
+            calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                           rolling=30, validate='sample')
+        self.assertEqual('There are nan or inf values in the target', str(em.exception))
+
+        with self.assertRaises(ValueError) as em:
+            calc_ml_factor(model=MeanModel(), features=features, target=target.iloc[2:], eval_days=7,
+                           refit_every=8, rolling=30, validate='sample')
+        self.assertEqual('The index for the features and target is different', str(em.exception))
+
+        with self.assertRaises(ValueError) as em:
+            calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                           rolling=30, validate='some')
+        self.assertEqual('validate must be "full", "sample" or "none" not "some"', str(em.exception))
+
+    def test_sorted(self):
+        """
+        testing sorted data is not rebuilt when copy is False, the dtypes are kept and the memory is shared
+        """
+        self.examples()
+        mixed = pd.DataFrame({'a': np.arange(len(self.date_index)), 'b': self.rand_target.to_numpy()},
+                             index=self.date_index).sort_index()
+
+        no_copy = _sorted(mixed, copy=False)
+        pd.testing.assert_series_equal(mixed.dtypes, no_copy.dtypes)
+        self.assertTrue(np.shares_memory(mixed['a'].to_numpy(), no_copy['a'].to_numpy()))
+        self.assertTrue(np.shares_memory(mixed['b'].to_numpy(), no_copy['b'].to_numpy()))
+
+        copied = _sorted(mixed, copy=True)
+        pd.testing.assert_frame_equal(mixed, copied)
+        self.assertFalse(np.shares_memory(mixed['a'].to_numpy(), copied['a'].to_numpy()))
+
+        unsorted = _sorted(mixed.iloc[::-1], copy=False)
+        pd.testing.assert_frame_equal(mixed, unsorted)
+
+    def test_dtype_calc_ml_factor(self):
+        """
+        testing the features are cast to the dtype passed or the dtype of the model
+        """
+        self.examples()
+        features, target = self.rand_features, self.rand_target
+
+        expected = calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                                  rolling=30)
+        float32 = calc_ml_factor(model=Float32Model(), features=features, target=target, eval_days=7,
+                                 refit_every=8, rolling=30)
+        pd.testing.assert_series_equal(expected, float32, check_dtype=False, rtol=1e-5)
+
+        passed = calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                                rolling=30, dtype='float32')
+        pd.testing.assert_series_equal(expected, passed, check_dtype=False, rtol=1e-5)
+
+        # values too large for float32 become inf
+        features.iat[0, 0] = 1e300
+        with self.assertRaises(ValueError) as em:
+            calc_ml_factor(model=MeanModel(), features=features, target=target, eval_days=7, refit_every=8,
+                           rolling=30, dtype='float32')
+        self.assertEqual('There are nan or inf values in the features', str(em.exception))
+
     @staticmethod
     def turn_to_datetime64(convert):
         """
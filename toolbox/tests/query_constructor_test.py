@@ -0,0 +1,373 @@
+import asyncio
+import os
+import shutil
+import threading
+import tempfile
+import unittest
+from unittest import mock
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from toolbox.db.api.connection_pool import close_connection_pools
+from toolbox.db.api.executor import run_blocking
+from toolbox.db.api.sql_connection import SQLConnection
+from toolbox.db.read.cached_query import CachedQuery, invalidate_tables
+from toolbox.db.read.memory_cache import get_memory_cache
+from toolbox.db.read.partitioned_cached_query import PartitionedCachedQuery
+from toolbox.db.read.query_batch import QueryBatch, run_many
+from toolbox.db.read.query_profiler import (CSVSink, PROFILE_FIELDS, ProfileSink, RingBufferSink, disable_profiling,
+                                           enable_profiling)
+from toolbox.db.read.query_constructor import QueryConstructor
+
+
+class QueryConstructorTest(unittest.TestCase):
+
+    def examples(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.addCleanup(close_connection_pools)
+        self.addCleanup(get_memory_cache().clear)
+
+        for name, value in [('CACHE_DIRECTORY', self.directory), ('_MANIFEST', None)]:
+            patcher = mock.patch(f'toolbox.db.read.cached_query.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.db_path = os.path.join(self.directory, 'test.duckdb')
+        con = duckdb.connect(self.db_path)
+        con.execute('CREATE SCHEMA crsp')
+        con.execute("""CREATE TABLE crsp.sd AS
+                        SELECT CAST(day AS TIMESTAMP) AS date, permno, CAST(permno * 10 AS DOUBLE) AS prc
+                        FROM range(DATE '2019-01-01', DATE '2022-01-01', INTERVAL 1 DAY) AS days(day),
+                            (VALUES (1), (2), (3)) AS assets(permno)""")
+        con.execute('CREATE SCHEMA meta')
+        con.execute("""CREATE TABLE meta.table_versions AS
+                        SELECT 'crsp.sd' AS table_name, count(*) AS row_count, now()::TIMESTAMP AS updated
+                        FROM crsp.sd""")
+        con.close()
+
+        self.sql_con = SQLConnection(self.db_path, pooled=False, close_key='test')
+        self.addCleanup(self.sql_con.close)
+
+    def query(self, cache: bool = False, start_date: str = '2020-01-01', end_date: str = '2020-12-31',
+              **kwargs) -> QueryConstructor:
+        """
+        prc of permnos 1 and 2, defaults to 2020
+        """
+        return QueryConstructor(sql_con=self.sql_con, cache=cache, **kwargs).query_timeseries_table(
+            'crsp.sd', ['prc'], assets=[1, 2], search_by='permno', start_date=start_date, end_date=end_date,
+            adjust=False)
+
+    def write(self, sql: str, bump_version: bool = False):
+        """
+        runs sql on a writable connection
+        :param bump_version: should crsp.sd get a new version like IngestDataBase gives a reloaded table?
+        """
+        self.sql_con.close()
+        with SQLConnection(self.db_path, read_only=False) as writer:
+            writer.execute(sql)
+            if bump_version:
+                writer.execute("UPDATE meta.table_versions SET updated = updated + INTERVAL 1 SECOND")
+
+    #
+    #  ************************************  results  ************************************
+    #
+
+    def test_arrow(self):
+        """
+        ensuring the Arrow, numpy and DataFrame results agree
+        """
+        self.examples()
+
+        table = self.query().arrow
+        self.assertIsInstance(table, pa.Table)
+        self.assertEqual(366 * 2, table.num_rows)
+
+        arrays = self.query().numpy
+        self.assertEqual(sorted(table.column_names), sorted(arrays))
+        np.testing.assert_array_equal(table.column('prc').to_numpy(), arrays['prc'])
+
+        df = self.query().to_df(copy=False)
+        self.assertEqual(['date', 'permno'], df.index.names)
+        self.assertIsInstance(df.index.levels[0], pd.PeriodIndex)
+        self.assertEqual(20 * 366 + 10 * 366, df['prc'].sum())
+
+    def test_polars(self):
+        """
+        ensuring polars results are returned when polars is installed and an ImportError is raised when it is not
+        """
+        self.examples()
+
+        try:
+            import polars
+        except ImportError:
+            with self.assertRaises(ImportError) as em:
+                self.query().polars
+            self.assertTrue(str(em.exception).startswith('polars is required'))
+        else:
+            self.assertEqual(366 * 2, len(self.query().polars))
+
+    #
+    #  ************************************  streaming  ************************************
+    #
+
+    def test_iter_batches(self):
+        """
+        ensuring the batches are at most rows long and together are the full query
+        """
+        self.examples()
+        full = self.query(start_date='2019-01-01').arrow.sort_by([('date', 'ascending'), ('permno', 'ascending')])
+
+        batches = list(self.query(start_date='2019-01-01').iter_batches(rows=100, as_arrow=True))
+        self.assertTrue(all(batch.num_rows <= 100 for batch in batches))
+        streamed = pa.Table.from_batches(batches).sort_by([('date', 'ascending'), ('permno', 'ascending')])
+        self.assertTrue(full.equals(streamed))
+
+        expected = self.query(start_date='2019-01-01').df.sort_index()
+        dfs = list(self.query(start_date='2019-01-01').iter_batches(rows=100))
+        pd.testing.assert_frame_equal(expected, pd.concat(dfs).sort_index())
+
+    def test_iter_dates(self):
+        """
+        ensuring each chunk is one period, periods split across fetched batches are joined and no rows are dropped or
+        duplicated
+        """
+        self.examples()
+        full = self.query().arrow.sort_by([('date', 'ascending'), ('permno', 'ascending')])
+
+        # 7 rows per fetch so most months are split across batches
+        chunks = list(self.query().iter_dates(freq='M', rows=7, as_arrow=True))
+        months = [pd.DatetimeIndex(chunk.column('date').to_numpy()).to_period('M').unique() for chunk in chunks]
+        self.assertEqual(list(pd.period_range('2020-01', '2020-12', freq='M')), [month[0] for month in months])
+        self.assertTrue(all(len(month) == 1 for month in months))
+
+        streamed = pa.concat_tables(chunks).sort_by([('date', 'ascending'), ('permno', 'ascending')])
+        self.assertTrue(full.equals(streamed))
+
+        dfs = list(self.query().iter_dates(freq='Q', rows=7))
+        self.assertEqual([2 * 91, 2 * 91, 2 * 92, 2 * 92], [len(df) for df in dfs])
+        pd.testing.assert_frame_equal(self.query().df.sort_index(), pd.concat(dfs).sort_index())
+
+    def test_iter_empty(self):
+        """
+        ensuring a query with no rows yields nothing
+        """
+        self.examples()
+
+        self.assertEqual([], list(self.query(start_date='2020-06-01', end_date='2020-01-01').iter_batches()))
+        self.assertEqual([], list(self.query(start_date='2020-06-01', end_date='2020-01-01').iter_dates()))
+
+    #
+    #  ************************************  partitioned cache  ************************************
+    #
+
+    def test_partitioned_restatement(self):
+        """
+        ensuring a restatement that keeps the row count reaches the cached partitions through invalidate_tables
+        and through a new table version
+        """
+        self.examples()
+
+        self.assertEqual(30 * 366, self.query(cache=True, partition_freq='Y').df['prc'].sum())
+
+        self.write('UPDATE crsp.sd SET prc = prc * 2')
+        invalidate_tables(['crsp.sd'])
+        self.assertEqual(60 * 366, self.query(cache=True, partition_freq='Y').df['prc'].sum())
+
+        self.write('UPDATE crsp.sd SET prc = prc * 2', bump_version=True)
+        self.assertEqual(120 * 366, self.query(cache=True, partition_freq='Y').df['prc'].sum())
+
+    def test_partitioned_hot_query(self):
+        """
+        ensuring a repeated partitioned query is served from the cache without touching the database
+        """
+        self.examples()
+
+        expected = self.query(cache=True, partition_freq='Y').df
+        with mock.patch.object(self.sql_con, 'execute', wraps=self.sql_con.execute) as execute, \
+                mock.patch.object(self.sql_con, 'arrow', wraps=self.sql_con.arrow) as arrow:
+            pd.testing.assert_frame_equal(expected, self.query(cache=True, partition_freq='Y').df)
+            # different dates in the same partition
+            january = self.query(cache=True, partition_freq='Y', end_date='2020-01-31').df
+            self.assertEqual(30 * 31, january['prc'].sum())
+
+        execute.assert_not_called()
+        arrow.assert_not_called()
+
+    def test_partitioned_append(self):
+        """
+        ensuring rows added without a new version only re-query the partitions they were added to
+        """
+        self.examples()
+
+        self.query(cache=True, partition_freq='Y', start_date='2019-01-01', end_date='2021-12-31').df
+        self.write("INSERT INTO crsp.sd VALUES (TIMESTAMP '2021-06-01', 4, 40), (TIMESTAMP '2021-06-01', 1, 5)")
+
+        with mock.patch.object(PartitionedCachedQuery, '_fetch', autospec=True,
+                               side_effect=PartitionedCachedQuery._fetch) as fetch:
+            df = self.query(cache=True, partition_freq='Y', start_date='2019-06-01', end_date='2021-12-31').df
+
+        self.assertEqual(1, fetch.call_count)
+        self.assertEqual(pd.Timestamp('2021-01-01'), fetch.call_args[0][1])
+        self.assertEqual(2, len(df.xs(pd.Period('2021-06-01'), level='date').loc[1]))
+
+    def test_partitioned_dates(self):
+        """
+        ensuring dates that are not zero padded are compared as dates, ranges with no dates give an empty table and
+        partitioned queries are only cached in their segments
+        """
+        self.examples()
+
+        expected = self.query(start_date='2020-1-5', end_date='2020-2-1').df
+        partitioned = self.query(cache=True, partition_freq='Y', start_date='2020-1-5', end_date='2020-2-1')
+        pd.testing.assert_frame_equal(expected, partitioned.df)
+        self.assertEqual(28 * 2, len(expected))
+        self.assertFalse(CachedQuery(partitioned.raw_sql, sql_con=self.sql_con).is_query_cached())
+
+        columns = self.query().arrow.column_names
+        for start_date, end_date in [('2020-06-01', '2020-01-01'), ('2999-06-01', '2020-01-01'),
+                                     ('2999-06-01', '2999-01-01')]:
+            table = self.query(cache=True, partition_freq='Y', start_date=start_date, end_date=end_date).arrow
+            self.assertEqual((0, columns), (table.num_rows, table.column_names))
+
+    #
+    #  ************************************  QueryBatch  ************************************
+    #
+
+    def test_query_batch(self):
+        """
+        ensuring a batch returns the results in order and only runs duplicate queries once
+        """
+        self.examples()
+
+        queries = [self.query(end_date='2020-01-31'), self.query(), self.query(end_date='2020-01-31')]
+        with mock.patch.object(QueryConstructor, '_execute_arrow', autospec=True,
+                               side_effect=QueryConstructor._execute_arrow) as execute:
+            dfs = QueryBatch(queries, max_workers=2).df()
+
+        self.assertEqual(2, execute.call_count)
+        self.assertEqual([30 * 31, 30 * 366, 30 * 31], [df['prc'].sum() for df in dfs])
+        self.assertEqual([62, 732, 62], [table.num_rows for table in run_many(queries, as_arrow=True)])
+
+        with self.assertRaises(ValueError) as em:
+            QueryBatch(max_workers=0)
+        self.assertEqual('max_workers must be greater than zero', str(em.exception))
+
+    def test_query_batch_cache(self):
+        """
+        ensuring cached queries are not run and a query that skips the cache is not given a cached result
+        """
+        self.examples()
+
+        self.query(cache=True, partition_freq=None).df
+        self.write('UPDATE crsp.sd SET prc = prc * 2')
+
+        with mock.patch.object(QueryConstructor, '_execute_arrow', autospec=True,
+                               side_effect=QueryConstructor._execute_arrow) as execute:
+            cached, fresh = QueryBatch([self.query(cache=True, partition_freq=None), self.query(cache=False)]).df()
+
+        self.assertEqual(1, execute.call_count)
+        self.assertEqual(30 * 366, cached['prc'].sum())
+        self.assertEqual(60 * 366, fresh['prc'].sum())
+
+    #
+    #  ************************************  async  ************************************
+    #
+
+    def test_async(self):
+        """
+        ensuring the async api gives the same results as the blocking api
+        """
+        self.examples()
+        expected = self.query().df
+
+        async def run():
+            return await asyncio.gather(self.query().adf(), self.query(cache=True, partition_freq=None).aarrow())
+
+        df, table = asyncio.run(run())
+        pd.testing.assert_frame_equal(expected, df)
+        self.assertEqual(expected['prc'].sum(), pa.compute.sum(table.column('prc')).as_py())
+
+        cq = CachedQuery(self.query().raw_sql, sql_con=self.sql_con)
+        self.assertTrue(cq.is_query_cached())
+        self.assertTrue(table.equals(asyncio.run(cq.aget_cached_query_arrow())))
+
+    def test_async_cancel(self):
+        """
+        ensuring cancelling a running call interrupts its connection
+        """
+        started, release = threading.Event(), threading.Event()
+        sql_con = mock.Mock()
+
+        def blocking():
+            started.set()
+            release.wait(5)
+
+        async def run():
+            task = asyncio.ensure_future(run_blocking(blocking, sql_con=sql_con))
+            while not started.is_set():
+                await asyncio.sleep(.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        try:
+            asyncio.run(run())
+        finally:
+            release.set()
+        sql_con.interrupt.assert_called_once()
+
+    #
+    #  ************************************  profiler  ************************************
+    #
+
+    def test_profiler(self):
+        """
+        ensuring each call is profiled with its cache outcome and size, and profiling can be turned off
+        """
+        self.examples()
+        self.addCleanup(disable_profiling)
+
+        ring = RingBufferSink(max_records=3)
+        csv_path = os.path.join(self.directory, 'profiles.csv')
+        enable_profiling(ring, CSVSink(csv_path))
+
+        self.query().df
+        self.query(cache=True, partition_freq=None).df
+        self.query(cache=True, partition_freq=None).arrow
+        self.query(cache=True, partition_freq='Y').df
+
+        profiles = ring.df()
+        self.assertEqual(PROFILE_FIELDS, list(profiles.columns))
+        self.assertEqual(['miss', 'hit', 'partitioned'], list(profiles['cache']))
+        self.assertEqual([732, 732, 732], list(profiles['rows']))
+        self.assertEqual(1, profiles['sql_hash'].nunique())
+        self.assertTrue((profiles['execute_seconds'] >= 0).all())
+        self.assertEqual(4, len(pd.read_csv(csv_path)))
+
+        disable_profiling()
+        self.query().df
+        self.assertEqual(3, len(ring.records))
+
+        # a sink without record fails when it is made rather than on the first profiled query
+        class IncompleteSink(ProfileSink):
+            pass
+
+        with self.assertRaises(TypeError):
+            IncompleteSink()
+
+    def test_explain(self):
+        """
+        ensuring explain gives duckdb's plan, with timings when analyzing
+        """
+        self.examples()
+
+        self.assertIn('crsp.sd', self.query().explain())
+        self.assertIn('total time', self.query().explain(analyze=True).lower())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from toolbox.db.api.sql_connection import SQLConnection
+from toolbox.db.read.query_constructor import QueryConstructor
+from toolbox.utils import utils
+from toolbox.utils.utils import cross_sectional, cross_sectional_to_parquet, factorize, rank, ntile
+
+
+class UtilsTest(unittest.TestCase):
+
+    def examples(self):
+        rng = np.random.default_rng(0)
+        self.date_index = pd.MultiIndex.from_product(
+            [pd.date_range(start='2010-01-01', periods=5), [f'S{i}' for i in range(20)]], names=['date', 'symbol'])
+        self.foo_data = pd.DataFrame({'ret': rng.normal(size=len(self.date_index)),
+                                      'size': rng.normal(size=len(self.date_index))}, index=self.date_index)
+        self.foo_data.iat[3, 0] = np.nan
+
+    #
+    #  ************************************  factorize  ************************************
+    #
+
+    def test_factorize_options(self):
+        """
+        testing winsorize, mad scaling and rank gauss give the same values with both backends
+        """
+        self.examples()
+        self.foo_data['size'] = self.foo_data['size'].round()
+
+        for kwargs in [dict(winsorize=(.1, .9)), dict(scale='mad'), dict(winsorize=(.05, .95), scale='mad'),
+                       dict(method='rank_gauss')]:
+            expected = factorize(self.foo_data, ['date'], ['symbol'], backend='duckdb', **kwargs).sort_index()
+            got = factorize(self.foo_data, ['date'], ['symbol'], backend='numpy', **kwargs).sort_index()
+            pd.testing.assert_frame_equal(expected, got[expected.columns], check_dtype=False)
+
+    def test_factorize_winsorize(self):
+        """
+        testing winsorizing bounds an outlier and rank gauss is symmetric around zero
+        """
+        self.examples()
+        self.foo_data.iat[0, 1] = 1e6
+
+        plain = factorize(self.foo_data, ['date'], ['symbol'])
+        winsorized = factorize(self.foo_data, ['date'], ['symbol'], winsorize=(.1, .9))
+        self.assertGreater(plain['size'].iloc[0], 4)
+        self.assertLess(winsorized['size'].iloc[0], 4)
+
+        gauss = factorize(self.foo_data, ['date'], ['symbol'], method='rank_gauss')
+        np.testing.assert_allclose(gauss.groupby('date')['size'].sum(), 0, atol=1e-9)
+        self.assertTrue(np.isnan(gauss.loc[self.foo_data.index[3], 'ret']))
+
+        with self.assertRaises(ValueError) as em:
+            factorize(self.foo_data, ['date'], ['symbol'], winsorize=(.9, .1))
+        self.assertEqual('winsorize must be (lower, upper) quantiles with 0 <= lower < upper <= 1', str(em.exception))
+
+    #
+    #  ************************************  cross_sectional  ************************************
+    #
+
+    def test_cross_sectional(self):
+        """
+        testing cross_sectional gives the same values as running factorize, rank and ntile one at a time
+        """
+        self.examples()
+
+        for backend in ['duckdb', 'numpy']:
+            out = cross_sectional(self.foo_data, ['date'], {'ret': ['factorize', 'pct_rank'], 'size': ['ntile5']},
+                                  backend=backend)
+            self.assertEqual(['ret_factorize', 'ret_pct_rank', 'size_ntile5'], list(out.columns))
+
+            out = out.sort_index()
+            factorized = factorize(self.foo_data, ['date'], ['symbol'], backend='duckdb').sort_index()
+            ranked = rank(self.foo_data, ['date'], ['symbol'], backend='duckdb').sort_index()
+            ntiled = ntile(self.foo_data, 5, ['date'], ['symbol'], backend='duckdb').sort_index()
+            pd.testing.assert_series_equal(factorized['ret'], out['ret_factorize'], check_names=False)
+            pd.testing.assert_series_equal(ranked['ret'], out['ret_pct_rank'], check_names=False)
+            pd.testing.assert_series_equal(ntiled['size'], out['size_ntile5'], check_names=False,
+                                           check_dtype=False)
+
+    def test_numpy_backend(self):
+        """
+        testing the numpy backend gives the same values as duckdb, including ties and nulls
+        """
+        self.examples()
+        self.foo_data['size'] = self.foo_data['size'].round()
+        self.foo_data.iat[5, 1] = np.nan
+
+        def check(func, **kwargs):
+            expected = func(backend='duckdb', **kwargs).sort_index()
+            got = func(backend='numpy', **kwargs).sort_index()
+            self.assertEqual(sorted(expected.columns), sorted(got.columns))
+            pd.testing.assert_frame_equal(expected, got[expected.columns])
+
+        check(factorize, df=self.foo_data, partition_by=['date'], exclude=['symbol'])
+        for rank_type in ['percent_rank', 'rank', 'dense_rank', 'cume_dist']:
+            check(rank, df=self.foo_data, partition_by=['date'], exclude=['symbol'], rank_type=rank_type)
+        check(cross_sectional, df=self.foo_data, partition_by=['date'],
+              ops={'ret': ['zscore', 'demean', 'ntile3'], 'size': ['rank', 'dense_rank']})
+
+        with self.assertRaises(ValueError) as em:
+            factorize(self.foo_data, ['date'], ['symbol'], backend='polars')
+        self.assertEqual('backend must be "duckdb", "numpy" or "auto" not "polars"', str(em.exception))
+
+    def test_auto_backend(self):
+        """
+        testing auto picks the backend by the limit of each operation and both backends give the same dtypes,
+        including the rank dtypes with and without nulls and monthly periods
+        """
+        self.examples()
+        monthly = self.foo_data.copy()
+        monthly.index = monthly.index.set_levels(pd.period_range('2010-01', periods=5, freq='M'), level='date')
+        monthly['count'] = np.arange(len(monthly)) % 7
+
+        calls = [(factorize, {}, 'factorize'), (rank, {'rank_type': 'rank'}, 'rank'),
+                 (rank, {'rank_type': 'dense_rank'}, 'rank'), (ntile, {'ntiles': 3}, 'ntile')]
+        limits = {'factorize': monthly.size - 1, 'rank': monthly.size, 'ntile': monthly.size}
+        with mock.patch.dict(utils.NUMPY_BACKEND_MAX_CELLS, limits), \
+                mock.patch.object(utils, '_duck_db_edits', wraps=utils._duck_db_edits) as duck_db_edits:
+            for func, kwargs, kind in calls:
+                duck_db_edits.reset_mock()
+                expected = func(df=monthly, partition_by=['date'], exclude=['symbol'], backend='duckdb', **kwargs)
+                got = func(df=monthly, partition_by=['date'], exclude=['symbol'], backend='auto', **kwargs)
+                self.assertEqual(2 if kind == 'factorize' else 1, duck_db_edits.call_count)
+
+                pd.testing.assert_series_equal(expected.dtypes.sort_index(), got.dtypes.sort_index())
+                self.assertEqual('period[D]', got.index.levels[0].dtype)
+
+            ranked = rank(monthly, ['date'], ['symbol'], rank_type='rank')
+            self.assertEqual(['Int64', 'int64', 'int64'], [str(ranked[col].dtype) for col in monthly.columns])
+
+            # any transform over the limit of its operation sends the whole call to duckdb
+            duck_db_edits.reset_mock()
+            out = cross_sectional(monthly, ['date'], {'ret': ['rank', 'factorize'], 'size': ['dense_rank']})
+            self.assertEqual(1, duck_db_edits.call_count)
+            self.assertEqual(['Int64', 'int64'], [str(out[col].dtype) for col in ['ret_rank', 'size_dense_rank']])
+
+    def test_cross_sectional_zscore(self):
+        """
+        testing the zscore has a mean of zero and a std of one per partition, nulls stay null
+        """
+        self.examples()
+
+        out = cross_sectional(self.foo_data, ['date'], {'ret': ['zscore', 'demean']})
+        grouped = out.groupby('date')['ret_zscore']
+        np.testing.assert_allclose(grouped.mean(), 0, atol=1e-12)
+        np.testing.assert_allclose(grouped.std(), 1)
+        self.assertTrue(np.isnan(out.loc[self.foo_data.index[3], 'ret_demean']))
+
+    def test_cross_sectional_errors(self):
+        """
+        testing cross_sectional raises for unknown columns and operations
+        """
+        self.examples()
+
+        with self.assertRaises(ValueError) as em:
+            cross_sectional(self.foo_data, ['date'], {'foo': ['zscore']})
+        self.assertEqual('Column foo is not in the dataframe', str(em.exception))
+
+        with self.assertRaises(ValueError) as em:
+            cross_sectional(self.foo_data, ['date'], {'ret': ['ntile0']})
+        self.assertTrue(str(em.exception).startswith('Operation ntile0 is not recognised'))
+
+    def test_cross_sectional_to_parquet(self):
+        """
+        testing the chunked parquet output matches cross_sectional for parquet, Arrow and QueryConstructor sources
+        """
+        self.examples()
+        ops = {'ret': ['factorize', 'pct_rank'], 'size': ['ntile5']}
+        expected = cross_sectional(self.foo_data, ['date'], ops, backend='duckdb').sort_index()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            self.foo_data.reset_index().to_parquet(os.path.join(tmp, 'input.parquet'))
+            sources = {'parquet': os.path.join(tmp, 'input.parquet'),
+                       'arrow': pa.Table.from_pandas(self.foo_data.reset_index())}
+
+            # the same data in a database, streamed one period at a time by the QueryConstructor
+            db_path = os.path.join(tmp, 'input.duckdb')
+            with duckdb.connect(db_path) as con:
+                con.execute('CREATE SCHEMA foo')
+                con.execute(f"CREATE TABLE foo.data AS SELECT * FROM read_parquet('{sources['parquet']}')")
+            sql_con = SQLConnection(db_path, pooled=False)
+            self.addCleanup(sql_con.close)
+            sources['query'] = QueryConstructor(sql_con=sql_con).query_timeseries_table(
+                'foo.data', ['ret', 'size'], assets=list(self.date_index.levels[1]), search_by='symbol',
+                start_date='2010-01-01', end_date='2010-12-31', adjust=False)
+
+            for name, source in sources.items():
+                paths = cross_sectional_to_parquet(source, os.path.join(tmp, name), ['date'], ops, freq='D',
+                                                   temp_directory=os.path.join(tmp, 'spill'))
+                self.assertEqual(5, len(paths))
+
+                got = pd.concat([pd.read_parquet(path) for path in paths]).set_index(['date', 'symbol'])
+                pd.testing.assert_frame_equal(expected, got.sort_index()[expected.columns], check_dtype=False,
+                                              check_index_type=False)
+
+            with self.assertRaises(ValueError) as em:
+                cross_sectional_to_parquet(sources['parquet'], tmp, ['symbol'], ops)
+            self.assertEqual('partition_by must contain date so each period can be transformed on its own',
+                             str(em.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,283 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+# the rank methods of group_rank
+RANK_METHODS = ['percent_rank', 'rank', 'dense_rank', 'cume_dist']
+# scales a normal distributions MAD to its std
+MAD_TO_STD = 1.4826
+
+# coefficients of the rational approximations of the inverse normal cdf used by norm_ppf
+_PPF_A = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02,
+          -3.066479806614716e+01, 2.506628277459239e+00]
+_PPF_B = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01,
+          -1.328068155288572e+01]
+_PPF_C = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00,
+          4.374664141464968e+00, 2.938163982698783e+00]
+_PPF_D = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+
+
+class GroupIndex:
+    """
+    The sizes and first rows of each group when the rows are sorted by group.
+    Groups are integer codes from 0 to n_groups - 1, rows do not need to be sorted by group
+    """
+
+    def __init__(self, groups: np.ndarray):
+        """
+        :param groups: the group code of each row
+        """
+        self.groups = np.asarray(groups, dtype=np.int64)
+        self.sizes = np.bincount(self.groups) if len(self.groups) else np.zeros(0, dtype=np.int64)
+        self.starts = np.cumsum(self.sizes) - self.sizes
+
+    def sort(self, column: np.ndarray, descending: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        sorts a column by group then value, nan values are last in each group
+        :return: the order of the rows and the position of each sorted row in its group
+        """
+        order = np.lexsort((-column if descending else column, self.groups))
+        positions = np.arange(len(order)) - self.starts[self.groups[order]]
+        return order, positions
+
+
+def group_zscore(values: np.ndarray, index: GroupIndex, center: str = 'mean') -> np.ndarray:
+    """
+    (x - center) / std of each column in each group, the std is the sample std.
+    nan values are ignored and stay nan, like nulls in sql
+    :param values: 2-D array of rows by columns
+    :param index: the groups of the rows
+    :param center: 'mean' or 'median'
+    :return: array the shape of values
+    """
+    if center not in ['mean', 'median']:
+        raise ValueError(f'center must be "mean" or "median" not "{center}"')
+
+    out = np.empty(values.shape, dtype=np.float64, order='F')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for col in range(values.shape[1]):
+            column = values[:, col]
+            std = _group_std(column, index)
+            centers = _group_median(column, index) if center == 'median' else _group_mean(column, index)
+            out[:, col] = (column - centers[index.groups]) / std[index.groups]
+
+    return out
+
+
+def group_factorize(values: np.ndarray, index: GroupIndex, winsorize: Optional[Tuple[float, float]] = None,
+                    scale: str = 'std', method: str = 'zscore') -> np.ndarray:
+    """
+    the robust z-score of factorize, nan values are ignored and stay nan
+    :param values: 2-D array of rows by columns
+    :param index: the groups of the rows
+    :param winsorize: (lower, upper) quantiles to clip each column to in each group before scaling
+    :param scale: 'std' divides by the sample std, 'mad' divides by MAD_TO_STD * the median absolute deviation
+    :param method: 'zscore' centers on the median then scales, 'rank_gauss' maps the ranks to a standard normal
+    :return: array the shape of values
+    """
+    if method == 'rank_gauss':
+        return group_rank_gauss(values, index)
+    if winsorize is None and scale == 'std':
+        return group_zscore(values, index, 'median')
+
+    out = np.empty(values.shape, dtype=np.float64, order='F')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for col in range(values.shape[1]):
+            column = values[:, col]
+            if winsorize is not None:
+                column = np.clip(column, _group_quantile(column, index, winsorize[0])[index.groups],
+                                 _group_quantile(column, index, winsorize[1])[index.groups])
+
+            centered = column - _group_median(column, index)[index.groups]
+            if scale == 'mad':
+                spread = MAD_TO_STD * _group_median(np.abs(centered), index)
+                # more than half the values at the median, NULLIF in the sql
+                spread[spread == 0] = np.nan
+            else:
+                spread = _group_std(centered, index)
+            out[:, col] = centered / spread[index.groups]
+
+    return out
+
+
+def group_rank_gauss(values: np.ndarray, index: GroupIndex) -> np.ndarray:
+    """
+    maps the ranks of each column in each group to a standard normal: norm_ppf((average rank - 0.5) / count)
+    ties get the average of their ranks, nan values are ignored and stay nan
+    """
+    ranks = group_rank(values, index, 'rank')
+    # the amount of values smaller or equal is the last rank of the ties
+    last_ranks = group_rank(values, index, 'cume_dist') * index.sizes[index.groups][:, None]
+
+    out = np.empty(values.shape, dtype=np.float64, order='F')
+    for col in range(values.shape[1]):
+        counts = np.bincount(index.groups, weights=~np.isnan(values[:, col]), minlength=len(index.sizes))
+        out[:, col] = norm_ppf(((ranks[:, col] + last_ranks[:, col]) / 2 - 0.5) / counts[index.groups])
+
+    return out
+
+
+def norm_ppf(p: np.ndarray) -> np.ndarray:
+    """
+    the inverse of the standard normal cdf, accurate to a relative error of 1.2e-9.
+    uses the rational approximations of Peter Acklam so scipy is not needed
+    :param p: probabilities in (0, 1), nan stays nan
+    """
+    p = np.asarray(p, dtype=np.float64)
+    out = np.full(p.shape, np.nan)
+    low, high = p < 0.02425, p > 1 - 0.02425
+    central = ~low & ~high & ~np.isnan(p)
+
+    q = p[central] - 0.5
+    r = q * q
+    out[central] = (_polynomial(_PPF_A, r) * q) / (_polynomial(_PPF_B, r) * r + 1)
+
+    for tail, sign in [(low, 1), (high, -1)]:
+        tail = tail & (p > 0) & (p < 1)
+        q = np.sqrt(-2 * np.log(p[tail] if sign == 1 else 1 - p[tail]))
+        out[tail] = sign * _polynomial(_PPF_C, q) / (_polynomial(_PPF_D, q) * q + 1)
+
+    return out
+
+
+def group_demean(values: np.ndarray, index: GroupIndex) -> np.ndarray:
+    """
+    x - mean of each column in each group, nan values are ignored and stay nan
+    """
+    out = np.empty(values.shape, dtype=np.float64, order='F')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for col in range(values.shape[1]):
+            out[:, col] = values[:, col] - _group_mean(values[:, col], index)[index.groups]
+    return out
+
+
+def group_rank(values: np.ndarray, index: GroupIndex, method: str = 'percent_rank') -> np.ndarray:
+    """
+    ranks each column in each group with the semantics of the sql window functions, nan values get a nan rank but
+    count towards the size of the group like nulls in sql
+        percent_rank: (rank - 1) / (group size - 1)
+        rank: 1 + the amount of smaller values
+        dense_rank: 1 + the amount of smaller unique values
+        cume_dist: the amount of values smaller or equal / group size
+    :param values: 2-D array of rows by columns
+    :param index: the groups of the rows
+    :param method: one of RANK_METHODS
+    :return: array the shape of values
+    """
+    if method not in RANK_METHODS:
+        raise ValueError(f'method must be one of {RANK_METHODS} not "{method}"')
+
+    out = np.empty(values.shape, dtype=np.float64, order='F')
+    for col in range(values.shape[1]):
+        column = values[:, col]
+        order, positions = index.sort(column)
+        sorted_values, sorted_groups = column[order], index.groups[order]
+
+        # a run is a group of tied values
+        new_run = np.ones(len(order), dtype=bool)
+        new_run[1:] = (sorted_values[1:] != sorted_values[:-1]) | (sorted_groups[1:] != sorted_groups[:-1])
+        run_first = np.maximum.accumulate(np.where(new_run, np.arange(len(order)), 0))
+        sizes = index.sizes[sorted_groups]
+
+        if method == 'percent_rank':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ranked = np.where(sizes > 1, positions[run_first] / (sizes - 1), 0.0)
+        elif method == 'rank':
+            ranked = positions[run_first] + 1.0
+        elif method == 'dense_rank':
+            runs = np.cumsum(new_run)
+            ranked = (runs - runs[index.starts[sorted_groups]] + 1).astype(np.float64)
+        else:
+            run_last = np.append(np.flatnonzero(new_run)[1:], len(order)) - 1
+            ranked = (positions[run_last[np.cumsum(new_run) - 1]] + 1) / sizes
+
+        ranked[np.isnan(sorted_values)] = np.nan
+        out[order, col] = ranked
+
+    return out
+
+
+def group_ntile(values: np.ndarray, index: GroupIndex, ntiles: int) -> np.ndarray:
+    """
+    splits each column in each group into ntiles with the highest values in ntile 1, the semantics of
+    NTILE(ntiles) OVER (PARTITION BY group ORDER BY x DESC). nan values are put in the last ntiles like nulls in sql.
+    ties are split in the order of the rows
+    :param values: 2-D array of rows by columns
+    :param index: the groups of the rows
+    :param ntiles: the amount of ntiles
+    :return: array the shape of values
+    """
+    if ntiles < 1:
+        raise ValueError('ntiles must be greater than zero')
+
+    out = np.empty(values.shape, dtype=np.float64, order='F')
+    for col in range(values.shape[1]):
+        order, positions = index.sort(values[:, col], descending=True)
+        sizes = index.sizes[index.groups[order]]
+
+        # the first n_large ntiles have one more row than the rest
+        buckets = np.minimum(ntiles, sizes)
+        bucket_size = sizes // buckets
+        n_large = sizes - buckets * bucket_size
+        large_rows = n_large * (bucket_size + 1)
+        out[order, col] = np.where(positions < large_rows, 1 + positions // (bucket_size + 1),
+                                   1 + n_large + (positions - large_rows) // np.maximum(bucket_size, 1))
+
+    return out
+
+
+def _polynomial(coefficients, x: np.ndarray) -> np.ndarray:
+    """
+    evaluates a polynomial with the coefficients highest power first
+    """
+    out = np.zeros_like(x)
+    for coefficient in coefficients:
+        out = out * x + coefficient
+    return out
+
+
+def _group_quantile(column: np.ndarray, index: GroupIndex, quantile: float) -> np.ndarray:
+    """
+    the quantile of each group interpolated like quantile_cont, nan values are ignored
+    """
+    order, _ = index.sort(column)
+    sorted_values = column[order]
+    counts = np.bincount(index.groups, weights=~np.isnan(column), minlength=len(index.sizes)).astype(np.int64)
+    if not len(sorted_values):
+        return np.full(len(index.sizes), np.nan)
+
+    position = quantile * np.maximum(counts - 1, 0)
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    low_values = sorted_values[np.minimum(index.starts + low, len(order) - 1)]
+    high_values = sorted_values[np.minimum(index.starts + high, len(order) - 1)]
+
+    return np.where(counts > 0, low_values + (high_values - low_values) * (position - low), np.nan)
+
+
+def _group_mean(column: np.ndarray, index: GroupIndex) -> np.ndarray:
+    valid = ~np.isnan(column)
+    counts = np.bincount(index.groups, weights=valid, minlength=len(index.sizes))
+    return np.bincount(index.groups, weights=np.where(valid, column, 0.0), minlength=len(index.sizes)) / counts
+
+
+def _group_std(column: np.ndarray, index: GroupIndex) -> np.ndarray:
+    valid = ~np.isnan(column)
+    counts = np.bincount(index.groups, weights=valid, minlength=len(index.sizes))
+    deviations = np.where(valid, column - _group_mean(column, index)[index.groups], 0.0)
+    variance = np.bincount(index.groups, weights=deviations ** 2, minlength=len(index.sizes)) / (counts - 1)
+    return np.where(counts > 1, np.sqrt(variance), np.nan)
+
+
+def _group_median(column: np.ndarray, index: GroupIndex) -> np.ndarray:
+    order, _ = index.sort(column)
+    sorted_values = column[order]
+    counts = np.bincount(index.groups, weights=~np.isnan(column), minlength=len(index.sizes)).astype(np.int64)
+
+    # the nan values are last so the middle of the valid values is at the start of the group plus half the count
+    low = index.starts + np.maximum(counts - 1, 0) // 2
+    high = index.starts + counts // 2
+    if not len(sorted_values):
+        return np.full(len(index.sizes), np.nan)
+    median = (sorted_values[np.minimum(low, len(order) - 1)] + sorted_values[np.minimum(high, len(order) - 1)]) / 2
+    return np.where(counts > 0, median, np.nan)
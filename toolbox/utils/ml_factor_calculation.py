@@ -1,18 +1,38 @@
 import gc
+import hashlib
+import json
+import os
+import shutil
+import tempfile
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from typing import Generator, Tuple, List
+from typing import Callable, Generator, Tuple, List, Optional
 
 from tqdm import tqdm
 
+# amount of rows checked for nan and inf values at a time
+_VALIDATE_CHUNK_ROWS = 100_000
+# amount of rows checked when validate='sample'
+_VALIDATE_SAMPLE_ROWS = 100_000
+
 
 class ModelWrapper(ABC):
     """
     Wraps a model for calc_ml_factor.
     """
+    # the dtype calc_ml_factor casts the features to and transform_data outputs are cast back to, ex: 'float32'
+    # None keeps the dtype of the passed features
+    feature_dtype: Optional[str] = None
+    # set to True by models that implement partial_fit_model, calc_ml_factor then updates the model on an expanding
+    # window rather than refitting it
+    supports_partial_fit: bool = False
+
     @abstractmethod
     def fit_model(self, train_features: pd.DataFrame, train_target: pd.Series) -> any:
         """
@@ -28,6 +48,22 @@ class ModelWrapper(ABC):
         """
         pass
 
+    def partial_fit_model(self, new_features: pd.DataFrame, new_target: pd.Series, state: any) -> any:
+        """
+        Optional, lets calc_ml_factor update a model rather than refitting it on all history.
+        Only called if supports_partial_fit is True. When calc_ml_factor is run with an expanding window and n_jobs=1,
+        each fold only passes the rows added since the previous fold plus the model returned by the previous fold.
+        Otherwise fit_model is used.
+
+        :param new_features: the features added to the training window since the previous fold,
+            every training row on the first fold
+        :param new_target: the target for new_features
+        :param state: the model returned by the previous call, None on the first fold
+        :return: a model fit to all the rows seen so far, is passed back as state on the next fold
+        """
+        raise NotImplementedError(f'{type(self).__name__} sets supports_partial_fit but does not implement '
+                                  f'partial_fit_model')
+
     @staticmethod
     def transform_data(train_features: pd.DataFrame, train_target: pd.Series, predict: pd.DataFrame) -> \
             Tuple[pd.DataFrame, pd.DataFrame]:
@@ -39,6 +75,7 @@ class ModelWrapper(ABC):
 
         The indexes must not be changed. However columns can be dropped and altered.
         Any change to the train_target must also be done to the predict data.
+        If feature_dtype is set then the outputs are cast to it, so a transform that upcasts does not undo the policy
 
         Example use: fit a PCA to the train_features then transform the train_features and predict data using said PCA.
                 or use RFE to reduce dimensionality
@@ -69,6 +106,8 @@ class ModelWrapper(ABC):
 
         # allowing the user to adjust the data before fitting, assuming that the user does not mess up the indexes
         transformed_features, transformedPredict = self.transform_data(train_features, train_target, predict)
+        transformed_features = _as_dtype(transformed_features, self.feature_dtype)
+        transformedPredict = _as_dtype(transformedPredict, self.feature_dtype)
 
         # fitting and making predictions with user defined model
         model: any = self.fit_model(transformed_features, train_target)
@@ -79,6 +118,29 @@ class ModelWrapper(ABC):
 
         return predicted
 
+    def partial_predict(self, new_features: pd.DataFrame, new_target: pd.Series, predict: pd.DataFrame,
+                        state: any) -> Tuple[pd.Series, any]:
+        """
+        updates a model with the rows added to the training window by calling "partial_fit_model" and then makes
+        predictions with the updated model.
+        transform_data is given the new rows only, transformations that need all the training history should not be
+        used with partial_fit_model
+
+        :param new_features: the features added to the training window since the previous fold
+        :param new_target: the target for new_features
+        :param predict: The data to make predictions on
+        :param state: the model returned by the previous fold, None on the first fold
+        :return: the predictions and the updated model
+        """
+        transformed_features, transformed_predict = self.transform_data(new_features, new_target, predict)
+        transformed_features = _as_dtype(transformed_features, self.feature_dtype)
+        transformed_predict = _as_dtype(transformed_predict, self.feature_dtype)
+
+        model: any = self.partial_fit_model(transformed_features, new_target, state)
+        predicted: pd.Series = pd.Series(data=model.predict(transformed_predict), index=predict.index)
+
+        return predicted, model
+
 
 class SliceHolder:
     """
@@ -106,7 +168,9 @@ class SliceHolder:
 
 
 def calc_ml_factor(model: ModelWrapper, features: pd.DataFrame, target: pd.Series, eval_days: int, refit_every: int,
-                   expanding: int = None, rolling: int = None) -> pd.Series:
+                   expanding: int = None, rolling: int = None, n_jobs: int = 1, checkpoint_dir: str = None,
+                   model_id: str = None, validate: str = 'full', copy: bool = True, dtype: str = None,
+                   purge: int = 0, embargo: int = 0) -> pd.Series:
     """
     Calculates an alpha factor using a ML factor combination method.
     The model is fit and predictions are made in a ModelWrapper
@@ -133,32 +197,114 @@ def calc_ml_factor(model: ModelWrapper, features: pd.DataFrame, target: pd.Serie
         if this value is passed then the model will be trained with an expanding window of data
     :param rolling: the amount of rolling days to fit a model to
         if minTrainDays is passed then this should not be passed
+        if model.supports_partial_fit then each fold only updates the model with the new days
+    :param n_jobs: the amount of processes to fit the folds in, -1 uses every core.
+        The features and target are shared with the processes through memory mapped files, the model is pickled to
+        the processes so it must be importable
+    :param checkpoint_dir: if passed then the predictions of each fold are written to a parquet file in this directory
+        as the fold finishes. A rerun with the same model_id, eval_days, refit_every, expanding, rolling, purge and
+        embargo loads the finished folds rather than fitting them again
+    :param model_id: identifies the model for checkpoint_dir, must be passed with checkpoint_dir.
+        Change the id when the model changes, otherwise the predictions of the old model will be loaded
+    :param validate: how much of the data to check for nan and inf values and matching indexes.
+        'full' checks every row, 'sample' checks a random sample of rows and 'none' only checks the index types
+    :param copy: if False then the features and target are not copied, the folds are read only views of the passed
+        data. Data that is not sorted by its index is still sorted into a new frame
+    :param dtype: the dtype to cast the features to once before the folds are made, ex: 'float32'.
+        The features are kept in one column major array and each fold is a view of it.
+        If None then model.feature_dtype is used, if that is None too then the features keep their dtype
+    :param purge: the amount of days dropped from the end of each training window, see fold_plan
+    :param embargo: the amount of days skipped before each predicting window, see fold_plan
     :return: pandas series of predictions. The index will be the same as "features"
     """
 
-    features_copy: pd.DataFrame = features.copy().sort_index()
-    target_copy: pd.Series = target.copy().sort_index()
+    if validate not in ['full', 'sample', 'none']:
+        raise ValueError(f'validate must be "full", "sample" or "none" not "{validate}"')
 
-    if not np.isfinite(features_copy.values).all():
+    dtype = dtype if dtype is not None else model.feature_dtype
+
+    # sort_index always makes a new frame, only copying when the data is already sorted
+    # casting to dtype makes a new array so there is no need to copy first
+    features_copy: pd.DataFrame = _sorted(features, copy and dtype is None)
+    target_copy: pd.Series = _sorted(target, copy)
+    if dtype is not None:
+        # cast before validating so values that overflow the dtype are caught
+        features_copy = _contiguous(features_copy, dtype)
+
+    rows: Optional[np.ndarray] = None
+    if validate == 'sample' and len(features_copy) > _VALIDATE_SAMPLE_ROWS:
+        rows = np.sort(np.random.default_rng(0).choice(len(features_copy), _VALIDATE_SAMPLE_ROWS, replace=False))
+
+    if validate != 'none' and not _all_finite(features_copy, rows):
         raise ValueError('There are nan or inf values in the features')
-    if not np.isfinite(target_copy.values).all():
+    if validate != 'none' and not _all_finite(target_copy, rows):
         raise ValueError('There are nan or inf values in the target')
     if not isinstance(features_copy.index, pd.MultiIndex):
         raise ValueError('Features and target must have a pd.MultiIndex of (pd.Timestamp, str)')
-    if not isinstance(features_copy.index.get_level_values(0), pd.DatetimeIndex):
+    if not isinstance(features_copy.index.levels[0], pd.DatetimeIndex):
         raise ValueError('Features and target must have index level 0 of pd.DatetimeIndex')
-    if not features_copy.index.equals(target_copy.index):
-        raise ValueError('The index for the features and target is different')
-
-    train_predict_slices: Generator[Tuple[SliceHolder, SliceHolder], None, None] = \
-        generate_indexes(features_copy.index, eval_days, refit_every, expanding, rolling)
-
-    ml_alpha: List[pd.Series] = []
-    for train_slice, predict_slice in tqdm(train_predict_slices):
-        features_train = features_copy.loc[train_slice.start:train_slice.end]
-        target_train = target_copy.loc[train_slice.start:train_slice.end]
-        predict = features_copy.loc[predict_slice.start:predict_slice.end]
-        ml_alpha.append(model.predict(features_train, target_train, predict))
+    if validate != 'none':
+        if rows is None:
+            same_index = features_copy.index.equals(target_copy.index)
+        else:
+            same_index = (len(features_copy) == len(target_copy) and
+                          features_copy.index[rows].equals(target_copy.index[rows]))
+        if not same_index:
+            raise ValueError('The index for the features and target is different')
+
+    # row bounds of the folds, the folds are views of the sorted data rather than label lookups
+    plan = fold_plan(features_copy.index, eval_days, refit_every, expanding, rolling, purge, embargo)
+    train_predict_slices: List[Tuple[SliceHolder, SliceHolder]] = [
+        (SliceHolder(int(fold.train_start_row), int(fold.train_stop_row)),
+         SliceHolder(int(fold.predict_start_row), int(fold.predict_stop_row))) for fold in plan.itertuples()]
+
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    if n_jobs < 1:
+        raise ValueError('n_jobs must be greater than zero or -1')
+
+    ml_alpha: List[Optional[pd.Series]] = [None] * len(train_predict_slices)
+    on_fold_done: Optional[Callable[[int, pd.Series], None]] = None
+    if checkpoint_dir is not None:
+        if not model_id:
+            raise ValueError('model_id must be passed with checkpoint_dir')
+        # the dtypes the model is fit on are part of the run, a float32 run does not load float64 predictions
+        checkpoint = _FoldCheckpoint(checkpoint_dir, model_id, eval_days=eval_days, refit_every=refit_every,
+                                     expanding=expanding, rolling=rolling, purge=purge, embargo=embargo,
+                                     dtype=sorted({str(col_dtype) for col_dtype in features_copy.dtypes}))
+        dates = features_copy.index.get_level_values(0)
+        for fold, slices in enumerate(train_predict_slices):
+            ml_alpha[fold] = checkpoint.load(fold, dates, *slices)
+        print(f'Loaded {sum(alpha is not None for alpha in ml_alpha)} of {len(ml_alpha)} Folds From Checkpoint')
+
+        def save_fold(fold: int, predictions: pd.Series) -> None:
+            checkpoint.save(fold, dates, *train_predict_slices[fold], predictions)
+
+        on_fold_done = save_fold
+
+    remaining = [fold for fold, alpha in enumerate(ml_alpha) if alpha is None]
+    # an expanding window only adds rows, so a model that can be updated does not need to see all the history again
+    incremental = bool(expanding) and model.supports_partial_fit
+    if n_jobs == 1:
+        state, fitted_through = None, 0
+        for fold in tqdm(remaining):
+            train_slice, predict_slice = train_predict_slices[fold]
+            if incremental:
+                new_start = fitted_through if state is not None else train_slice.start
+                ml_alpha[fold], state = model.partial_predict(
+                    features_copy.iloc[new_start:train_slice.end], target_copy.iloc[new_start:train_slice.end],
+                    features_copy.iloc[predict_slice.start:predict_slice.end], state)
+                fitted_through = train_slice.end
+            else:
+                ml_alpha[fold] = _predict_fold(model, features_copy, target_copy, train_slice, predict_slice)
+            if on_fold_done:
+                on_fold_done(fold, ml_alpha[fold])
+    elif remaining:
+        predictions = _calc_folds_in_processes(model, features_copy, target_copy,
+                                               [train_predict_slices[fold] for fold in remaining], n_jobs,
+                                               on_fold_done=(lambda i, alpha: on_fold_done(remaining[i], alpha))
+                                               if on_fold_done else None)
+        for fold, alpha in zip(remaining, predictions):
+            ml_alpha[fold] = alpha
 
     del features_copy, target_copy
     gc.collect()
@@ -166,8 +312,201 @@ def calc_ml_factor(model: ModelWrapper, features: pd.DataFrame, target: pd.Serie
     return pd.concat(ml_alpha)
 
 
+def _sorted(data, copy: bool):
+    """
+    sorts a frame or series by its index, data that is already sorted is copied or if copy is False shallow copied.
+    A shallow copy shares the memory and keeps the dtype of every column, with copy on write a change to it does not
+    reach the passed data
+    """
+    if not data.index.is_monotonic_increasing:
+        return data.sort_index()
+    return data.copy(deep=copy)
+
+
+def _contiguous(features: pd.DataFrame, dtype: str) -> pd.DataFrame:
+    """
+    casts the features to one column major array, row slices of the returned frame are views of each column
+    """
+    values = np.asfortranarray(features.to_numpy(dtype=dtype))
+    return pd.DataFrame(values, index=features.index, columns=features.columns, copy=False)
+
+
+def _as_dtype(features: pd.DataFrame, dtype: Optional[str]) -> pd.DataFrame:
+    """
+    casts the features to dtype if the dtype is set and any column has a different dtype
+    """
+    if dtype is None or (features.dtypes == np.dtype(dtype)).all():
+        return features
+    return features.astype(dtype)
+
+
+def _all_finite(data, rows: Optional[np.ndarray] = None) -> bool:
+    """
+    checks for nan and inf values a chunk of rows at a time so the check does not need a mask the size of data
+    :param rows: the positions of the rows to check, if None then every row is checked
+    """
+    if rows is not None:
+        return bool(np.isfinite(data.iloc[rows].to_numpy()).all())
+
+    for start in range(0, len(data), _VALIDATE_CHUNK_ROWS):
+        if not np.isfinite(data.iloc[start:start + _VALIDATE_CHUNK_ROWS].to_numpy()).all():
+            return False
+    return True
+
+
+# the features and target of a worker process, set by _init_worker
+_WORKER_DATA: Optional[Tuple[pd.DataFrame, pd.Series]] = None
+
+
+def _calc_folds_in_processes(model: ModelWrapper, features: pd.DataFrame, target: pd.Series,
+                             slices: List[Tuple[SliceHolder, SliceHolder]], n_jobs: int,
+                             on_fold_done: Optional[Callable[[int, pd.Series], None]] = None) -> List[pd.Series]:
+    """
+    fits the folds in a process pool, the predictions are returned in the order of slices.
+    the features, target and index are written to memory mapped files once, every process reads the same pages
+    rather than getting a pickled copy of the data
+    :param slices: positional slices from generate_indexes
+    :param on_fold_done: called with the position in slices and the predictions of each fold as the fold finishes
+    """
+    directory = tempfile.mkdtemp(prefix='calc_ml_factor_')
+    try:
+        paths = {'features': _write_memmap(directory, 'features', features.to_numpy()),
+                 'target': _write_memmap(directory, 'target', target.to_numpy())}
+        levels = []
+        for i, level in enumerate(features.index.levels):
+            paths[f'codes_{i}'] = _write_memmap(directory, f'codes_{i}', features.index.codes[i])
+            levels.append(level)
+
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(paths, levels, list(features.index.names), list(features.columns),
+                                           target.name)) as executor:
+            # the largest folds are sent first so a slow fold does not start last
+            by_size = sorted(range(len(slices)), key=lambda i: slices[i][0].end - slices[i][0].start, reverse=True)
+            futures = {executor.submit(_predict_worker_fold, model, *slices[i]): i for i in by_size}
+
+            ml_alpha: List[Optional[pd.Series]] = [None] * len(slices)
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                ml_alpha[futures[future]] = future.result()
+                if on_fold_done:
+                    on_fold_done(futures[future], ml_alpha[futures[future]])
+            return ml_alpha
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _write_memmap(directory: str, name: str, values: np.ndarray) -> str:
+    """
+    writes an array to a .npy file that can be memory mapped, column major arrays stay column major
+    :return: the path to the file
+    """
+    path = os.path.join(directory, f'{name}.npy')
+    np.save(path, values if values.flags.f_contiguous else np.ascontiguousarray(values))
+    return path
+
+
+def _init_worker(paths: dict, levels: List[pd.Index], names: List[str], columns: List, target_name) -> None:
+    """
+    memory maps the features and target in a worker process
+    """
+    global _WORKER_DATA
+    codes = [np.load(paths[f'codes_{i}'], mmap_mode='r') for i in range(len(levels))]
+    index = pd.MultiIndex(levels=levels, codes=codes, names=names, verify_integrity=False)
+
+    features = pd.DataFrame(np.load(paths['features'], mmap_mode='r'), index=index, columns=columns, copy=False)
+    target = pd.Series(np.load(paths['target'], mmap_mode='r'), index=index, name=target_name, copy=False)
+    _WORKER_DATA = (features, target)
+
+
+def _predict_worker_fold(model: ModelWrapper, train_slice: SliceHolder, predict_slice: SliceHolder) -> pd.Series:
+    """
+    fits one fold in a worker process on the memory mapped data
+    """
+    features, target = _WORKER_DATA
+    return _predict_fold(model, features, target, train_slice, predict_slice)
+
+
+def _predict_fold(model: ModelWrapper, features: pd.DataFrame, target: pd.Series, train_slice: SliceHolder,
+                  predict_slice: SliceHolder) -> pd.Series:
+    """
+    fits one fold, the slices are positional so the train and predict data are views of features and target
+    """
+    return model.predict(features.iloc[train_slice.start:train_slice.end],
+                         target.iloc[train_slice.start:train_slice.end],
+                         features.iloc[predict_slice.start:predict_slice.end])
+
+
+class _FoldCheckpoint:
+    """
+    Saves the predictions of each fold of calc_ml_factor to a parquet file so an interrupted run can be resumed.
+    Each run configuration gets its own directory, the dates a fold was trained and predicted on are kept in the
+    Arrow schema metadata so a fold is only loaded if it covers the same dates
+    """
+
+    # key in the Arrow schema metadata holding the dates of the fold
+    _FOLD_KEY = b'toolbox_fold'
+
+    def __init__(self, checkpoint_dir: str, model_id: str, **params):
+        """
+        :param checkpoint_dir: the directory to keep the checkpoints of every run in
+        :param model_id: identifies the model
+        :param params: the generate_indexes parameters and the feature dtypes of the run
+        """
+        run_hash = hashlib.sha224(json.dumps(params, sort_keys=True).encode()).hexdigest().upper()[:16]
+        self._directory = os.path.join(checkpoint_dir, f'{model_id}_{run_hash}')
+        os.makedirs(self._directory, exist_ok=True)
+
+        with open(os.path.join(self._directory, 'run.json'), 'w') as f:
+            json.dump({'model_id': model_id, **params}, f)
+
+    def load(self, fold: int, dates: pd.Index, train_slice: SliceHolder,
+             predict_slice: SliceHolder) -> Optional[pd.Series]:
+        """
+        :return: the saved predictions of the fold, None if the fold is not saved or was saved for other dates
+        """
+        path = self._path(fold)
+        if not os.path.isfile(path):
+            return None
+
+        table = pq.read_table(path)
+        saved = json.loads((table.schema.metadata or {}).get(self._FOLD_KEY, b'{}'))
+        if saved != self._fold_info(fold, dates, train_slice, predict_slice):
+            return None
+
+        predictions = table.to_pandas()['predictions']
+        predictions.name = None
+        return predictions
+
+    def save(self, fold: int, dates: pd.Index, train_slice: SliceHolder, predict_slice: SliceHolder,
+             predictions: pd.Series) -> None:
+        """
+        writes the predictions of a fold, the file is written under a temp name then moved so a crash while writing
+        does not leave a partial fold
+        """
+        table = pa.Table.from_pandas(predictions.to_frame('predictions'))
+        fold_info = json.dumps(self._fold_info(fold, dates, train_slice, predict_slice)).encode()
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), self._FOLD_KEY: fold_info})
+
+        path = self._path(fold)
+        pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def _path(self, fold: int) -> str:
+        return os.path.join(self._directory, f'fold_{fold:06d}.parquet')
+
+    @staticmethod
+    def _fold_info(fold: int, dates: pd.Index, train_slice: SliceHolder, predict_slice: SliceHolder) -> dict:
+        """
+        :return: the fold number, the first and last train and predict dates and the amount of predicted rows
+        """
+        return {'fold': fold,
+                'train_start': str(dates[train_slice.start]), 'train_end': str(dates[train_slice.end - 1]),
+                'predict_start': str(dates[predict_slice.start]), 'predict_end': str(dates[predict_slice.end - 1]),
+                'rows': predict_slice.end - predict_slice.start}
+
+
 def generate_indexes(data_index: pd.MultiIndex, eval_days: int, refit_every: int, expanding: int = None,
-                     rolling: int = None) -> Generator[Tuple[SliceHolder, SliceHolder], None, None]:
+                     rolling: int = None, positional: bool = False) -> \
+        Generator[Tuple[SliceHolder, SliceHolder], None, None]:
     """
     generates the slice index's for the training and predicting periods.
     function is designed to work with dates in level 0 however this is not enforced anywhere
@@ -183,11 +522,64 @@ def generate_indexes(data_index: pd.MultiIndex, eval_days: int, refit_every: int
         if this value is passed then the model will be trained with an expanding window of data
     :param rolling: the amount of rolling days to fit a model to
         if minTrainDays is passed then this should not be passed
+    :param positional: if True then the SliceHolders hold row offsets into data_index rather than dates.
+        The start is inclusive and the end is exclusive like a python slice. data_index must be sorted by date
     :return: a generator with each iteration containing a tuple of two SliceHolders of dates.
             Slice One: training indexes
             Slice Two: predicting indexes
     """
 
+    dates, train_start, train_end, predict_start, predict_end = \
+        _fold_days(data_index, eval_days, refit_every, expanding, rolling)
+
+    if positional:
+        date_offsets = _date_offsets(data_index, dates)
+        for fold in range(len(train_start)):
+            yield (SliceHolder(int(date_offsets[train_start[fold]]), int(date_offsets[train_end[fold] + 1])),
+                   SliceHolder(int(date_offsets[predict_start[fold]]), int(date_offsets[predict_end[fold] + 1])))
+    else:
+        for fold in range(len(train_start)):
+            yield (SliceHolder(dates[train_start[fold]], dates[train_end[fold]]),
+                   SliceHolder(dates[predict_start[fold]], dates[predict_end[fold]]))
+
+
+def fold_plan(data_index: pd.MultiIndex, eval_days: int, refit_every: int, expanding: int = None, rolling: int = None,
+              purge: int = 0, embargo: int = 0) -> pd.DataFrame:
+    """
+    plans every training and predicting fold at once, the plan has the same folds as generate_indexes.
+    lets callers see the amount of folds up front and schedule, parallelize or cache folds from the plan
+
+    :param data_index: MultiIndex of the data, must be sorted by date (level 0)
+    :param eval_days: see generate_indexes
+    :param refit_every: see generate_indexes
+    :param expanding: see generate_indexes
+    :param rolling: see generate_indexes
+    :param purge: the amount of days dropped from the end of each training window, the predicting windows do not move
+    :param embargo: the amount of days skipped between the end of the eval_days and the start of each predicting
+        window, the training windows do not move
+    :return: DataFrame with a row per fold and the columns
+        train_start, train_end, predict_start, predict_end: the first and last dates of each window, inclusive
+        train_start_row, train_stop_row, predict_start_row, predict_stop_row: the row offsets of each window into
+            data_index, the stop is exclusive like a python slice
+    """
+    dates, train_start, train_end, predict_start, predict_end = \
+        _fold_days(data_index, eval_days, refit_every, expanding, rolling, purge, embargo)
+    date_offsets = _date_offsets(data_index, dates)
+
+    return pd.DataFrame({'train_start': dates[train_start], 'train_end': dates[train_end],
+                         'predict_start': dates[predict_start], 'predict_end': dates[predict_end],
+                         'train_start_row': date_offsets[train_start], 'train_stop_row': date_offsets[train_end + 1],
+                         'predict_start_row': date_offsets[predict_start],
+                         'predict_stop_row': date_offsets[predict_end + 1]})
+
+
+def _fold_days(data_index: pd.MultiIndex, eval_days: int, refit_every: int, expanding: int = None,
+               rolling: int = None, purge: int = 0, embargo: int = 0) -> Tuple[np.ndarray, ...]:
+    """
+    finds the positions of the first and last days of the training and predicting windows of every fold.
+    all positions are inclusive
+    :return: the unique dates of data_index, train_start, train_end, predict_start, predict_end
+    """
     if (eval_days < 1) or (refit_every < 1):
         raise ValueError('eval_days and/or refit_every must be greater than zero')
     if rolling is not None and (rolling < 1):
@@ -198,27 +590,33 @@ def generate_indexes(data_index: pd.MultiIndex, eval_days: int, refit_every: int
         raise ValueError('minTrainDays or rollingDays must be defined')
     if bool(expanding) & bool(rolling):
         raise ValueError('minTrainDays and rollingDays can not both be defined')
+    if purge < 0 or embargo < 0:
+        raise ValueError('purge and embargo can not be negative')
 
     dates: np.array = data_index.get_level_values(0).drop_duplicates().to_numpy()
 
     start_place = expanding if expanding else rolling
-    # dont have to ceil this bc it wont matter with a < operator
-    amount_of_loops: float = (len(dates) - start_place - eval_days) / refit_every
-
-    i: int = 0
-    while i < amount_of_loops:
-        # .loc[] is inclusive in a slice, so everything here is inclusive
-        train_end_index: int = (i * refit_every) + (start_place - 1)
-        train_start_index: int = train_end_index - rolling + 1 if rolling else 0
-        train_slice: SliceHolder = SliceHolder(dates[train_start_index], dates[train_end_index])
-
-        predict_start_index: int = train_end_index + eval_days + 1
-        predict_end_index: int = predict_start_index + refit_every - 1
-        # accounting for when the ending predicted index is out of bounds on the last loop
-        if predict_end_index >= len(dates) - 1:
-            predict_end_index: int = len(dates) - 1
-
-        predict_slice: SliceHolder = SliceHolder(dates[predict_start_index], dates[predict_end_index])
-
-        i += 1
-        yield train_slice, predict_slice
+    if purge >= start_place:
+        raise ValueError('purge must be less than the amount of training days')
+
+    # the amount of folds where the predicting window starts inside the data
+    days_to_predict = len(dates) - start_place - eval_days - embargo
+    amount_of_folds = -(-days_to_predict // refit_every) if days_to_predict > 0 else 0
+
+    # the last day of each training window before purging, everything here is inclusive
+    window_end = np.arange(amount_of_folds) * refit_every + (start_place - 1)
+    train_end = window_end - purge
+    train_start = window_end - rolling + 1 if rolling else np.zeros(amount_of_folds, dtype=window_end.dtype)
+
+    predict_start = window_end + eval_days + embargo + 1
+    # accounting for when the ending predicted index is out of bounds on the last fold
+    predict_end = np.minimum(predict_start + refit_every - 1, len(dates) - 1)
+
+    return dates, train_start, train_end, predict_start, predict_end
+
+
+def _date_offsets(data_index: pd.MultiIndex, dates: np.ndarray) -> np.ndarray:
+    """
+    :return: the first row of each date in data_index, the last entry is one past the last row
+    """
+    return np.append(data_index.get_level_values(0).searchsorted(dates, 'left'), len(data_index))
@@ -1,8 +1,26 @@
-from typing import List
+import os
+import re
+from functools import partial
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple, Union
 
 import duckdb
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+from tqdm import tqdm
+
+from toolbox.utils.group_kernels import GroupIndex, MAD_TO_STD, RANK_METHODS, group_demean, group_factorize, \
+    group_ntile, group_rank, group_zscore, norm_ppf
+
+if TYPE_CHECKING:
+    # only needed for the annotations, query_constructor is not imported at runtime so utils stays light
+    import pyarrow.dataset
+    from toolbox.db.read.query_constructor import QueryConstructor
+
+# backend='auto' uses the numpy kernels for frames with at most this many cells and duckdb for larger frames
+# duckdb's partitioned median catches up with the numpy factorize sooner than its window ranks catch up with the
+# numpy ranks, see benchmarks/cross_sectional_backends.py
+NUMPY_BACKEND_MAX_CELLS = {'factorize': 1_000_000, 'rank': 10_000_000, 'ntile': 10_000_000}
 
 
 def calculate_ic(y_true: np.array, y_pred: np.array) -> float:
@@ -20,28 +38,52 @@ def calculate_ic(y_true: np.array, y_pred: np.array) -> float:
     return np.corrcoef(y_true, y_pred)[0][1]
 
 
-def factorize(df: pd.DataFrame, partition_by: List[str], exclude=None):
+def factorize(df: pd.DataFrame, partition_by: List[str], exclude=None, backend: str = 'auto',
+              winsorize: Optional[Tuple[float, float]] = None, scale: str = 'std', method: str = 'zscore'):
     """
     Factorizes each column of the given dataframe except for the partition_by columns and the exclude columns
     Will preserve indexes and period data types
 
-    Calculates the centered zscore
-
-    In future would like to winsorize at 2.5% and 97.5% percentiles but hard to do in sql
+    Calculates the centered zscore, the cleaning options all run in the same partitioned pass
 
     Won't rename the columns will overwrite them
 
     :param df: the dataframe we are factorizing
     :param partition_by: What to partition by for calculating median and std will normally be date and sector
     :param exclude: columns to exclude in the factorization process
+    :param backend: 'duckdb', 'numpy' or 'auto' to pick by the size of df
+    :param winsorize: (lower, upper) quantiles to clip each partition to before scaling, ex: (.025, .975)
+    :param scale: 'std' divides by the std, 'mad' divides by 1.4826 * the median absolute deviation
+    :param method: 'zscore' centers on the median then scales,
+        'rank_gauss' maps the ranks to a standard normal, ignores winsorize and scale
     """
     if exclude is None:
         exclude = []
+    if winsorize is not None and not (0 <= winsorize[0] < winsorize[1] <= 1):
+        raise ValueError('winsorize must be (lower, upper) quantiles with 0 <= lower < upper <= 1')
+    if scale not in ['std', 'mad']:
+        raise ValueError(f'scale must be "std" or "mad" not "{scale}"')
+    if method not in ['zscore', 'rank_gauss']:
+        raise ValueError(f'method must be "zscore" or "rank_gauss" not "{method}"')
+
+    cols = [col for col in df.columns if col not in partition_by + exclude]
+    if _use_numpy(df, backend, ['factorize']):
+        op = partial(group_factorize, winsorize=winsorize, scale=scale, method=method)
+        return _numpy_edits(df, partition_by, exclude, [(col, col, op) for col in cols])
+
+    factorized = _duck_db_edits(df, _factorize(df, partition_by, exclude, winsorize, scale, method))
+    if method == 'rank_gauss':
+        # duckdb has no inverse normal cdf, the query returns the scaled ranks
+        for col in cols:
+            factorized[col] = norm_ppf(factorized[col].to_numpy(dtype=np.float64, na_value=np.nan))
+    return factorized
 
-    return _duck_db_edits(df, _factorize(df, partition_by, exclude))
 
+def _factorize(df: pd.DataFrame, partition_by: List[str], exclude: List[str],
+               winsorize: Optional[Tuple[float, float]] = None, scale: str = 'std', method: str = 'zscore'):
+    if winsorize is not None or scale != 'std' or method != 'zscore':
+        return _robust_factorize(df, partition_by, exclude, winsorize, scale, method)
 
-def _factorize(df: pd.DataFrame, partition_by: List[str], exclude: List[str]):
     select = partition_by + exclude
     for col in set(df.columns) - set(partition_by) - set(exclude):
         select.append(
@@ -54,7 +96,48 @@ def _factorize(df: pd.DataFrame, partition_by: List[str], exclude: List[str]):
     return sql
 
 
-def rank(df: pd.DataFrame, partition_by: List[str], exclude=None, rank_type: str = 'percent_rank'):
+def _robust_factorize(df: pd.DataFrame, partition_by: List[str], exclude: List[str],
+                      winsorize: Optional[Tuple[float, float]], scale: str, method: str):
+    """
+    factorize with winsorizing, MAD scaling or rank gauss.
+    each step is a CTE over the same partition: clip to the quantiles, center on the median then scale.
+    rank gauss returns (average rank - 0.5) / count, the inverse normal cdf is applied after the query
+    """
+    keep = partition_by + exclude
+    cols = [col for col in df.columns if col not in keep]
+    window = f"WINDOW factorize_partition AS (PARTITION BY {', '.join(partition_by)})"
+
+    def step(exprs: List[str], source: str) -> str:
+        return f"SELECT {', '.join(keep + exprs)} FROM {source} {window}"
+
+    if method == 'rank_gauss':
+        ranked = [f'CASE WHEN {col} is NULL THEN NULL ELSE ((rank() OVER (factorize_partition ORDER BY {col}) + '
+                  f'cume_dist() OVER (factorize_partition ORDER BY {col}) * count(*) OVER factorize_partition) / 2 '
+                  f'- 0.5) / count({col}) OVER factorize_partition END AS {col}' for col in cols]
+        return f"{step(ranked, 'df')} ORDER BY {', '.join(partition_by)}"
+
+    clipped = cols
+    if winsorize is not None:
+        clipped = [f'CASE WHEN {col} is NULL THEN NULL ELSE '
+                   f'LEAST(GREATEST({col}, quantile_cont({col}, {winsorize[0]}) OVER factorize_partition), '
+                   f'quantile_cont({col}, {winsorize[1]}) OVER factorize_partition) END AS {col}' for col in cols]
+    centered = [f'{col} - median({col}) OVER factorize_partition AS {col}' for col in cols]
+    if scale == 'mad':
+        scaled = [f'{col} / NULLIF({MAD_TO_STD} * median(abs({col})) OVER factorize_partition, 0) AS {col}'
+                  for col in cols]
+    else:
+        scaled = [f'{col} / stddev({col}) OVER factorize_partition AS {col}' for col in cols]
+
+    sql = f"""WITH clipped AS ({step(clipped, 'df')}),
+                    centered AS ({step(centered, 'clipped')})
+                    {step(scaled, 'centered')}
+                    ORDER BY {', '.join(partition_by)}
+                    """
+    return sql
+
+
+def rank(df: pd.DataFrame, partition_by: List[str], exclude=None, rank_type: str = 'percent_rank',
+         backend: str = 'auto'):
     """
     Ranks each column of the given dataframe except for the partition_by columns and the exclude columns
     Will preserve indexes and period data types
@@ -64,10 +147,15 @@ def rank(df: pd.DataFrame, partition_by: List[str], exclude=None, rank_type: str
     :param partition_by: What to partition by for calculating rank will normally be date and sector
     :param exclude: columns to exclude in the ranking process
     :param rank_type: the type of rank we are performing
+    :param backend: 'duckdb', 'numpy' or 'auto' to pick by the size of df.
+        numpy supports the rank types percent_rank, rank, dense_rank and cume_dist, auto uses duckdb for the others
     """
     if exclude is None:
         exclude = []
 
+    if _use_numpy(df, backend if rank_type in RANK_METHODS or backend != 'auto' else 'duckdb', ['rank']):
+        cols = [col for col in df.columns if col not in partition_by + exclude]
+        return _numpy_edits(df, partition_by, exclude, [(col, col, rank_type) for col in cols])
     return _duck_db_edits(df, _rank(df, partition_by, exclude, rank_type))
 
 
@@ -84,7 +172,7 @@ def _rank(df: pd.DataFrame, partition_by: List[str], exclude: List[str], rank_ty
     return sql
 
 
-def ntile(df: pd.DataFrame, ntiles:int, partition_by: List[str], exclude=None):
+def ntile(df: pd.DataFrame, ntiles:int, partition_by: List[str], exclude=None, backend: str = 'auto'):
     """
     Ntiles each column of the given dataframe except for the partition_by columns and the exclude columns
     Will preserve indexes and period data types
@@ -93,10 +181,14 @@ def ntile(df: pd.DataFrame, ntiles:int, partition_by: List[str], exclude=None):
     :param df: the dataframe we are factorizing
     :param partition_by: What to partition by for calculating rank will normally be date and sector
     :param exclude: columns to exclude in the ranking process
+    :param backend: 'duckdb', 'numpy' or 'auto' to pick by the size of df
     """
     if exclude is None:
         exclude = []
 
+    if _use_numpy(df, backend, ['ntile']):
+        cols = [col for col in df.columns if col not in partition_by + exclude]
+        return _numpy_edits(df, partition_by, exclude, [(col, col, f'ntile{ntiles}') for col in cols])
     return _duck_db_edits(df, _ntile(df, ntiles, partition_by, exclude))
 
 
@@ -112,6 +204,269 @@ def _ntile(df, ntiles, partition_by, exclude):
     return sql
 
 
+# cross_sectional operations that are a rank function, value is the duckdb function
+_RANK_OPS = {'pct_rank': 'percent_rank', 'rank': 'rank', 'dense_rank': 'dense_rank', 'cume_dist': 'cume_dist'}
+# rank operations that give whole numbers, duckdb returns them as integers
+_INT_RANK_OPS = ['rank', 'dense_rank']
+# cross_sectional operations that are computed over the whole partition, value is the sql with {col} and {window}
+_PARTITION_OPS = {
+    'zscore': '({col} - avg({col}) OVER {window}) / stddev({col}) OVER {window}',
+    'factorize': '({col} - median({col}) OVER {window}) / stddev({col}) OVER {window}',
+    'demean': '{col} - avg({col}) OVER {window}',
+}
+
+
+def cross_sectional(df: pd.DataFrame, partition_by: List[str], ops: Dict[str, List[str]],
+                    backend: str = 'auto') -> pd.DataFrame:
+    """
+    Runs many cross sectional transforms of many columns in one pass.
+    Every transform shares one partition of the data rather than making a round trip to duckdb per transform.
+    Will preserve indexes and period data types
+
+    The operations are:
+        zscore: (x - mean) / std
+        factorize: (x - median) / std, the same as factorize
+        demean: x - mean
+        pct_rank, rank, dense_rank, cume_dist: the rank of x, nulls stay null, the same as rank
+        ntile{n}: the ntile of x with the highest values in ntile 1, ex: ntile5, the same as ntile
+
+    The output columns are named {col}_{op}, ex: ret_zscore.
+    The columns in ops are replaced by their transforms, the other columns are kept as is.
+
+    Example: cross_sectional(df, ['date'], {'ret': ['zscore', 'pct_rank'], 'size': ['ntile5']})
+
+    :param df: the dataframe we are transforming
+    :param partition_by: What to partition by for the transforms will normally be date and sector
+    :param ops: the column to transform mapped to a list of the operations to run on the column
+    :param backend: 'duckdb', 'numpy' or 'auto' to pick by the size of df
+    """
+    columns = list(df.columns) if isinstance(df.index, pd.RangeIndex) else list(df.index.names) + list(df.columns)
+    for col in ops:
+        if col not in columns:
+            raise ValueError(f'Column {col} is not in the dataframe')
+        if col in partition_by:
+            raise ValueError(f'Can not transform the partition_by column {col}')
+
+    # compiling the sql for both backends so unknown operations raise the same error
+    sql = _cross_sectional(columns, partition_by, ops)
+    if _use_numpy(df, backend, [_op_kind(op) for col_ops in ops.values() for op in col_ops]):
+        keep = [col for col in columns if col not in partition_by and col not in ops]
+        transforms = [(f'{col}_{op}', col, op) for col, col_ops in ops.items() for op in col_ops]
+        return _numpy_edits(df, partition_by, keep, transforms)
+    return _duck_db_edits(df, sql)
+
+
+def _cross_sectional(columns: List[str], partition_by: List[str], ops: Dict[str, List[str]], source: str = 'df',
+                     where: str = ''):
+    window = 'cross_sectional_partition'
+
+    select = partition_by + [col for col in columns if col not in partition_by and col not in ops]
+    for col, col_ops in ops.items():
+        for op in col_ops:
+            select.append(f'{_op_sql(col, op, window)} AS {col}_{op}')
+
+    sql = f"""SELECT {', '.join(select)}
+                    FROM {source}
+                    {'WHERE ' + where if where else ''}
+                    WINDOW {window} AS (PARTITION BY {', '.join(partition_by)})
+                    ORDER BY {', '.join(partition_by)}
+                    """
+    return sql
+
+
+def cross_sectional_to_parquet(source: Union[str, pa.Table, 'pyarrow.dataset.Dataset', 'QueryConstructor'],
+                               output_dir: str, partition_by: List[str], ops: Dict[str, List[str]],
+                               freq: str = 'Y', date_col: str = 'date', memory_limit: Optional[str] = None,
+                               temp_directory: Optional[str] = None) -> List[str]:
+    """
+    Runs cross_sectional out of core, the data is never fully loaded into pandas.
+    Each date partition is independent so the data is transformed one period of dates at a time and each period is
+    written straight to a parquet file by duckdb. duckdb spills to temp_directory when a period does not fit in
+    memory_limit
+
+    :param source: where to read the data from:
+        a path to a parquet file, a glob of parquet files or a directory of parquet files,
+        an Arrow table or dataset, only the dates of each period are scanned,
+        or a QueryConstructor, the query is streamed one period at a time with iter_dates
+    :param output_dir: the directory to write the parquet files to, one file per period
+    :param partition_by: What to partition by for the transforms, must contain date_col
+    :param ops: the column to transform mapped to a list of the operations, see cross_sectional
+    :param freq: the size of each period, any pandas period frequency ex: 'Y', 'Q', 'M'
+    :param date_col: the date column of the data
+    :param memory_limit: the max memory duckdb can use ex: '16GB', None uses the duckdb default
+    :param temp_directory: where duckdb spills to disk, None uses the duckdb default
+    :return: the paths of the written parquet files in date order
+    """
+    if date_col not in partition_by:
+        raise ValueError(f'partition_by must contain {date_col} so each period can be transformed on its own')
+
+    con = duckdb.connect()
+    if memory_limit is not None:
+        con.execute(f"SET memory_limit = '{memory_limit}'")
+    if temp_directory is not None:
+        con.execute(f"SET temp_directory = '{temp_directory}'")
+    os.makedirs(output_dir, exist_ok=True)
+
+    paths = []
+    try:
+        for i, where in enumerate(tqdm(_source_chunks(con, source, freq, date_col))):
+            columns = [row[0] for row in con.execute('DESCRIBE SELECT * FROM source').fetchall()]
+            for col in ops:
+                if col not in columns:
+                    raise ValueError(f'Column {col} is not in the dataframe')
+
+            path = os.path.join(output_dir, f'part-{i:05d}.parquet')
+            sql = _cross_sectional(columns, partition_by, ops, source='source', where=where)
+            con.execute(f"COPY ({sql}) TO '{path}' (FORMAT PARQUET)")
+            paths.append(path)
+    finally:
+        con.close()
+
+    return paths
+
+
+def _source_chunks(con: duckdb.DuckDBPyConnection, source, freq: str, date_col: str) -> Iterator[str]:
+    """
+    makes "source" on con hold one period of data at a time
+    :return: generator of the where clause that filters source to the period
+    """
+    # a QueryConstructor streams each period into memory
+    if hasattr(source, 'iter_dates'):
+        for table in source.iter_dates(freq=freq, as_arrow=True):
+            con.register('source', table)
+            yield ''
+            con.unregister('source')
+        return
+
+    if isinstance(source, str):
+        path = os.path.join(source, '**', '*.parquet') if os.path.isdir(source) else source
+        con.execute(f"CREATE OR REPLACE VIEW source AS SELECT * FROM read_parquet('{path}')")
+    else:
+        con.register('source', source)
+
+    # the first and last date of each period, cast to text and back so the bounds keep the type of the column
+    date_type = {row[0]: row[1] for row in con.execute('DESCRIBE SELECT * FROM source').fetchall()}[date_col]
+    dates = pd.Series([row[0] for row in con.execute(
+        f'SELECT DISTINCT CAST({date_col} AS VARCHAR) FROM source WHERE {date_col} IS NOT NULL ORDER BY 1').fetchall()])
+    if not len(dates):
+        return
+
+    periods = pd.DatetimeIndex(pd.to_datetime(dates, utc=True)).tz_convert(None).to_period(freq)
+    for _, period_dates in dates.groupby(periods.asi8, sort=True):
+        yield (f"{date_col} >= CAST('{period_dates.iloc[0]}' AS {date_type}) AND "
+               f"{date_col} <= CAST('{period_dates.iloc[-1]}' AS {date_type})")
+
+
+def _op_sql(col: str, op: str, window: str) -> str:
+    """
+    :return: the sql for one cross_sectional operation on col over the named window
+    """
+    if op in _PARTITION_OPS:
+        return _PARTITION_OPS[op].format(col=col, window=window)
+    if op in _RANK_OPS:
+        return f'CASE WHEN {col} is NULL THEN NULL ELSE {_RANK_OPS[op]}() OVER ({window} ORDER BY {col}) END'
+
+    ntiles = re.fullmatch(r'ntile(\d+)', op)
+    if ntiles and int(ntiles.group(1)) > 0:
+        return f'NTILE({ntiles.group(1)}) OVER ({window} ORDER BY {col} DESC)'
+
+    raise ValueError(f'Operation {op} is not recognised. Valid operations are '
+                     f'{list(_PARTITION_OPS) + list(_RANK_OPS) + ["ntile{n}"]}')
+
+
+def _op_kind(op: str) -> str:
+    """
+    :return: the key of NUMPY_BACKEND_MAX_CELLS for a cross_sectional operation
+    """
+    if op in _PARTITION_OPS:
+        return 'factorize'
+    return 'rank' if op in _RANK_OPS else 'ntile'
+
+
+def _use_numpy(df: pd.DataFrame, backend: str, kinds: List[str]) -> bool:
+    """
+    :param kinds: the keys of NUMPY_BACKEND_MAX_CELLS for the operations being run, auto uses the lowest limit
+    :return: True if the numpy kernels should be used rather than duckdb
+    """
+    if backend not in ['duckdb', 'numpy', 'auto']:
+        raise ValueError(f'backend must be "duckdb", "numpy" or "auto" not "{backend}"')
+    max_cells = min(NUMPY_BACKEND_MAX_CELLS[kind] for kind in kinds) if kinds else 0
+    return backend == 'numpy' or (backend == 'auto' and df.size <= max_cells)
+
+
+def _numpy_edits(df: pd.DataFrame, partition_by: List[str], keep: List[str],
+                 transforms: List[Tuple[str, str, str]]) -> pd.DataFrame:
+    """
+    the numpy backend of the cross sectional utils, has the same output and dtypes as _duck_db_edits.
+    the partitions are found once and each operation runs on every column it is applied to at once
+    :param partition_by: the columns to partition by, kept in the output
+    :param keep: the other columns to keep as is
+    :param transforms: (output column, input column, operation) the operations are the cross_sectional operations,
+        the rank types of RANK_METHODS or a kernel from group_kernels
+    """
+    index_cols = None
+    if not isinstance(df.index, pd.RangeIndex):
+        index_cols = df.index.names
+        df = df.reset_index()
+
+    groups = df.groupby(partition_by, sort=True, dropna=False).ngroup().to_numpy()
+    # sorting by the partition like the ORDER BY of the sql
+    order = np.argsort(groups, kind='stable')
+    df = df.iloc[order].reset_index(drop=True)
+    index = GroupIndex(groups[order])
+
+    out = df[partition_by + keep].copy()
+    by_op: Dict[str, List[Tuple[str, str]]] = {}
+    for out_col, col, op in transforms:
+        by_op.setdefault(op, []).append((out_col, col))
+
+    for op, cols in by_op.items():
+        values = np.asfortranarray(df[[col for _, col in cols]].to_numpy(dtype=np.float64))
+        transformed = _numpy_op(values, index, op)
+        for i, (out_col, _) in enumerate(cols):
+            # duckdb gives rank and dense_rank as BIGINT, nullable when a value is null
+            out[out_col] = _as_int(transformed[:, i]) if op in _INT_RANK_OPS else transformed[:, i]
+
+    # duckdb reads periods as timestamps, _duck_db_edits turns them back into daily periods
+    for col in out.columns:
+        if isinstance(out[col].dtype, pd.PeriodDtype):
+            out[col] = out[col].dt.to_timestamp().dt.to_period('D')
+
+    return out.set_index(index_cols) if index_cols else out
+
+
+def _as_int(values: np.ndarray) -> Union[np.ndarray, pd.api.extensions.ExtensionArray]:
+    """
+    :return: float ranks as int64, or as Int64 if any are nan
+    """
+    if np.isnan(values).any():
+        return pd.array(values, dtype='Int64')
+    return values.astype(np.int64)
+
+
+def _numpy_op(values: np.ndarray, index: GroupIndex, op: str) -> np.ndarray:
+    """
+    :return: one cross_sectional operation or rank type on every column of values
+        op can also be a kernel taking values and index
+    """
+    if callable(op):
+        return op(values, index)
+    if op == 'zscore':
+        return group_zscore(values, index, 'mean')
+    if op == 'factorize':
+        return group_zscore(values, index, 'median')
+    if op == 'demean':
+        return group_demean(values, index)
+    if op in _RANK_OPS or op in RANK_METHODS:
+        return group_rank(values, index, _RANK_OPS.get(op, op))
+
+    ntiles = re.fullmatch(r'ntile(\d+)', op)
+    if ntiles and int(ntiles.group(1)) > 0:
+        return group_ntile(values, index, int(ntiles.group(1))).astype(np.int64)
+
+    raise ValueError(f'Operation {op} is not supported by the numpy backend')
+
+
 def _duck_db_edits(df, sql):
     index_cols = None
     if not isinstance(df.index, pd.RangeIndex):